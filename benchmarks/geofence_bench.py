@@ -0,0 +1,60 @@
+# benchmarks/geofence_bench.py
+"""
+Benchmark of server.geofence.GeofenceEngine: N trackers x M zones at 1 Hz.
+
+Run from the project root:
+    python -m benchmarks.geofence_bench [--trackers 10000] [--zones 1000] [--ticks 5]
+"""
+import argparse
+import time
+import numpy as np
+
+from server.models import WebUIMapInfo, WebUIMapEntity
+from server.geofence import GeofenceEngine
+
+
+def make_zones(num_zones: int, size: float, seed: int = 0) -> WebUIMapInfo:
+    """Random hexagonal zones of 3-15 m radius."""
+    rng = np.random.default_rng(seed)
+    entities = []
+    angles = np.linspace(0, 2 * np.pi, 6, endpoint=False)
+    for i in range(num_zones):
+        cx, cy = rng.uniform(0, size, 2)
+        radius = rng.uniform(3, 15)
+        points = np.stack([cx + radius * np.cos(angles), cy + radius * np.sin(angles)], axis=1)
+        entities.append(WebUIMapEntity(type="polyline", points=points.tolist(), closed=True, geofence=True, name=f"zone{i}"))
+    return WebUIMapInfo(width=size, height=size, entities=entities)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trackers", type=int, default=10000)
+    parser.add_argument("--zones", type=int, default=1000)
+    parser.add_argument("--size", type=float, default=1000.0, help="Map width/height in meters")
+    parser.add_argument("--ticks", type=int, default=5, help="Number of 1 Hz position rounds")
+    parser.add_argument("--cell-size", type=float, default=2.0)
+    args = parser.parse_args()
+
+    engine = GeofenceEngine(hysteresis_meters=0.5, dwell_seconds=2.0, cell_size=args.cell_size)
+    start = time.perf_counter()
+    engine.set_zones(make_zones(args.zones, args.size))
+    print(f"{'build zone grid':<32} {(time.perf_counter() - start) * 1e3:>10.1f} ms ({args.zones} zones)")
+
+    rng = np.random.default_rng(1)
+    positions = rng.uniform(0, args.size, (args.trackers, 2))
+    tracker_ids = [f"t{i}" for i in range(args.trackers)]
+    total_events = 0
+    for tick in range(args.ticks):
+        positions += rng.normal(0, 1.0, positions.shape) # ~1 m/s random walk
+        coords = positions.tolist()
+        start = time.perf_counter()
+        for tracker_id, (x, y) in zip(tracker_ids, coords):
+            total_events += len(engine.update(tracker_id, x, y, tick * 1000))
+        elapsed = time.perf_counter() - start
+        print(f"tick {tick}: {elapsed * 1e3:>10.1f} ms for {args.trackers} updates "
+              f"({elapsed / args.trackers * 1e6:.1f} us/update, {elapsed * 100:.1f}% of a 1 s budget)")
+    print(f"events emitted: {total_events}")
+
+
+if __name__ == "__main__":
+    main()
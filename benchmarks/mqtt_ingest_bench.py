@@ -0,0 +1,186 @@
+# benchmarks/mqtt_ingest_bench.py
+"""
+Benchmark of MQTT ingest: paho's network thread vs. the asyncio-driven client (server.mqtt_asyncio).
+
+A minimal MQTT 3.1.1 broker in a child process streams SenseCAP-style PUBLISH
+packets (QoS 0) at a fixed rate; the client parses each one and hands it to a
+coroutine on the event loop, as server.main.on_message does. Reported per mode:
+throughput, broker-send -> coroutine latency percentiles and client CPU time.
+
+Run from the project root:
+    python -m benchmarks.mqtt_ingest_bench [--messages 50000] [--rate 5000] [--modes thread,asyncio]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import struct
+import time
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from server.mqtt_asyncio import AsyncioMqttConnection
+
+TOPIC = "/device_sensor_data/bench/{eui}/1/vs/5002"
+
+
+# --- Fake broker ---
+def _remaining_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+def _publish_packet(topic: str, payload: bytes) -> bytes:
+    topic_bytes = topic.encode()
+    body = struct.pack("!H", len(topic_bytes)) + topic_bytes + payload
+    return b"\x30" + _remaining_length(len(body)) + body
+
+async def _read_packet(reader: asyncio.StreamReader):
+    header = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return header, await reader.readexactly(length)
+
+async def _stream(writer: asyncio.StreamWriter, messages: int, rate: float, trackers: int, beacons: int):
+    try:
+        await _send_publishes(writer, messages, rate, trackers, beacons)
+    except ConnectionError:
+        pass # Client disconnected
+
+async def _send_publishes(writer: asyncio.StreamWriter, messages: int, rate: float, trackers: int, beacons: int):
+    start = time.monotonic()
+    for i in range(messages):
+        payload = json.dumps({
+            "value": [{"mac": f"C3:00:00:00:{b // 256:02X}:{b % 256:02X}", "rssi": str(-50 - b)} for b in range(beacons)],
+            "timestamp": int(time.time() * 1000),
+            "sentNs": time.monotonic_ns(),
+        }).encode()
+        writer.write(_publish_packet(TOPIC.format(eui=f"EUI{i % trackers:05d}"), payload))
+        if rate > 0:
+            ahead = start + (i + 1) / rate - time.monotonic()
+            if ahead > 0.001:
+                await writer.drain()
+                await asyncio.sleep(ahead)
+        elif i % 256 == 0:
+            await writer.drain()
+    await writer.drain()
+
+async def _serve(port_queue, messages: int, rate: float, trackers: int, beacons: int):
+    async def client(reader, writer):
+        try:
+            while True:
+                header, body = await _read_packet(reader)
+                kind = header & 0xF0
+                if kind == 0x10: # CONNECT
+                    writer.write(b"\x20\x02\x00\x00")
+                elif kind == 0x80: # SUBSCRIBE
+                    writer.write(b"\x90\x03" + body[:2] + b"\x00")
+                    await writer.drain()
+                    asyncio.ensure_future(_stream(writer, messages, rate, trackers, beacons))
+                elif kind == 0xC0: # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif kind == 0xE0: # DISCONNECT
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+    server = await asyncio.start_server(client, "127.0.0.1", 0)
+    port_queue.put(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+def run_broker(port_queue, messages: int, rate: float, trackers: int, beacons: int):
+    asyncio.run(_serve(port_queue, messages, rate, trackers, beacons))
+
+
+# --- Client side ---
+async def run_client(mode: str, port: int, messages: int) -> dict:
+    loop = asyncio.get_running_loop()
+    latencies = np.zeros(messages, dtype=np.int64)
+    received = 0
+    done = asyncio.Event()
+
+    async def process(sent_ns: int):
+        nonlocal received
+        latencies[received] = time.monotonic_ns() - sent_ns
+        received += 1
+        if received == messages:
+            done.set()
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe("/device_sensor_data/bench/+/+/+/+")
+
+    def on_message(client, userdata, msg):
+        parts = msg.topic.split("/")
+        if len(parts) < 7 or parts[6] != "5002":
+            return
+        data = json.loads(msg.payload.decode("utf-8"))
+        if mode == "asyncio":
+            loop.create_task(process(data["sentNs"]))
+        else:
+            asyncio.run_coroutine_threadsafe(process(data["sentNs"]), loop)
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    if mode == "asyncio":
+        connection = AsyncioMqttConnection(client, loop)
+        connection.start("127.0.0.1", port)
+    else:
+        client.connect_async("127.0.0.1", port)
+        client.loop_start()
+    await asyncio.wait_for(done.wait(), timeout=max(60.0, messages / 1000))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    if mode == "asyncio":
+        connection.stop()
+    else:
+        client.loop_stop()
+        client.disconnect()
+    latency_ms = latencies / 1e6
+    return {
+        "mode": mode,
+        "msgPerSec": messages / elapsed,
+        "p50Ms": float(np.percentile(latency_ms, 50)),
+        "p99Ms": float(np.percentile(latency_ms, 99)),
+        "maxMs": float(latency_ms.max()),
+        "cpuSeconds": cpu,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--rate", type=float, default=5000.0, help="Messages per second sent by the broker (0 = as fast as possible)")
+    parser.add_argument("--trackers", type=int, default=1000)
+    parser.add_argument("--beacons", type=int, default=8, help="Beacons per report")
+    parser.add_argument("--modes", default="thread,asyncio")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    for mode in args.modes.split(","):
+        port_queue = context.Queue()
+        broker = context.Process(target=run_broker, args=(port_queue, args.messages, args.rate, args.trackers, args.beacons), daemon=True)
+        broker.start()
+        try:
+            result = asyncio.run(run_client(mode, port_queue.get(timeout=10), args.messages))
+        finally:
+            broker.terminate()
+            broker.join()
+        print(f"{result['mode']:>8}: {result['msgPerSec']:9.0f} msg/s  latency p50 {result['p50Ms']:7.2f} ms  "
+              f"p99 {result['p99Ms']:7.2f} ms  max {result['maxMs']:7.2f} ms  client CPU {result['cpuSeconds']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
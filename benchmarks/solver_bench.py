@@ -0,0 +1,261 @@
+# benchmarks/solver_bench.py
+"""
+Solver accuracy vs. latency on reproducible synthetic scenes, with a regression check.
+
+Scenes (positions uniform over the map, seeded):
+    config2       the beacon layout of test/config2.json (4 beacons)
+    map1-grid     test/map1.json's map with a beacon every --grid-spacing meters
+    config2-rest  config2 with resting tags: the positions are REST_REPORTS reports each at
+                  samples / REST_REPORTS spots (what the solve memo is for)
+RSSI follows the log-distance model of the scene (txPower, signalPropagationFactor)
+with Gaussian shadowing of --noise-db. Every solver path of server.positioning
+solves the same reports; per scene and path the error RMSE, p95 error, failure
+rate, share of solves that fell back to scipy and mean microseconds per solve
+(ranging included) are reported.
+
+Paths:
+    lm         calculate_position_result, cold start from the beacon centroid
+    lm-warm    the same, warm-started from the truth + 0.5 m noise (as from a filter prediction)
+    lm-memo    lm-warm through a SolveMemo (SolveMemoParams defaults): a report whose key matches an
+               earlier one gets that report's fix
+    lm-select  with GDOP beacon subset selection enabled (other BeaconSelectionParams defaults)
+    lm-cheap   the severe-overload settings of server.load_shedding.cheap_solver_params
+    scipy      scipy's Levenberg-Marquardt (multilateration_least_squares, the fallback path)
+    batch      calculate_positions_batch, vectorized over all reports of the scene
+
+The results are compared with a baseline (--baseline); the exit status is 1 if
+an error metric got worse by more than --accuracy-tolerance (relative), the
+failure or scipy fallback rate by more than 0.01, or the time per solve by more than
+--time-tolerance (relative; --no-time-check on noisy machines). Write a new
+baseline with --update-baseline.
+
+Run from the project root:
+    python -m benchmarks.solver_bench [--samples 2000] [--noise-db 3] [--paths lm,lm-warm,batch] [--update-baseline]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from server import positioning
+from server.diagnostics import positioning_counters
+from server.load_shedding import cheap_solver_params
+from server.models import BeaconSelectionParams, DetectedBeacon, MiniprogramConfig, SolveMemoParams, SolverParams
+from server.solve_memo import SolveMemo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "solver_baseline.json")
+PATHS = ("lm", "lm-warm", "lm-memo", "lm-select", "lm-cheap", "scipy", "batch")
+WARM_START_NOISE = 0.5 # Meters
+WARMUP_SOLVES = 50
+REST_REPORTS = 40 # Reports per spot in the config2-rest scene
+
+
+# --- Scenes ---
+def _load(name: str) -> dict:
+    with open(os.path.join(ROOT, "test", name), encoding="utf-8") as f:
+        return json.load(f)
+
+def _with_macs(config: MiniprogramConfig) -> MiniprogramConfig:
+    """Synthetic MACs (the test configs leave them empty)."""
+    beacons = [b.model_copy(update={"macAddress": f"C3:00:00:00:{i >> 8:02X}:{i & 0xFF:02X}"}) for i, b in enumerate(config.beacons)]
+    return config.model_copy(update={"beacons": beacons})
+
+def scene_config2() -> MiniprogramConfig:
+    return _with_macs(MiniprogramConfig(**_load("config2.json")))
+
+def scene_map1_grid(spacing: float) -> MiniprogramConfig:
+    data = _load("map1.json")
+    width, height = data["map"]["width"], data["map"]["height"]
+    data["beacons"] = [{"macAddress": "", "txPower": -59, "x": float(x), "y": float(y)}
+                       for x in np.arange(spacing / 4, width, spacing) for y in np.arange(spacing / 4, height, spacing)]
+    return _with_macs(MiniprogramConfig(**data))
+
+def make_reports(config: MiniprogramConfig, samples: int, noise_db: float, seed: int,
+                 spots: int = 0) -> Tuple[np.ndarray, List[List[DetectedBeacon]]]:
+    """Ground truth positions (samples, 2) and the reports a tracker there would send; with spots, drawn from that many fixed spots."""
+    rng = np.random.default_rng(seed)
+    truth = rng.uniform((0.0, 0.0), (config.map.width, config.map.height), (spots or samples, 2))
+    if spots:
+        truth = truth[rng.integers(0, spots, samples)]
+    coords = np.array([(b.x, b.y) for b in config.beacons])
+    tx_power = np.array([b.txPower for b in config.beacons], dtype=float)
+    n = config.settings.signalPropagationFactor
+    distances = np.maximum(np.hypot(*(truth[:, None, :] - coords).transpose(2, 0, 1)), 0.1)
+    rssi = np.rint(tx_power - 10 * n * np.log10(distances) + rng.normal(0.0, noise_db, distances.shape)).astype(int)
+    macs = [b.macAddress for b in config.beacons]
+    return truth, [[DetectedBeacon(macAddress=mac, rssi=int(r)) for mac, r in zip(macs, row)] for row in rssi]
+
+
+# --- Solver paths ---
+Solve = Callable[[int], Optional[Tuple[float, float]]]
+
+def _ranges(config: MiniprogramConfig, beacons: List[DetectedBeacon]) -> List[Tuple[float, float, float]]:
+    by_mac = {b.macAddress: b for b in config.beacons}
+    n = config.settings.signalPropagationFactor
+    out = []
+    for detected in beacons:
+        beacon = by_mac[detected.macAddress]
+        distance = positioning.calculate_distance(detected.rssi, beacon.txPower, n)
+        if 0.1 < distance < 100:
+            out.append((beacon.x, beacon.y, distance))
+    return out
+
+def path_solvers(config: MiniprogramConfig, truth: np.ndarray, reports: List[List[DetectedBeacon]], seed: int) -> Dict[str, Solve]:
+    """Per-report solve functions of every path except batch."""
+    by_mac = {b.macAddress.lower(): b for b in config.beacons}
+    no_selection = BeaconSelectionParams(enabled=False)
+    cheap_solver, cheap_selection = cheap_solver_params(SolverParams(), BeaconSelectionParams())
+    guesses = truth + np.random.default_rng(seed + 1).normal(0.0, WARM_START_NOISE, truth.shape)
+
+    def result_position(result):
+        return result.position if result else None
+
+    def lm(i, guess=None, selection=no_selection, solver=None):
+        return result_position(positioning.calculate_position_result(
+            reports[i], config, initial_guess=guess, beacon_selection=selection, solver=solver, beacons_by_mac=by_mac))
+
+    memo_params = SolveMemoParams()
+    memo = SolveMemo(memo_params.maxEntries, memo_params.rssiStepDb, memo_params.startCellMeters)
+
+    def lm_memo(i):
+        guess = (float(guesses[i, 0]), float(guesses[i, 1]))
+        key = memo.key("", reports[i], guess)
+        result = memo.get(key)
+        if result is None:
+            result = positioning.calculate_position_result(
+                reports[i], config, initial_guess=guess, beacon_selection=no_selection, beacons_by_mac=by_mac)
+            memo.put(key, result, 0.0)
+        return result_position(result)
+
+    return {
+        "lm": lambda i: lm(i),
+        "lm-warm": lambda i: lm(i, guess=(float(guesses[i, 0]), float(guesses[i, 1]))),
+        "lm-memo": lm_memo,
+        "lm-select": lambda i: lm(i, selection=BeaconSelectionParams(enabled=True)),
+        "lm-cheap": lambda i: lm(i, selection=cheap_selection, solver=cheap_solver),
+        "scipy": lambda i: positioning.multilateration_least_squares(_ranges(config, reports[i])),
+    }
+
+def run_path(name: str, config: MiniprogramConfig, truth: np.ndarray, reports: List[List[DetectedBeacon]],
+             solvers: Dict[str, Solve]) -> dict:
+    positions = np.full((len(reports), 2), np.nan)
+    fallbacks = positioning_counters.snapshot().get("solver_fallbacks", 0)
+    if name == "batch":
+        table = positioning.BeaconTable(config)
+        positioning.calculate_positions_batch(reports[:WARMUP_SOLVES], config, BeaconSelectionParams(enabled=False), table=table)
+        started = time.perf_counter()
+        results = positioning.calculate_positions_batch(reports, config, BeaconSelectionParams(enabled=False), table=table)
+        elapsed = time.perf_counter() - started
+        for i, result in enumerate(results):
+            if result:
+                positions[i] = result.position
+    else:
+        solve = solvers[name]
+        for i in range(min(WARMUP_SOLVES, len(reports))):
+            solve(i)
+        started = time.perf_counter()
+        for i in range(len(reports)):
+            position = solve(i)
+            if position is not None:
+                positions[i] = position
+        elapsed = time.perf_counter() - started
+    fallbacks = positioning_counters.snapshot().get("solver_fallbacks", 0) - fallbacks # Warmup included
+    solved = np.isfinite(positions[:, 0])
+    errors = np.hypot(*(positions[solved] - truth[solved]).T)
+    return {
+        "rmse": round(float(np.sqrt(np.mean(errors ** 2))), 4) if len(errors) else None,
+        "p95": round(float(np.percentile(errors, 95)), 4) if len(errors) else None,
+        "failureRate": round(1.0 - float(solved.mean()), 4),
+        "fallbackRate": round(fallbacks / (len(reports) + min(WARMUP_SOLVES, len(reports))), 4),
+        "usPerSolve": round(elapsed / len(reports) * 1e6, 2),
+    }
+
+
+# --- Regression check ---
+def regressions(results: dict, baseline: dict, accuracy_tolerance: float, time_tolerance: Optional[float]) -> List[str]:
+    found = []
+    for scene, paths in results["scenes"].items():
+        for path, metrics in paths.items():
+            reference = baseline.get("scenes", {}).get(scene, {}).get(path)
+            if reference is None:
+                continue
+            for key in ("rmse", "p95"):
+                if reference[key] is not None and metrics[key] is not None and metrics[key] > reference[key] * (1 + accuracy_tolerance):
+                    found.append(f"{scene}/{path}: {key} {metrics[key]} m > baseline {reference[key]} m")
+            for key in ("failureRate", "fallbackRate"):
+                if metrics[key] > reference[key] + 0.01:
+                    found.append(f"{scene}/{path}: {key} {metrics[key]} > baseline {reference[key]}")
+            if time_tolerance is not None and metrics["usPerSolve"] > reference["usPerSolve"] * (1 + time_tolerance):
+                found.append(f"{scene}/{path}: {metrics['usPerSolve']} us/solve > baseline {reference['usPerSolve']} us/solve")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=2000, help="Reports per scene")
+    parser.add_argument("--noise-db", type=float, default=3.0, help="RSSI shadowing standard deviation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--grid-spacing", type=float, default=2.0, help="Beacon spacing of the map1-grid scene (meters)")
+    parser.add_argument("--paths", default=",".join(PATHS), help=f"Comma-separated subset of {','.join(PATHS)}")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline instead of checking")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.05, help="Allowed relative increase of RMSE / p95 error")
+    parser.add_argument("--time-tolerance", type=float, default=1.0, help="Allowed relative increase of us/solve")
+    parser.add_argument("--no-time-check", action="store_true", help="Do not fail on timing (e.g. on shared CI machines)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    paths = [p for p in args.paths.split(",") if p]
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        parser.error(f"unknown paths: {', '.join(sorted(unknown))}")
+    logging.getLogger("server").setLevel(logging.ERROR) # Per-beacon rejections (e.g. implausibly close) show up as errors / failures
+    positioning._get_least_squares() # Import scipy before anything is timed
+    scenes = {"config2": (scene_config2(), 0), "map1-grid": (scene_map1_grid(args.grid_spacing), 0),
+              "config2-rest": (scene_config2(), max(1, args.samples // REST_REPORTS))}
+    params = {"samples": args.samples, "noiseDb": args.noise_db, "seed": args.seed, "gridSpacing": args.grid_spacing}
+    results = {"params": params, "scenes": {}}
+
+    print(f"{'scene':<12} {'path':<10} {'beacons':>7} {'rmse m':>8} {'p95 m':>8} {'failed':>7} {'scipy':>7} {'us/solve':>9}")
+    for scene, (config, spots) in scenes.items():
+        truth, reports = make_reports(config, args.samples, args.noise_db, args.seed, spots)
+        solvers = path_solvers(config, truth, reports, args.seed)
+        results["scenes"][scene] = {}
+        for path in paths:
+            metrics = results["scenes"][scene][path] = run_path(path, config, truth, reports, solvers)
+            print(f"{scene:<12} {path:<10} {len(config.beacons):>7} {metrics['rmse'] or float('nan'):>8.3f} "
+                  f"{metrics['p95'] or float('nan'):>8.3f} {metrics['failureRate']:>7.1%} {metrics['fallbackRate']:>7.1%} {metrics['usPerSolve']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --update-baseline to create one")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("params") != params:
+        print(f"baseline was recorded with {baseline.get('params')}; not comparable, skipping the regression check")
+        return
+    found = regressions(results, baseline, args.accuracy_tolerance, None if args.no_time_check else args.time_tolerance)
+    for line in found:
+        print(f"REGRESSION {line}")
+    if found:
+        sys.exit(1)
+    print("no regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
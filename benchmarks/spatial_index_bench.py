@@ -0,0 +1,85 @@
+# benchmarks/spatial_index_bench.py
+"""
+Benchmark of server.spatial_index.SpatialIndex on a synthetic 10k-entity map.
+
+Run from the project root:
+    python -m benchmarks.spatial_index_bench [--entities 10000] [--beacons 10000]
+"""
+import argparse
+import time
+import numpy as np
+
+from server.models import WebUIConfig, WebUIMapInfo, WebUIMapEntity, WebUIBeaconConfig, WebUISettings
+from server.spatial_index import SpatialIndex
+
+
+def make_config(num_entities: int, num_beacons: int, size: float, seed: int = 0) -> WebUIConfig:
+    """Random walls (2-point polylines) and rooms (closed rectangles) plus randomly placed beacons."""
+    rng = np.random.default_rng(seed)
+    entities = []
+    for i in range(num_entities):
+        x, y = rng.uniform(0, size, 2)
+        if i % 4 == 0: # Every 4th entity is a closed room
+            w, h = rng.uniform(2, 8, 2)
+            points = [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]
+            entities.append(WebUIMapEntity(type="polyline", points=points, closed=True))
+        else:
+            dx, dy = rng.uniform(-5, 5, 2)
+            entities.append(WebUIMapEntity(type="polyline", points=[[x, y], [x + dx, y + dy]]))
+    beacons = [
+        WebUIBeaconConfig(uuid=f"bench-{i}", major=1, minor=i, x=float(bx), y=float(by), txPower=-59)
+        for i, (bx, by) in enumerate(rng.uniform(0, size, (num_beacons, 2)))
+    ]
+    return WebUIConfig(map=WebUIMapInfo(width=size, height=size, entities=entities), beacons=beacons, settings=WebUISettings())
+
+
+def timed(label: str, fn, repeat: int):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    per_call_us = (time.perf_counter() - start) / repeat * 1e6
+    print(f"{label:<40} {per_call_us:>12.1f} us/call")
+    return per_call_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entities", type=int, default=10000)
+    parser.add_argument("--beacons", type=int, default=10000)
+    parser.add_argument("--size", type=float, default=500.0, help="Map width/height in meters")
+    parser.add_argument("--cell-size", type=float, default=2.0)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    config = make_config(args.entities, args.beacons, args.size)
+    rng = np.random.default_rng(1)
+    points = rng.uniform(0, args.size, (args.queries, 2))
+
+    start = time.perf_counter()
+    index = SpatialIndex.from_config(config, cell_size=args.cell_size)
+    print(f"{'build':<40} {(time.perf_counter() - start) * 1e3:>12.1f} ms "
+          f"({args.entities} entities, {args.beacons} beacons)")
+
+    # Incremental update: move 1% of the entities
+    changed = config.model_copy(deep=True)
+    for entity in changed.map.entities[:: 100]:
+        entity.points = [[p[0] + 1.0, p[1]] for p in entity.points]
+    start = time.perf_counter()
+    added, removed = index.update_from_config(changed)
+    print(f"{'incremental update (1% moved)':<40} {(time.perf_counter() - start) * 1e3:>12.1f} ms "
+          f"(+{added} / -{removed})")
+
+    timed("nearest_beacons k=4", lambda i: index.nearest_beacons(*points[i], k=4), args.queries)
+    timed("beacons_in_rect 20x20 m", lambda i: index.beacons_in_rect(*points[i], *(points[i] + 20)), args.queries)
+    timed("entities_in_rect 20x20 m", lambda i: index.entities_in_rect(*points[i], *(points[i] + 20)), args.queries)
+    timed("entities_crossing_segment 3 m", lambda i: index.entities_crossing_segment(*points[i], *(points[i] + 3)), args.queries)
+    timed("entities_containing_point", lambda i: index.entities_containing_point(*points[i]), args.queries)
+
+    # Reference: brute-force nearest beacon scan over all beacons
+    beacon_xy = np.array([(b.x, b.y) for b in changed.beacons])
+    timed("brute-force nearest k=4 (reference)",
+          lambda i: np.argsort(np.hypot(*(beacon_xy - points[i]).T))[:4], args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# server/batch_ingest.py
+"""
+Incremental parsing of bulk report uploads (POST /api/reports/batch).
+
+The body is newline-delimited JSON, optionally gzip-compressed (one or more
+concatenated gzip members, as `cat a.gz b.gz` produces), read chunk by
+chunk as it arrives: only the current chunk (inflated at most
+DECOMPRESS_CHUNK_BYTES at a time) and one partial line are held in memory, and
+bodies over MAX_BODY_BYTES (after decompression) are cut off. Each line is one report, either in the server's own TrackerReport
+shape or as a SenseCAP payload with the device EUI added:
+
+    {"trackerId": "...", "timestamp": 1746522494000, "detectedBeacons": [{"macAddress": "...", "rssi": -60}]}
+    {"deviceEui": "...", "timestamp": 1746522494000, "value": [{"mac": "C3:00:00:3E:7D:DA", "rssi": "-53"}]}
+"""
+import json
+import zlib
+from collections import Counter
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from .models import TrackerReport
+
+MAX_LINE_BYTES = 1 << 20 # Longer lines are rejected (and skipped) instead of buffered
+MAX_REPORTED_ERRORS = 20 # Rejected lines listed individually in the summary
+DECOMPRESS_CHUNK_BYTES = 1 << 20 # Most gzip output inflated per step, however well the input compresses
+MAX_BODY_BYTES = 1 << 30 # Decompressed body size limit; larger bodies are rejected (413) at that point
+
+class BatchLineError(ValueError):
+    """A single line could not be turned into a report; `reason` is the summary counter key."""
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+class BatchStreamError(ValueError):
+    """The body itself is unreadable (e.g. corrupt gzip data); nothing after this point can be parsed."""
+
+class BatchTooLargeError(BatchStreamError):
+    """The (decompressed) body exceeds MAX_BODY_BYTES; lines up to the limit were parsed."""
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes], gzipped: bool = False) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    Yields (line_number, line) for each non-empty line of a streamed body.
+    line is None for a line longer than MAX_LINE_BYTES (which is skipped).
+    Raises BatchStreamError (BatchTooLargeError past MAX_BODY_BYTES).
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None # gzip header + deflate
+    partial = b""
+    skipping = False # Inside an over-long line
+    line_number = 0
+    body_bytes = 0
+
+    def split(data: bytes):
+        nonlocal partial, skipping, line_number, body_bytes
+        body_bytes += len(data)
+        if body_bytes > MAX_BODY_BYTES:
+            raise BatchTooLargeError(f"Body exceeds {MAX_BODY_BYTES} bytes (decompressed) after line {line_number}")
+        lines = data.split(b"\n")
+        lines[0] = partial + lines[0]
+        partial = lines.pop()
+        for line in lines:
+            line_number += 1
+            if skipping:
+                skipping = False
+                yield line_number, None
+            elif line.strip():
+                yield line_number, line if len(line) <= MAX_LINE_BYTES else None
+        if len(partial) > MAX_LINE_BYTES:
+            partial, skipping = b"", True
+
+    def inflate(chunk: bytes):
+        # Bounded steps: a small, highly compressed chunk must not inflate into one huge buffer
+        nonlocal decompressor
+        try:
+            while True:
+                if decompressor.eof: # Concatenated members (cat a.gz b.gz): the next one starts after this one's end
+                    chunk = decompressor.unused_data + chunk
+                    if not chunk:
+                        return
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data = decompressor.decompress(chunk, DECOMPRESS_CHUNK_BYTES)
+                if data:
+                    yield data
+                chunk = decompressor.unconsumed_tail
+                if not chunk and not decompressor.eof and len(data) < DECOMPRESS_CHUNK_BYTES: # Input used up and no output pending
+                    return
+        except zlib.error as e:
+            raise BatchStreamError(f"Invalid gzip data after line {line_number}: {e}") from e
+
+    async for chunk in chunks:
+        for data in inflate(chunk) if decompressor is not None else (chunk,):
+            for item in split(data):
+                yield item
+    if decompressor is not None:
+        try:
+            tail = decompressor.flush()
+        except zlib.error as e:
+            raise BatchStreamError(f"Invalid gzip data after line {line_number}: {e}") from e
+        if not decompressor.eof:
+            raise BatchStreamError(f"Truncated gzip data after line {line_number}")
+        for item in split(tail):
+            yield item
+    line_number += 1
+    if skipping:
+        yield line_number, None
+    elif partial.strip():
+        yield line_number, partial
+
+
+def _parse_sensecap_values(tracker_id: str, timestamp, values, deduplication_id=None) -> TrackerReport:
+    if not isinstance(values, list):
+        raise BatchLineError("invalid_report", "'value' must be a list of beacons")
+    beacons = []
+    for item in values:
+        if isinstance(item, dict) and item.get("mac") and item.get("rssi") is not None:
+            try:
+                beacons.append({"macAddress": str(item["mac"]).upper(), "rssi": int(item["rssi"])})
+            except (TypeError, ValueError):
+                continue # Same as MQTT ingest: unparseable beacon entries are skipped
+    # One validation call per report (pydantic-core) is cheaper than building each DetectedBeacon
+    return TrackerReport.model_validate({"trackerId": str(tracker_id), "timestamp": timestamp, "detectedBeacons": beacons,
+                                         "deduplicationId": str(deduplication_id) if deduplication_id is not None else None})
+
+def parse_report_line(line: bytes) -> TrackerReport:
+    """Parses one NDJSON line into a TrackerReport. Raises BatchLineError."""
+    if line is None:
+        raise BatchLineError("line_too_long", f"Line exceeds {MAX_LINE_BYTES} bytes")
+    if b'"detectedBeacons"' in line: # Fast path: TrackerReport shape, parsed and validated in one pydantic-core call
+        try:
+            return TrackerReport.model_validate_json(line)
+        except ValidationError:
+            pass # Re-parsed below for a precise rejection reason
+    try:
+        data = json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise BatchLineError("invalid_json", f"Invalid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise BatchLineError("invalid_report", "Line is not a JSON object")
+    # Unlike live MQTT ingest, a backfilled report without a timestamp cannot be placed in time
+    if data.get("timestamp") is None:
+        raise BatchLineError("missing_timestamp", "Missing 'timestamp'")
+    try:
+        if "value" in data:
+            tracker_id = data.get("deviceEui") or data.get("trackerId")
+            if not tracker_id:
+                raise BatchLineError("invalid_report", "Missing 'deviceEui' / 'trackerId'")
+            return _parse_sensecap_values(tracker_id, data["timestamp"], data["value"], data.get("deduplicationId"))
+        return TrackerReport.model_validate(data)
+    except BatchLineError:
+        raise
+    except ValidationError as e:
+        raise BatchLineError("invalid_report", f"Invalid report: {e.error_count()} validation error(s), first: {e.errors()[0]['msg']}") from e
+    except (TypeError, ValueError) as e:
+        raise BatchLineError("invalid_report", f"Invalid report: {e}") from e
+
+
+class BatchSummary:
+    """Accepted / rejected counts of one upload, with the first few rejected lines."""
+    def __init__(self):
+        self.accepted = 0
+        self.rejected: Counter = Counter() # reason -> count
+        self.errors: List[Dict] = []
+        self.outcomes: Counter = Counter() # e.g. positioned / not_positioned / merged_into_history
+        self.trackers: set = set()
+        self.stream_error: Optional[str] = None
+
+    def reject(self, line_number: int, error: BatchLineError):
+        self.rejected[error.reason] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "reason": error.reason, "error": str(error)})
+
+    def to_dict(self, elapsed_seconds: float) -> dict:
+        total_rejected = sum(self.rejected.values())
+        result = {
+            "accepted": self.accepted,
+            "rejected": total_rejected,
+            "rejectedByReason": dict(self.rejected),
+            "outcomes": dict(self.outcomes),
+            "trackers": len(self.trackers),
+            "elapsedMs": round(elapsed_seconds * 1000, 1),
+            "reportsPerSecond": round((self.accepted + total_rejected) / elapsed_seconds, 1) if elapsed_seconds > 0 else None,
+            "errors": self.errors,
+        }
+        if self.stream_error:
+            result["streamError"] = self.stream_error
+        return result
@@ -0,0 +1,254 @@
+# server/calibration.py
+"""
+Per-beacon calibration of txPower and the path loss exponent n.
+
+The log-distance model RSSI = txPower - 10 * n * log10(d) is linear in
+x = -10 * log10(d), so each beacon is a straight-line fit (intercept txPower,
+slope n). All beacons are fitted at once with grouped sums (np.bincount) and
+made robust with Huber-weighted IRLS, so millions of samples cost a few passes
+over flat arrays.
+
+Offline job, run from the project root:
+    python -m server.calibration samples.csv [--config server/web_config.json] [--dry-run]
+
+samples.csv has a header and the columns mac,rssi and either distance or x,y
+(surveyed tag position; the distance is then taken from the configured beacon
+coordinates). Online samples come from reference tags configured under
+calibration.referenceTags in the server runtime config.
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+
+from .models import WebUIConfig, WebUIBeaconConfig
+from . import config_manager
+
+log = logging.getLogger(__name__)
+
+HUBER_K = 1.345 # 95% efficiency under Gaussian noise
+N_BOUNDS = (1.0, 6.0) # Same bounds as WebUISettings.signalPropagationFactor
+MIN_DISTANCE_M = 0.1
+MAD_STRIDE = 1000.0 # Larger than any plausible RSSI residual in dB
+
+# --- Robust Grouped Regression ---
+def fit_path_loss(beacon_idx: np.ndarray, rssi: np.ndarray, distance: np.ndarray, num_beacons: int,
+                  iterations: int = 8, min_samples: int = 50) -> Dict[str, np.ndarray]:
+    """
+    Fits txPower and n for every beacon with Huber-weighted least squares.
+
+    Args:
+        beacon_idx: (N,) beacon index of each sample (0..num_beacons-1).
+        rssi: (N,) measured RSSI in dBm.
+        distance: (N,) true distance in meters.
+
+    Returns:
+        Dict of (num_beacons,) arrays: txPower, n, samples, residualStd and ok
+        (False where there were too few samples or too little distance spread).
+    """
+    g = np.asarray(beacon_idx, dtype=np.int64)
+    y = np.asarray(rssi, dtype=np.float64)
+    x = -10.0 * np.log10(np.maximum(np.asarray(distance, dtype=np.float64), MIN_DISTANCE_M))
+    w = np.ones_like(y)
+    counts = np.bincount(g, minlength=num_beacons)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    has_samples = counts > 0
+
+    def grouped(values):
+        return np.bincount(g, weights=values, minlength=num_beacons)
+
+    tx_power = np.full(num_beacons, np.nan)
+    n = np.full(num_beacons, np.nan)
+    scale = np.full(num_beacons, np.nan)
+    for _ in range(iterations):
+        sw, sx, sy = grouped(w), grouped(w * x), grouped(w * y)
+        sxx, sxy = grouped(w * x * x), grouped(w * x * y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            det = sw * sxx - sx * sx
+            n = np.clip((sw * sxy - sx * sy) / det, *N_BOUNDS)
+            tx_power = (sy - n * sx) / sw
+
+        residual = y - (tx_power[g] + n[g] * x)
+        # Robust scale per beacon: 1.4826 * median absolute residual. Offsetting |r| by
+        # beacon index * MAD_STRIDE makes one flat sort order samples by (beacon, |r|).
+        abs_res = np.abs(residual)
+        keyed = np.sort(g * MAD_STRIDE + np.minimum(abs_res, MAD_STRIDE - 1))
+        mad = np.full(num_beacons, np.nan)
+        mad[has_samples] = keyed[starts[has_samples] + counts[has_samples] // 2] - np.flatnonzero(has_samples) * MAD_STRIDE
+        scale = np.maximum(1.4826 * mad, 0.5) # Floor at 0.5 dB, RSSI is integer-quantized
+
+        u = abs_res / (HUBER_K * scale[g])
+        w = np.where(u <= 1.0, 1.0, 1.0 / np.maximum(u, 1e-12))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = det / (sw * sw) # Weighted variance of x
+    ok = (counts >= min_samples) & np.isfinite(tx_power) & np.isfinite(n) & (spread > 1.0)
+    return {"txPower": tx_power, "n": n, "samples": counts, "residualStd": scale, "ok": ok}
+
+
+# --- Online Sample Buffer ---
+class CalibrationSampleBuffer:
+    """
+    Fixed-capacity ring buffer of (beacon, RSSI, true distance) samples from
+    reference tags, stored as flat arrays ready for fit_path_loss.
+    """
+    def __init__(self, capacity: int = 1_000_000):
+        self.capacity = int(capacity)
+        self.beacon_idx = np.zeros(self.capacity, dtype=np.int32)
+        self.rssi = np.zeros(self.capacity, dtype=np.float32)
+        self.distance = np.zeros(self.capacity, dtype=np.float32)
+        self.size = 0
+        self.next = 0
+        self.beacon_keys: List[str] = []
+        self.beacon_index: Dict[str, int] = {}
+
+    def add(self, beacon_key: str, rssi: float, distance: float):
+        idx = self.beacon_index.get(beacon_key)
+        if idx is None:
+            idx = self.beacon_index[beacon_key] = len(self.beacon_keys)
+            self.beacon_keys.append(beacon_key)
+        self.beacon_idx[self.next] = idx
+        self.rssi[self.next] = rssi
+        self.distance[self.next] = distance
+        self.next = (self.next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def clear(self):
+        self.size = 0
+        self.next = 0
+        self.beacon_keys = []
+        self.beacon_index = {}
+
+    def counts(self) -> Dict[str, int]:
+        """Number of buffered samples per beacon key."""
+        counts = np.bincount(self.beacon_idx[:self.size], minlength=len(self.beacon_keys))
+        return {key: int(c) for key, c in zip(self.beacon_keys, counts) if c}
+
+    def snapshot(self) -> "CalibrationSamples":
+        """
+        Copies of the buffered samples and beacon keys. Take it where add() is called
+        (the event loop) and fit the copy elsewhere: once the ring has wrapped, new
+        samples, possibly of new beacon indexes, land inside the live arrays.
+        """
+        size = self.size
+        return CalibrationSamples(self.beacon_idx[:size].copy(), self.rssi[:size].copy(),
+                                  self.distance[:size].copy(), list(self.beacon_keys))
+
+    def fit(self, min_samples: int = 50) -> Dict[str, Dict[str, float]]:
+        """Fits all buffered samples; returns {beacon_key: result} for beacons with a usable fit."""
+        return self.snapshot().fit(min_samples)
+
+
+class CalibrationSamples(NamedTuple):
+    """A copy of a CalibrationSampleBuffer's samples (see CalibrationSampleBuffer.snapshot)."""
+    beacon_idx: np.ndarray
+    rssi: np.ndarray
+    distance: np.ndarray
+    beacon_keys: List[str]
+
+    def fit(self, min_samples: int = 50) -> Dict[str, Dict[str, float]]:
+        """Fits the samples; returns {beacon_key: result} for beacons with a usable fit. Safe in a worker thread."""
+        return _results_by_key(fit_path_loss(self.beacon_idx, self.rssi, self.distance, len(self.beacon_keys),
+                                             min_samples=min_samples), self.beacon_keys)
+
+
+def _results_by_key(fit: Dict[str, np.ndarray], keys: List[str]) -> Dict[str, Dict[str, float]]:
+    return {
+        key: {
+            "txPower": float(fit["txPower"][i]),
+            "n": float(fit["n"][i]),
+            "samples": int(fit["samples"][i]),
+            "residualStd": float(fit["residualStd"][i]),
+        }
+        for i, key in enumerate(keys) if fit["ok"][i]
+    }
+
+
+# --- Applying Results ---
+def beacon_key(beacon: WebUIBeaconConfig) -> Optional[str]:
+    """Key used to match calibration samples to configured beacons (lower-case MAC, as in calculate_position)."""
+    return beacon.macAddress.lower() if beacon.macAddress else None
+
+def apply_calibration(config: WebUIConfig, results: Dict[str, Dict[str, float]]) -> Tuple[WebUIConfig, int]:
+    """Returns a copy of config with fitted txPower / n written into matching beacons, and the number updated."""
+    new_config = config.model_copy(deep=True)
+    updated = 0
+    for beacon in [*new_config.beacons, *(b for floor in new_config.floors for b in floor.beacons)]:
+        result = results.get(beacon_key(beacon) or "")
+        if result:
+            beacon.txPower = int(round(result["txPower"]))
+            beacon.signalPropagationFactor = round(result["n"], 3)
+            updated += 1
+    return new_config, updated
+
+
+# --- Offline Job ---
+def load_samples_csv(path: str, config: WebUIConfig) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """Reads mac,rssi,(distance | x,y) rows into flat arrays (beacon index, RSSI, distance) plus the beacon keys."""
+    beacons = {beacon_key(b): b for b in [*config.beacons, *(b for floor in config.floors for b in floor.beacons)] if beacon_key(b)}
+    keys: List[str] = []
+    index: Dict[str, int] = {}
+    beacon_idx: List[int] = []
+    rssi: List[float] = []
+    distance: List[float] = []
+    skipped = 0
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            key = (row.get("mac") or "").strip().lower()
+            try:
+                if row.get("distance"):
+                    d = float(row["distance"])
+                else:
+                    b = beacons.get(key)
+                    if b is None:
+                        skipped += 1
+                        continue
+                    d = math.hypot(float(row["x"]) - b.x, float(row["y"]) - b.y)
+                r = float(row["rssi"])
+            except (KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+            if key not in index:
+                index[key] = len(keys)
+                keys.append(key)
+            beacon_idx.append(index[key])
+            rssi.append(r)
+            distance.append(d)
+    if skipped:
+        log.warning(f"Skipped {skipped} calibration rows (unknown beacon or malformed values).")
+    return np.asarray(beacon_idx), np.asarray(rssi), np.asarray(distance), keys
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fit txPower and path loss exponent per beacon from logged samples.")
+    parser.add_argument("samples", help="CSV with columns mac,rssi and distance or x,y")
+    parser.add_argument("--config", default="server/web_config.json", help="Web UI config to read beacons from and update")
+    parser.add_argument("--min-samples", type=int, default=50)
+    parser.add_argument("--dry-run", action="store_true", help="Print the fit without writing the config")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = WebUIConfig(**json.load(f))
+    beacon_idx, rssi, distance, keys = load_samples_csv(args.samples, config)
+    results = _results_by_key(fit_path_loss(beacon_idx, rssi, distance, len(keys), min_samples=args.min_samples), keys)
+    for key, result in sorted(results.items()):
+        print(f"{key}: txPower={result['txPower']:.1f} dBm n={result['n']:.3f} "
+              f"samples={result['samples']} residualStd={result['residualStd']:.2f} dB")
+
+    new_config, updated = apply_calibration(config, results)
+    if args.dry_run:
+        print(f"Dry run: {updated} beacon(s) would be updated.")
+    else:
+        config_manager.atomic_write_json(args.config, new_config.model_dump(mode='json'), indent=4)
+        print(f"Updated {updated} beacon(s) in {args.config}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# server/config_cache.py
+"""
+Binary sidecar cache for compiled configuration.
+
+Compiling a config file (JSON parsing, Pydantic validation and building derived
+structures such as the per-floor spatial indexes and geofence grids) is done once; the
+result is pickled next to the file as .<name>.compiled and reused as long as
+the SHA-256 of the file content, the compile parameters and the code are
+unchanged. The code part hashes the source of every module of the server
+package (the pickled objects are instances of its classes) and the Python,
+NumPy and Pydantic versions, so a code change or upgrade recompiles once
+instead of loading objects of an older layout.
+The sidecar lives in the server directory and is only ever written by the
+server itself, so it is trusted like the code next to it.
+"""
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Tuple, Union
+
+import numpy as np
+import pydantic
+
+log = logging.getLogger(__name__)
+
+PACKAGE_DIR = Path(__file__).resolve().parent
+
+def sidecar_path(path: Union[str, Path]) -> Path:
+    path = Path(path)
+    return path.parent / f".{path.name}.compiled"
+
+@functools.lru_cache(maxsize=1)
+def code_fingerprint() -> str:
+    """Hash of the server package's source files and the library versions the pickles depend on."""
+    digest = hashlib.sha256(repr((sys.version, np.__version__, pydantic.VERSION)).encode('utf-8'))
+    for source in sorted(PACKAGE_DIR.glob("*.py")):
+        digest.update(source.name.encode('utf-8'))
+        digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+def cache_key(raw: bytes, params: tuple = ()) -> str:
+    """Key of a compiled result: hash of the file content, the compile parameters and the code (code_fingerprint)."""
+    digest = hashlib.sha256(raw)
+    digest.update(repr((code_fingerprint(), params)).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_compiled(path: Union[str, Path], compile_func: Callable[[bytes], Any], params: tuple = ()) -> Tuple[Any, bool]:
+    """
+    Returns (compiled, cache_hit). compile_func receives the raw file content and
+    must return a picklable object; it only runs if no valid sidecar exists.
+    Cache read / write problems are logged and never fail the load.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    key = cache_key(raw, params)
+    sidecar = sidecar_path(path)
+    try:
+        with open(sidecar, 'rb') as f:
+            cached_key, compiled = pickle.load(f)
+        if cached_key == key:
+            return compiled, True
+    except FileNotFoundError:
+        pass
+    except Exception as e: # Corrupt or incompatible sidecar: recompile and overwrite it
+        log.warning(f"Ignoring unreadable compiled config cache {sidecar}: {e}")
+
+    compiled = compile_func(raw)
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=sidecar.parent, prefix=f"{sidecar.name}.", suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, compiled), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, sidecar)
+    except Exception as e:
+        log.warning(f"Could not write compiled config cache {sidecar}: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return compiled, False
@@ -1,7 +1,9 @@
 # server/config_manager.py
 import json
+import os
+import tempfile
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, Optional, Tuple, Union
 from .models import MiniprogramConfig, ServerRuntimeConfig, MiniprogramBeaconConfig
 
 # Define paths for the two configuration files
@@ -16,6 +18,29 @@ PASSWORD_PLACEHOLDER = "********"
 miniprogram_cfg_cache: Optional[MiniprogramConfig] = None
 server_runtime_cfg_cache: Optional[ServerRuntimeConfig] = None
 
+def atomic_write_json(path: Union[str, Path], data: Any, indent: int = 2):
+    """Writes JSON to a temp file in the same directory and renames it over path,
+       so readers never see a partially written file."""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def file_mtime_ns(path: Union[str, Path]) -> Optional[int]:
+    """Modification time of a config file in ns, or None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
 def load_miniprogram_config() -> Optional[MiniprogramConfig]:
     """Loads the miniprogram-generated configuration (map, beacons, basic settings)."""
     global miniprogram_cfg_cache
@@ -72,8 +97,7 @@ def save_miniprogram_config(config_data: MiniprogramConfig) -> bool:
     try:
         # config_data should be an instance of MiniprogramConfig
         # The .dict() method is from Pydantic BaseModel
-        with open(MINIPROGRAM_CONFIG_FILE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(config_data.model_dump(), f, indent=2) # Use model_dump() for Pydantic v2+
+        atomic_write_json(MINIPROGRAM_CONFIG_FILE_PATH, config_data.model_dump(), indent=2) # Use model_dump() for Pydantic v2+
         miniprogram_cfg_cache = config_data
         print(f"Miniprogram configuration saved successfully to {MINIPROGRAM_CONFIG_FILE_PATH}")
         return True
@@ -111,9 +135,8 @@ def save_server_runtime_config(config_data: ServerRuntimeConfig) -> Tuple[bool,
                 # If no existing sensible password, save it as empty or None (as Pydantic model allows)
                 data_to_save.mqtt.password = None 
 
-        with open(SERVER_RUNTIME_CONFIG_FILE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(data_to_save.model_dump(), f, indent=2)
-        
+        atomic_write_json(SERVER_RUNTIME_CONFIG_FILE_PATH, data_to_save.model_dump(), indent=2)
+
         server_runtime_cfg_cache = data_to_save # Update cache with what was actually saved
         print(f"Server runtime configuration saved successfully to {SERVER_RUNTIME_CONFIG_FILE_PATH}")
         return True, server_runtime_cfg_cache
@@ -145,10 +168,8 @@ def get_beacon_by_mac(mac_address: str) -> Optional[MiniprogramBeaconConfig]:
             return beacon
     return None
 
-# Initial load attempt when the module is imported
-print("Initializing configuration manager...")
-load_miniprogram_config()
-load_server_runtime_config()
+# Configs are not loaded on import: the server's startup handler parses each file once,
+# and get_*_config() loads lazily for other callers.
 
 # Example of how to potentially create a default server_runtime_config.json if it's missing
 # This is optional and depends on desired behavior.
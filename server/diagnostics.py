@@ -0,0 +1,131 @@
+# server/diagnostics.py
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+log = logging.getLogger(__name__)
+
+# --- Queue-Based Logging ---
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+_original_handlers: List[logging.Handler] = []
+
+def enable_queue_logging():
+    """
+    Moves the root logger's handlers behind a QueueHandler. Log calls on the event
+    loop then only enqueue the record; the (blocking) stderr / file I/O happens on
+    the QueueListener's background thread.
+    """
+    global _queue_listener, _original_handlers
+    if _queue_listener is not None:
+        return
+    root = logging.getLogger()
+    _original_handlers = [h for h in root.handlers if not isinstance(h, logging.handlers.QueueHandler)]
+    if not _original_handlers:
+        return
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    for handler in _original_handlers:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _queue_listener = logging.handlers.QueueListener(log_queue, *_original_handlers, respect_handler_level=True)
+    _queue_listener.start()
+
+def disable_queue_logging():
+    """Flushes the queue, stops the background thread and restores the original handlers."""
+    global _queue_listener, _original_handlers
+    if _queue_listener is None:
+        return
+    _queue_listener.stop() # Processes everything still queued
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+        root.removeHandler(handler)
+    for handler in _original_handlers:
+        root.addHandler(handler)
+    _queue_listener = None
+    _original_handlers = []
+
+
+# --- Rate-Limited Diagnostics ---
+class RateLimitedLog:
+    """
+    Wraps a logger so that each key (e.g. ("unknown_beacon", mac) or
+    ("too_few_beacons", tracker_id)) logs at most once per interval. Suppressed
+    repeats are counted and reported with the next message for that key.
+    Messages use %-style args so suppressed calls never format anything.
+    """
+    def __init__(self, logger: logging.Logger, interval_seconds: float = 60.0, max_keys: int = 10000):
+        self.logger = logger
+        self.interval_seconds = interval_seconds
+        self.max_keys = max_keys
+        self._last: "OrderedDict[Hashable, List[float]]" = OrderedDict() # key -> [last_emit_time, suppressed]
+        self._lock = threading.Lock() # Also used from the MQTT network thread
+
+    def log(self, level: int, key: Hashable, msg: str, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self._lock:
+            entry = self._last.get(key)
+            if entry is not None and now - entry[0] < self.interval_seconds:
+                entry[1] += 1
+                return
+            suppressed = int(entry[1]) if entry is not None else 0
+            self._last[key] = [now, 0]
+            self._last.move_to_end(key)
+            if len(self._last) > self.max_keys:
+                self._last.popitem(last=False)
+        if suppressed:
+            msg += " (%d similar message(s) suppressed)"
+            args += (suppressed,)
+        self.logger.log(level, msg, *args)
+
+    def info(self, key: Hashable, msg: str, *args):
+        self.log(logging.INFO, key, msg, *args)
+
+    def warning(self, key: Hashable, msg: str, *args):
+        self.log(logging.WARNING, key, msg, *args)
+
+    def error(self, key: Hashable, msg: str, *args):
+        self.log(logging.ERROR, key, msg, *args)
+
+
+# --- Summary Counters ---
+class DiagnosticCounters:
+    """
+    Structured counters that replace per-event log lines on the hot path
+    (e.g. one 'beacons_used' increment instead of one 'Using beacon ...' line per beacon).
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.totals: Counter = Counter()
+        self._last_summary: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, key: str, amount: int = 1):
+        with self._lock:
+            self.totals[key] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        """Cumulative counts since start."""
+        with self._lock:
+            return dict(self.totals)
+
+    def summary_since_last(self) -> Dict[str, int]:
+        """Counts accumulated since the previous call (non-zero entries only)."""
+        with self._lock:
+            delta = self.totals - self._last_summary
+            self._last_summary = self.totals.copy()
+        return dict(delta)
+
+    def log_summary(self, logger: logging.Logger, interval_seconds: float):
+        """Logs one line with the counts of the last interval, if anything happened."""
+        delta = self.summary_since_last()
+        if delta:
+            logger.info("%s summary (last %.0fs): %s", self.name, interval_seconds,
+                        ", ".join(f"{k}={v}" for k, v in sorted(delta.items())))
+
+
+positioning_counters = DiagnosticCounters("Positioning")
@@ -0,0 +1,121 @@
+# server/event_time.py
+import heapq
+import itertools
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .models import TrackerReport
+
+log = logging.getLogger(__name__)
+
+SKEW_WINDOW = 4096 # Recent receive-vs-event time skews kept for percentiles
+
+# --- Per-Tracker Reorder Buffer ---
+class _TrackerBuffer:
+    __slots__ = ("heap", "max_event_ms", "last_emitted_ms")
+
+    def __init__(self):
+        self.heap: List[Tuple[int, int, int, TrackerReport]] = [] # (event_ms, seq, receive_ms, report)
+        self.max_event_ms = -1
+        self.last_emitted_ms = -1
+
+
+class EventTimeOrderer:
+    """
+    Releases tracker reports in payload-timestamp (event time) order.
+
+    Each tracker has a small heap of pending reports and a watermark at
+    (newest event time seen - allowed_lateness_ms). Reports at or below the
+    watermark are released in order; a full buffer releases its oldest report;
+    flush_expired() releases reports that waited longer than max_hold_ms of
+    wall time so a tracker that goes quiet is not held back. A report older
+    than the last one released for its tracker is late: push() returns it
+    separately and the caller applies the late policy.
+    """
+    def __init__(self, allowed_lateness_ms: int = 2000, max_buffer_size: int = 16, max_hold_ms: int = 2000):
+        self.allowed_lateness_ms = int(allowed_lateness_ms)
+        self.max_buffer_size = int(max_buffer_size)
+        self.max_hold_ms = int(max_hold_ms)
+        self.buffers: Dict[str, _TrackerBuffer] = {}
+        self._seq = itertools.count() # Tie-breaker so equal timestamps keep arrival order
+        self.counters: Dict[str, int] = {
+            "received": 0, "released": 0, "reordered": 0, "late": 0, "lateDropped": 0, "lateReprocessed": 0,
+            "overflowReleases": 0, "holdReleases": 0, "futureTimestampsClamped": 0,
+        }
+        self._skews = np.zeros(SKEW_WINDOW, dtype=np.float64)
+        self._skew_count = 0
+
+    def configure(self, allowed_lateness_ms: int, max_buffer_size: int, max_hold_ms: int):
+        self.allowed_lateness_ms = int(allowed_lateness_ms)
+        self.max_buffer_size = int(max_buffer_size)
+        self.max_hold_ms = int(max_hold_ms)
+
+    def push(self, report: TrackerReport, receive_ms: int) -> Tuple[List[TrackerReport], bool]:
+        """Adds a report; returns (reports now released in event-time order, whether this report is late)."""
+        self.counters["received"] += 1
+        self._skews[self._skew_count % SKEW_WINDOW] = receive_ms - report.timestamp
+        self._skew_count += 1
+
+        buffer = self.buffers.get(report.trackerId)
+        if buffer is None:
+            buffer = self.buffers[report.trackerId] = _TrackerBuffer()
+        if report.timestamp < buffer.last_emitted_ms:
+            self.counters["late"] += 1
+            return [], True
+        if report.timestamp < buffer.max_event_ms:
+            self.counters["reordered"] += 1 # Out of order, but still in time for the buffer to fix it
+        buffer.max_event_ms = max(buffer.max_event_ms, report.timestamp)
+        heapq.heappush(buffer.heap, (report.timestamp, next(self._seq), receive_ms, report))
+
+        released = self._release(buffer, buffer.max_event_ms - self.allowed_lateness_ms)
+        while len(buffer.heap) > self.max_buffer_size:
+            self.counters["overflowReleases"] += 1
+            released.append(self._pop(buffer))
+        return released, False
+
+    def flush_expired(self, now_ms: int) -> List[TrackerReport]:
+        """Releases, in order, every buffered report up to the newest one that has waited longer than max_hold_ms."""
+        released: List[TrackerReport] = []
+        for buffer in self.buffers.values():
+            expired = [event_ms for event_ms, _, receive_ms, _ in buffer.heap if now_ms - receive_ms >= self.max_hold_ms]
+            if expired:
+                before = len(released)
+                released.extend(self._release(buffer, max(expired)))
+                self.counters["holdReleases"] += len(released) - before
+        return released
+
+    def flush_all(self) -> List[TrackerReport]:
+        """Releases everything still buffered (e.g. when leaving event-time mode)."""
+        released: List[TrackerReport] = []
+        for buffer in self.buffers.values():
+            while buffer.heap:
+                released.append(self._pop(buffer))
+        return released
+
+    def _pop(self, buffer: _TrackerBuffer) -> TrackerReport:
+        event_ms, _, _, report = heapq.heappop(buffer.heap)
+        buffer.last_emitted_ms = max(buffer.last_emitted_ms, event_ms)
+        self.counters["released"] += 1
+        return report
+
+    def _release(self, buffer: _TrackerBuffer, watermark_ms: int) -> List[TrackerReport]:
+        released = []
+        while buffer.heap and buffer.heap[0][0] <= watermark_ms:
+            released.append(self._pop(buffer))
+        return released
+
+    def metrics(self) -> dict:
+        """Counters plus receive-minus-event-time skew statistics (ms) over the recent window."""
+        skews = self._skews[:min(self._skew_count, SKEW_WINDOW)]
+        skew = {}
+        if len(skews):
+            p50, p95, p99 = np.percentile(skews, [50, 95, 99])
+            skew = {"mean": float(skews.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99),
+                    "min": float(skews.min()), "max": float(skews.max())}
+        return {
+            **self.counters,
+            "buffered": sum(len(b.heap) for b in self.buffers.values()),
+            "skewMs": skew,
+        }
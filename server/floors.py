@@ -0,0 +1,144 @@
+# server/floors.py
+"""
+Multi-floor / multi-site Web UI configurations.
+
+web_config.json may list `floors`, each with its own map and beacons; the
+top-level map and beacons form the floor DEFAULT_FLOOR_ID (the only floor of a
+single-floor config). FloorSet compiles every floor once per config snapshot:
+a WebUIConfig view holding only that floor's map and beacons, a MAC lookup,
+the BeaconTable of batch solves, a spatial index and a geofence engine.
+Reports are routed to a floor by their strongest known beacons, so a solve
+only ever looks at one floor's beacons, however many the building has.
+"""
+import heapq
+import logging
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .geofence import GeofenceEngine
+from .models import DetectedBeacon, WebUIBeaconConfig, WebUIConfig, WebUIMapInfo, WebUISettings
+from .positioning import BeaconTable
+from .spatial_index import SpatialIndex
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FLOOR_ID = "default"
+
+class CompiledFloor:
+    """One floor's config view plus the lookups derived from it."""
+    def __init__(self, floor_id: str, config: WebUIConfig, spatial_index: SpatialIndex, geofence_engine: GeofenceEngine,
+                 name: Optional[str] = None, site: Optional[str] = None, level: Optional[int] = None):
+        self.floor_id = floor_id
+        self.name = name
+        self.site = site
+        self.level = level
+        self.config = config # map / beacons / settings of this floor only
+        self.beacons_by_mac: Dict[str, WebUIBeaconConfig] = {b.macAddress.lower(): b for b in config.beacons if b.macAddress}
+        self.beacon_table = BeaconTable(config)
+        self.spatial_index = spatial_index
+        self.geofence_engine = geofence_engine
+        # Reused indexes are synced incrementally; (added, removed) tells callers whether walls changed
+        self.index_changes: Tuple[int, int] = spatial_index.update_from_config(config)
+
+    def info(self) -> dict:
+        map_info = self.config.map
+        return {
+            "id": self.floor_id,
+            "name": self.name,
+            "site": self.site,
+            "level": self.level,
+            "beacons": len(self.config.beacons),
+            "map": {"name": map_info.name, "width": map_info.width, "height": map_info.height} if map_info else None,
+        }
+
+
+class FloorSet:
+    """The compiled floors of one Web UI config snapshot and the beacon -> floor routing table."""
+    def __init__(self, floors: Dict[str, CompiledFloor]):
+        self.floors = floors
+        self.floor_of_mac: Dict[str, str] = {}
+        for floor in floors.values():
+            for mac in floor.beacons_by_mac:
+                if mac in self.floor_of_mac:
+                    log.warning(f"Beacon {mac} is configured on floors '{self.floor_of_mac[mac]}' and '{floor.floor_id}'; "
+                                f"reports are routed by its first floor.")
+                    continue
+                self.floor_of_mac[mac] = floor.floor_id
+        self.beacon_count = sum(len(floor.config.beacons) for floor in floors.values())
+        self._single = next(iter(floors)) if len(floors) == 1 else None
+
+    @classmethod
+    def from_config(cls, config: Optional[WebUIConfig], previous: Optional["FloorSet"] = None,
+                    cell_size: float = 2.0, geofence_cell_size: float = 2.0) -> "FloorSet":
+        """
+        Compiles the floors of config. Floors that already existed in `previous` keep
+        their spatial index (updated incrementally) and geofence engine (with its
+        zone memberships); the caller re-applies geofence parameters and zones.
+        """
+        views: List[Tuple[str, Optional[WebUIMapInfo], List[WebUIBeaconConfig], WebUISettings, dict]] = []
+        settings = config.settings if config else WebUISettings()
+        if config is None or not config.floors or config.map or config.beacons:
+            views.append((DEFAULT_FLOOR_ID, config.map if config else None, config.beacons if config else [], settings, {}))
+        for floor in config.floors if config else []:
+            views.append((floor.id, floor.map, floor.beacons, floor.settings or settings,
+                          {"name": floor.name, "site": floor.site, "level": floor.level}))
+
+        floors: Dict[str, CompiledFloor] = {}
+        for floor_id, map_info, beacons, floor_settings, meta in views:
+            if floor_id in floors:
+                log.warning(f"Duplicate floor id '{floor_id}' in the Web UI configuration; only the first is used.")
+                continue
+            reused = previous.floors.get(floor_id) if previous else None
+            spatial_index = reused.spatial_index if reused else SpatialIndex(cell_size=cell_size)
+            if reused:
+                geofence_engine = reused.geofence_engine
+            else:
+                geofence_engine = GeofenceEngine(cell_size=geofence_cell_size)
+                geofence_engine.set_zones(map_info)
+            view = WebUIConfig.model_construct(map=map_info, beacons=beacons, settings=floor_settings, floors=[]) # Already validated
+            floors[floor_id] = CompiledFloor(floor_id, view, spatial_index, geofence_engine, **meta)
+        return cls(floors)
+
+    def default_floor_id(self) -> str:
+        return next(iter(self.floors))
+
+    def route(self, detected: Sequence[DetectedBeacon], current_floor: Optional[str],
+              routing_beacons: int = 3, switch_margin_db: float = 6.0) -> str:
+        """
+        Floor of a report. The routing_beacons strongest known beacons add their
+        received power (mW) to their floor's score; a tracker leaves current_floor
+        only if the best floor's score is more than switch_margin_db higher.
+        Reports without a known beacon stay on current_floor.
+        """
+        if self._single is not None:
+            return self._single
+        floor_of_mac = self.floor_of_mac
+        heard = []
+        for beacon in detected:
+            if beacon.macAddress and -120 <= beacon.rssi < 0:
+                floor_id = floor_of_mac.get(beacon.macAddress.lower())
+                if floor_id is not None:
+                    heard.append((beacon.rssi, floor_id))
+        if current_floor not in self.floors:
+            current_floor = None
+        if not heard:
+            return current_floor or self.default_floor_id()
+        power: Dict[str, float] = {}
+        for rssi, floor_id in heapq.nlargest(routing_beacons, heard):
+            power[floor_id] = power.get(floor_id, 0.0) + 10.0 ** (rssi / 10.0)
+        best = max(power, key=power.get)
+        if current_floor is None or best == current_floor:
+            return best
+        current_power = power.get(current_floor, 0.0)
+        if current_power > 0 and 10.0 * math.log10(power[best] / current_power) <= switch_margin_db:
+            return current_floor
+        return best
+
+    def beacons_on_floor(self, detected: List[DetectedBeacon], floor_id: str) -> Tuple[List[DetectedBeacon], int]:
+        """Drops the detected beacons configured on other floors; returns (beacons kept, number dropped).
+           Unknown beacons are kept so the solver still counts them as unknown."""
+        if self._single is not None:
+            return detected, 0
+        floor_of_mac = self.floor_of_mac
+        kept = [b for b in detected if not b.macAddress or floor_of_mac.get(b.macAddress.lower(), floor_id) == floor_id]
+        return kept, len(detected) - len(kept)
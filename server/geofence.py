@@ -0,0 +1,220 @@
+# server/geofence.py
+import math
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+import logging
+
+from .models import WebUIMapInfo, WebUIMapEntity
+from .spatial_index import entity_segments, points_in_polygons
+
+log = logging.getLogger(__name__)
+
+# --- Zone Geometry ---
+class GeofenceZone:
+    """A closed map entity flagged with geofence=True, compiled to edge arrays."""
+    __slots__ = ("zone_id", "name", "edges", "bbox")
+
+    def __init__(self, zone_id: str, entity: WebUIMapEntity):
+        self.zone_id = zone_id
+        self.name = entity.name
+        self.edges = entity_segments(entity)
+        points = self.edges[:, 0:2] if len(self.edges) else np.zeros((1, 2))
+        self.bbox = np.concatenate([points.min(axis=0), points.max(axis=0)])
+
+    def distance_to_boundary(self, x: float, y: float) -> float:
+        """Shortest distance from the point to any edge of the zone."""
+        a = self.edges[:, 0:2]
+        ab = self.edges[:, 2:4] - a
+        ap = np.array([x, y]) - a
+        t = np.clip(np.sum(ap * ab, axis=1) / np.maximum(np.sum(ab * ab, axis=1), 1e-12), 0.0, 1.0)
+        closest = a + ab * t[:, None]
+        return float(np.min(np.hypot(closest[:, 0] - x, closest[:, 1] - y)))
+
+
+def _cells_inside(centers: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Vectorized crossing-number test of many points (N, 2) against one polygon's edges (E, 4)."""
+    px = centers[:, 0, None]
+    py = centers[:, 1, None]
+    x0, y0, x1, y1 = (edges[None, :, i] for i in range(4))
+    straddles = (y0 > py) != (y1 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return (np.sum(straddles & (px < x_cross), axis=1) % 2) == 1
+
+
+class ZoneGridIndex:
+    """
+    Precomputed uniform grid over geofence zones.
+
+    Every cell of a zone's bounding box is classified once at build time as
+    interior (fully inside, no test needed), boundary (an edge passes through it,
+    exact point-in-polygon test needed) or outside (not stored). A containment
+    lookup is then a dict hit plus exact tests for the few boundary zones.
+    """
+    def __init__(self, zones: List[GeofenceZone], cell_size: float = 1.0):
+        self.zones = zones
+        self.cell_size = float(cell_size)
+        interior: Dict[Tuple[int, int], List[int]] = {}
+        boundary: Dict[Tuple[int, int], List[int]] = {}
+
+        for zone_idx, zone in enumerate(zones):
+            cx0, cy0 = self._cell(zone.bbox[0], zone.bbox[1])
+            cx1, cy1 = self._cell(zone.bbox[2], zone.bbox[3])
+            edge_cells: Set[Tuple[int, int]] = set()
+            for edge in zone.edges:
+                edge_cells.update(self._edge_cells(edge))
+            for cell in edge_cells:
+                boundary.setdefault(cell, []).append(zone_idx)
+
+            gx, gy = np.meshgrid(np.arange(cx0, cx1 + 1), np.arange(cy0, cy1 + 1), indexing='ij')
+            cells = np.stack([gx.ravel(), gy.ravel()], axis=1)
+            inside = _cells_inside((cells + 0.5) * self.cell_size, zone.edges)
+            for cx, cy in cells[inside].tolist():
+                if (cx, cy) not in edge_cells:
+                    interior.setdefault((cx, cy), []).append(zone_idx)
+
+        self._cells: Dict[Tuple[int, int], Tuple[Tuple[int, ...], Tuple[int, ...], Optional[np.ndarray], Optional[np.ndarray]]] = {}
+        compiled: Dict[Tuple[int, ...], Tuple[np.ndarray, np.ndarray]] = {} # Shared by cells with the same boundary zones
+        for cell in set(interior) | set(boundary):
+            boundary_ids = tuple(boundary.get(cell, ()))
+            edges = owners = None
+            if boundary_ids: # Pre-concatenate the boundary zones' edges for a single vectorized test
+                if boundary_ids not in compiled:
+                    compiled[boundary_ids] = (
+                        np.concatenate([zones[i].edges for i in boundary_ids]),
+                        np.repeat(np.arange(len(boundary_ids)), [len(zones[i].edges) for i in boundary_ids])
+                    )
+                edges, owners = compiled[boundary_ids]
+            self._cells[cell] = (tuple(interior.get(cell, ())), boundary_ids, edges, owners)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def _edge_cells(self, edge: np.ndarray) -> List[Tuple[int, int]]:
+        """Cells actually crossed by an edge: cells of its bounding box whose corners are not all on one side of it."""
+        x0, y0, x1, y1 = edge
+        ex0, ey0 = self._cell(min(x0, x1), min(y0, y1))
+        ex1, ey1 = self._cell(max(x0, x1), max(y0, y1))
+        gx, gy = np.meshgrid(np.arange(ex0, ex1 + 1), np.arange(ey0, ey1 + 1), indexing='ij')
+        gx, gy = gx.ravel(), gy.ravel()
+        corners_x = (gx[:, None] + np.array([0, 1, 0, 1])) * self.cell_size
+        corners_y = (gy[:, None] + np.array([0, 0, 1, 1])) * self.cell_size
+        side = (x1 - x0) * (corners_y - y0) - (y1 - y0) * (corners_x - x0)
+        crossed = (side.min(axis=1) <= 0) & (side.max(axis=1) >= 0)
+        return list(zip(gx[crossed].tolist(), gy[crossed].tolist()))
+
+    def zones_at(self, x: float, y: float) -> List[int]:
+        """Indexes (into self.zones) of the zones containing the point."""
+        entry = self._cells.get(self._cell(x, y))
+        if entry is None:
+            return []
+        interior_ids, boundary_ids, edges, owners = entry
+        if not boundary_ids:
+            return list(interior_ids)
+        inside = points_in_polygons(x, y, edges, owners, len(boundary_ids))
+        return list(interior_ids) + [boundary_ids[i] for i in np.flatnonzero(inside)]
+
+
+# --- Geofence Engine ---
+class GeofenceEngine:
+    """
+    Tracks which trackers are inside which zones and emits enter / exit / dwell events.
+
+    Hysteresis: a tracker enters a zone as soon as its position is inside the
+    polygon, but only exits once it is more than hysteresis_meters outside the
+    boundary, so positions jittering around an edge do not flap.
+    """
+    def __init__(self, hysteresis_meters: float = 0.5, dwell_seconds: float = 60.0, cell_size: float = 2.0):
+        self.hysteresis_meters = hysteresis_meters
+        self.dwell_ms = int(dwell_seconds * 1000)
+        self.cell_size = cell_size
+        self.zones: Dict[str, GeofenceZone] = {}
+        self.grid = ZoneGridIndex([], cell_size)
+        self._zones_key: Optional[tuple] = None # Geometry + cell size the current grid was built from
+        # tracker_id -> zone_id -> [enter_time_ms, dwell_emitted]
+        self.memberships: Dict[str, Dict[str, list]] = {}
+
+    def configure(self, hysteresis_meters: float, dwell_seconds: float, cell_size: float):
+        """Applies new parameters; the grid is rebuilt on the next set_zones()."""
+        self.hysteresis_meters = hysteresis_meters
+        self.dwell_ms = int(dwell_seconds * 1000)
+        self.cell_size = cell_size
+
+    def set_zones(self, map_info: Optional[WebUIMapInfo]):
+        """(Re)builds the zones and their grid from the closed, geofence-flagged map entities.
+           Nothing is rebuilt if the zone geometry and cell size are unchanged."""
+        candidates = [(i, e) for i, e in enumerate(map_info.entities if map_info else []) if e.closed and e.geofence]
+        zones_key = (self.cell_size, tuple((i, e.name, tuple(map(tuple, e.points))) for i, e in candidates))
+        if zones_key == self._zones_key:
+            return
+        zones: Dict[str, GeofenceZone] = {}
+        for i, entity in candidates:
+            zone_id = entity.name or f"zone-{i}"
+            if zone_id in zones:
+                zone_id = f"{zone_id}-{i}"
+            zone = GeofenceZone(zone_id, entity)
+            if len(zone.edges) >= 3:
+                zones[zone_id] = zone
+        self.zones = zones
+        self.grid = ZoneGridIndex(list(zones.values()), self.cell_size)
+        self._zones_key = zones_key
+        # Forget memberships of zones that no longer exist
+        for tracker_zones in self.memberships.values():
+            for zone_id in [z for z in tracker_zones if z not in zones]:
+                del tracker_zones[zone_id]
+        log.info(f"Geofence zones loaded: {len(zones)}")
+
+    def _event(self, event: str, tracker_id: str, zone: GeofenceZone, x: float, y: float, timestamp_ms: int, enter_ms: Optional[int] = None) -> dict:
+        payload = {
+            "event": event,
+            "trackerId": tracker_id,
+            "zoneId": zone.zone_id,
+            "zoneName": zone.name,
+            "timestamp": timestamp_ms,
+            "x": x,
+            "y": y,
+        }
+        if enter_ms is not None:
+            payload["dwellMs"] = timestamp_ms - enter_ms
+        return payload
+
+    def update(self, tracker_id: str, x: float, y: float, timestamp_ms: int) -> List[dict]:
+        """Evaluates one position update of a tracker and returns the resulting events."""
+        if not self.zones:
+            return []
+        current = self.memberships.get(tracker_id)
+        inside_ids = [self.grid.zones[i].zone_id for i in self.grid.zones_at(x, y)]
+        if not inside_ids and not current:
+            return [] # Fast path: outside every zone and was outside before
+
+        if current is None:
+            current = self.memberships[tracker_id] = {}
+        events = []
+        for zone_id in inside_ids:
+            if zone_id not in current:
+                current[zone_id] = [timestamp_ms, False]
+                events.append(self._event("enter", tracker_id, self.zones[zone_id], x, y, timestamp_ms))
+
+        for zone_id, membership in list(current.items()):
+            zone = self.zones[zone_id]
+            if zone_id not in inside_ids and zone.distance_to_boundary(x, y) > self.hysteresis_meters:
+                del current[zone_id]
+                events.append(self._event("exit", tracker_id, zone, x, y, timestamp_ms, membership[0]))
+            elif not membership[1] and timestamp_ms - membership[0] >= self.dwell_ms:
+                membership[1] = True
+                events.append(self._event("dwell", tracker_id, zone, x, y, timestamp_ms, membership[0]))
+        return events
+
+    def remove_tracker(self, tracker_id: str, x: Optional[float], y: Optional[float], timestamp_ms: int) -> List[dict]:
+        """Forgets a tracker (e.g. it moved to another floor) and returns an exit event for every zone it was in."""
+        current = self.memberships.pop(tracker_id, None) or {}
+        return [self._event("exit", tracker_id, self.zones[zone_id], x, y, timestamp_ms, membership[0])
+                for zone_id, membership in current.items() if zone_id in self.zones]
+
+    def occupancy(self) -> Dict[str, List[str]]:
+        """Zone id -> ids of the trackers currently inside it."""
+        result: Dict[str, List[str]] = {zone_id: [] for zone_id in self.zones}
+        for tracker_id, tracker_zones in self.memberships.items():
+            for zone_id in tracker_zones:
+                result[zone_id].append(tracker_id)
+        return result
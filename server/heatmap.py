@@ -0,0 +1,150 @@
+# server/heatmap.py
+"""
+Incremental occupancy heatmaps.
+
+Every filtered position increments one cell of a per-floor grid (cellSize
+meters over WebUIMapInfo.width x height) in three rollups at once: its minute,
+hour and day bucket (UTC), so adding a position is O(1) and no rollup ever
+rescans raw points. With a fixed report interval the counts are proportional to
+dwell time. A query covers its window with the coarsest buckets that fit (whole
+days, then whole hours, then minutes at the edges) and sums at most a few
+hundred arrays. Each rollup keeps a bounded number of recent buckets; edges of a
+window older than the minute (hour) retention are widened to whole hours (days).
+"""
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .models import WebUIMapInfo
+
+log = logging.getLogger(__name__)
+
+BUCKET_MS = (60_000, 3_600_000, 86_400_000) # minute, hour, day
+LEVEL_NAMES = ("minute", "hour", "day")
+
+class FloorHeatmap:
+    """Bucketed count grids of one floor; grid[iy, ix] counts positions in [ix, ix+1) x [iy, iy+1) cells."""
+    def __init__(self, width: float, height: float, cell_size: float, retention: Tuple[int, int, int]):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.shape = (max(1, math.ceil(height / cell_size)), max(1, math.ceil(width / cell_size)))
+        self.retention = retention # Buckets kept per level
+        self.levels: List[Dict[int, np.ndarray]] = [{}, {}, {}] # level -> bucket key (time // BUCKET_MS) -> counts
+        self.newest = [-1, -1, -1] # Newest bucket key per level
+        self.points = 0
+        self.out_of_bounds = 0
+
+    def add(self, x: float, y: float, timestamp_ms: int) -> bool:
+        ix = int(x // self.cell_size)
+        iy = int(y // self.cell_size)
+        ny, nx = self.shape
+        if not (0 <= ix < nx and 0 <= iy < ny):
+            self.out_of_bounds += 1
+            return False
+        for level in range(3):
+            key = timestamp_ms // BUCKET_MS[level]
+            buckets = self.levels[level]
+            grid = buckets.get(key)
+            if grid is None:
+                if key <= self.newest[level] - self.retention[level]:
+                    continue # Older than this level keeps
+                grid = buckets[key] = np.zeros(self.shape, dtype=np.int32)
+                if key > self.newest[level]:
+                    self.newest[level] = key
+                    self._evict(level)
+            grid[iy, ix] += 1
+        self.points += 1
+        return True
+
+    def _evict(self, level: int):
+        oldest_kept = self.newest[level] - self.retention[level]
+        buckets = self.levels[level]
+        for key in [k for k in buckets if k <= oldest_kept]:
+            del buckets[key]
+
+    def _retained_from_ms(self, level: int) -> int:
+        """Start of the oldest bucket a level still keeps (everything if it has none yet)."""
+        if self.newest[level] < 0:
+            return 0
+        return (self.newest[level] - self.retention[level] + 1) * BUCKET_MS[level]
+
+    def query(self, start_ms: int, end_ms: int) -> Tuple[np.ndarray, int, int, Dict[str, int]]:
+        """Counts of [start_ms, end_ms); returns (grid, covered start, covered end, buckets summed per level)."""
+        start = start_ms - start_ms % BUCKET_MS[0]
+        end = -(-end_ms // BUCKET_MS[0]) * BUCKET_MS[0]
+        for level in (0, 1): # Window edges older than a level's retention are widened to the next level's buckets
+            size = BUCKET_MS[level + 1]
+            if start < self._retained_from_ms(level):
+                start -= start % size
+            if end <= self._retained_from_ms(level):
+                end = -(-end // size) * size
+        grid = np.zeros(self.shape, dtype=np.int64)
+        used = {name: 0 for name in LEVEL_NAMES}
+        t = start
+        while t < end:
+            for level in (2, 1, 0):
+                size = BUCKET_MS[level]
+                if t % size == 0 and t + size <= end:
+                    bucket = self.levels[level].get(t // size)
+                    if bucket is not None:
+                        grid += bucket
+                        used[LEVEL_NAMES[level]] += 1
+                    t += size
+                    break
+        return grid, start, end, used
+
+    def nbytes(self) -> int:
+        return sum(grid.nbytes for buckets in self.levels for grid in buckets.values())
+
+
+class HeatmapAggregator:
+    """The FloorHeatmap of every floor that has a map."""
+    def __init__(self, cell_size: float = 1.0, retention: Tuple[int, int, int] = (120, 72, 31)):
+        self.cell_size = float(cell_size)
+        self.retention = tuple(int(r) for r in retention)
+        self.floors: Dict[str, FloorHeatmap] = {}
+        self._maps: Dict[str, Tuple[float, float]] = {} # floor -> (width, height) of its map
+
+    def configure(self, cell_size: float, retention: Tuple[int, int, int]):
+        """Applies new parameters; grids are reset if the cell size changes."""
+        retention = tuple(int(r) for r in retention)
+        if float(cell_size) != self.cell_size:
+            self.cell_size = float(cell_size)
+            self.floors.clear()
+        self.retention = retention
+        for heatmap in self.floors.values():
+            heatmap.retention = retention
+            for level in range(3):
+                heatmap._evict(level)
+
+    def sync_floors(self, maps: Dict[str, Optional[WebUIMapInfo]]):
+        """Keeps the grids of floors whose map size is unchanged; others are (re)created on their next position."""
+        self._maps = {floor_id: (m.width, m.height) for floor_id, m in maps.items() if m and m.width > 0 and m.height > 0}
+        for floor_id, heatmap in list(self.floors.items()):
+            if self._maps.get(floor_id) != (heatmap.width, heatmap.height):
+                log.info(f"Heatmap of floor '{floor_id}' reset: its map was removed or resized.")
+                del self.floors[floor_id]
+
+    def add(self, floor_id: str, x: float, y: float, timestamp_ms: int) -> bool:
+        heatmap = self.floors.get(floor_id)
+        if heatmap is None:
+            size = self._maps.get(floor_id)
+            if size is None:
+                return False # Floor without a map
+            heatmap = self.floors[floor_id] = FloorHeatmap(size[0], size[1], self.cell_size, self.retention)
+        return heatmap.add(x, y, timestamp_ms)
+
+    def metrics(self) -> dict:
+        return {
+            floor_id: {
+                "points": h.points,
+                "outOfBounds": h.out_of_bounds,
+                "shape": list(h.shape),
+                "buckets": {name: len(h.levels[level]) for level, name in enumerate(LEVEL_NAMES)},
+                "bytes": h.nbytes(),
+            }
+            for floor_id, h in self.floors.items()
+        }
@@ -0,0 +1,93 @@
+# server/history_export.py
+"""
+Streaming export of tracker position histories (NDJSON, CSV or NumPy .npy).
+
+Exports iterate over the history lists held in tracker_states and encode rows in
+fixed-size chunks, so memory use does not grow with the size of the export.
+A TrackerState's position_history is never mutated after the state is created
+(updates build a new list), so holding a reference is a consistent snapshot
+that can be read from the response's worker thread.
+"""
+import bisect
+import io
+import json
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+History = Sequence[Tuple[float, float, int]] # (x, y, timestamp_ms), sorted by timestamp
+
+EXPORT_CHUNK_ROWS = 1024 # Rows encoded per yielded chunk
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "npy": "application/octet-stream",
+}
+
+def select_points(history: History, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+                  interval_ms: Optional[int] = None) -> Iterator[Tuple[float, float, int]]:
+    """
+    Points with start_ms <= timestamp <= end_ms (binary search on the sorted history).
+    With interval_ms, only the first point of each interval_ms time bucket is kept.
+    """
+    lo = 0 if start_ms is None else bisect.bisect_left(history, start_ms, key=lambda p: p[2])
+    hi = len(history) if end_ms is None else bisect.bisect_right(history, end_ms, key=lambda p: p[2])
+    last_bucket = None
+    for i in range(lo, hi):
+        point = history[i]
+        if interval_ms:
+            bucket = point[2] // interval_ms
+            if bucket == last_bucket:
+                continue
+            last_bucket = bucket
+        yield point
+
+def _rows(series: List[Tuple[str, History]], start_ms, end_ms, interval_ms) -> Iterator[List[Tuple[str, float, float, int]]]:
+    """(trackerId, x, y, timestamp) rows of all trackers, in chunks of EXPORT_CHUNK_ROWS."""
+    chunk = []
+    for tracker_id, history in series:
+        for x, y, timestamp in select_points(history, start_ms, end_ms, interval_ms):
+            chunk.append((tracker_id, x, y, timestamp))
+            if len(chunk) >= EXPORT_CHUNK_ROWS:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def iter_ndjson(series: List[Tuple[str, History]], start_ms=None, end_ms=None, interval_ms=None) -> Iterator[bytes]:
+    for chunk in _rows(series, start_ms, end_ms, interval_ms):
+        yield "".join(json.dumps({"trackerId": t, "timestamp": ts, "x": x, "y": y}) + "\n" for t, x, y, ts in chunk).encode("utf-8")
+
+def iter_csv(series: List[Tuple[str, History]], start_ms=None, end_ms=None, interval_ms=None) -> Iterator[bytes]:
+    yield b"trackerId,timestamp,x,y\n"
+    for chunk in _rows(series, start_ms, end_ms, interval_ms):
+        buffer = io.StringIO()
+        for t, x, y, ts in chunk:
+            # Tracker ids are device EUIs; quote anyway in case one contains a separator
+            tracker = '"' + t.replace('"', '""') + '"' if any(c in t for c in ',"\n') else t
+            buffer.write(f"{tracker},{ts},{x!r},{y!r}\n")
+        yield buffer.getvalue().encode("utf-8")
+
+def npy_dtype(series: List[Tuple[str, History]]) -> np.dtype:
+    width = max([len(t.encode("utf-8")) for t, _ in series] + [1])
+    return np.dtype([("trackerId", f"S{width}"), ("timestamp", "<i8"), ("x", "<f8"), ("y", "<f8")])
+
+def iter_npy(series: List[Tuple[str, History]], start_ms=None, end_ms=None, interval_ms=None) -> Iterator[bytes]:
+    """
+    A 1-D structured .npy array (trackerId, timestamp, x, y), loadable with np.load.
+    The header needs the row count, so the selection is counted in a first pass
+    (no rows are kept) before the rows are streamed.
+    """
+    dtype = npy_dtype(series)
+    count = sum(1 for _, history in series for _ in select_points(history, start_ms, end_ms, interval_ms))
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (count,)})
+    yield header.getvalue()
+    written = 0
+    for chunk in _rows(series, start_ms, end_ms, interval_ms):
+        chunk = chunk[:count - written] # Never exceed the announced shape
+        written += len(chunk)
+        yield np.array([(t.encode("utf-8"), ts, x, y) for t, x, y, ts in chunk], dtype=dtype).tobytes()
+
+EXPORTERS = {"ndjson": iter_ndjson, "csv": iter_csv, "npy": iter_npy}
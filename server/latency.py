@@ -0,0 +1,144 @@
+# server/latency.py
+"""
+End-to-end latency accounting, from a tag's uplink (payload timestamp) to the
+WebSocket broadcast of its position.
+
+Each live report carries a ReportTrace that is stamped as the report moves on:
+
+    uplink  payload timestamp -> MQTT message received (network, broker; tag clock)
+    decode  received -> report parsed
+    queue   parsed -> processing starts (thread hop, load shedding queue, event-time hold)
+    solve   floor routing, RSSI smoothing, solve
+    filter  tracking filter, state, history, geofence, heatmap
+    fanout  broadcast serialization, replay buffer, waiting for the send lock
+    send    socket sends to the subscribed clients
+
+Reports whose position is broadcast are recorded per site (floor) in a bounded
+window; the health endpoint reports percentiles per stage and of the total
+against the SLO (latency.sloMs at latency.sloPercentile). An EventLoopMonitor
+measures how late the event loop wakes up, which delays every stage above.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+STAGES = ("uplink", "decode", "queue", "solve", "filter", "fanout", "send")
+UPLINK, DECODE, QUEUE, SOLVE, FILTER, FANOUT, SEND = range(len(STAGES))
+PERCENTILES = (50, 95, 99)
+
+def _percentiles(values: np.ndarray) -> Dict[str, Optional[float]]:
+    if not len(values):
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES, axis=0))}
+
+
+class ReportTrace:
+    """Stage durations (ms) of one report; mark(stage) charges the time since the previous mark to stage."""
+    __slots__ = ("stages", "last")
+
+    def __init__(self, uplink_ms: float, received: float):
+        self.stages = [0.0] * len(STAGES)
+        self.stages[UPLINK] = uplink_ms
+        self.last = received # perf_counter() of the previous mark
+
+    def mark(self, stage: int):
+        now = time.perf_counter()
+        self.stages[stage] += (now - self.last) * 1000
+        self.last = now
+
+
+class _Window:
+    """Ring of (wall time s, stage ms..., total ms) rows of one site."""
+    __slots__ = ("rows", "count")
+
+    def __init__(self, size: int):
+        self.rows = np.empty((size, len(STAGES) + 2))
+        self.count = 0
+
+    def add(self, row):
+        self.rows[self.count % len(self.rows)] = row
+        self.count += 1
+
+    def recent(self, since: float) -> np.ndarray:
+        rows = self.rows[:min(self.count, len(self.rows))]
+        return rows[rows[:, 0] >= since]
+
+
+class LatencyTracker:
+    """Rolling per-site latency windows of broadcast reports."""
+    def __init__(self, max_samples: int = 4096, window_seconds: float = 300.0):
+        self.max_samples = int(max_samples)
+        self.window_seconds = float(window_seconds)
+        self._sites: Dict[str, _Window] = {}
+        self.counters = {"recorded": 0, "clockSkewed": 0}
+
+    def configure(self, max_samples: int, window_seconds: float):
+        if int(max_samples) != self.max_samples:
+            self._sites.clear()
+        self.max_samples = int(max_samples)
+        self.window_seconds = float(window_seconds)
+
+    @staticmethod
+    def begin(payload_timestamp_ms: int, received_ms: float, received: float) -> ReportTrace:
+        """Trace of a report received at received_ms (wall clock) / received (perf_counter)."""
+        return ReportTrace(received_ms - payload_timestamp_ms, received)
+
+    def finish(self, trace: ReportTrace, site: str):
+        """Records a report whose broadcast was just sent."""
+        stages = trace.stages
+        if stages[UPLINK] < 0: # Tag clock ahead of ours: the uplink delay is unknown
+            self.counters["clockSkewed"] += 1
+            stages[UPLINK] = 0.0
+        window = self._sites.get(site)
+        if window is None:
+            window = self._sites[site] = _Window(self.max_samples)
+        window.add((time.time(), *stages, sum(stages)))
+        self.counters["recorded"] += 1
+
+    def report(self, slo_ms: float, slo_percentile: float) -> dict:
+        since = time.time() - self.window_seconds
+        sites = {}
+        for site, window in self._sites.items():
+            rows = window.recent(since)
+            total = rows[:, -1]
+            at_percentile = float(np.percentile(total, slo_percentile)) if len(rows) else None
+            sites[site] = {
+                "reports": len(rows),
+                "ok": at_percentile is None or at_percentile <= slo_ms,
+                "totalMs": {**_percentiles(total), "max": round(float(total.max()), 2) if len(rows) else None},
+                "withinSloRatio": round(float(np.mean(total <= slo_ms)), 4) if len(rows) else None,
+                "stagesMs": {stage: _percentiles(rows[:, 1 + i]) for i, stage in enumerate(STAGES)},
+            }
+        return {"windowSeconds": self.window_seconds, **self.counters, "sites": sites}
+
+
+class EventLoopMonitor:
+    """Samples event loop lag: how much later than requested a sleep of interval seconds returns."""
+    def __init__(self, interval_seconds: float = 0.25, max_samples: int = 1200):
+        self.interval = float(interval_seconds)
+        self._lags = np.zeros(int(max_samples)) # Ring of lags (ms)
+        self._count = 0 # Samples taken
+
+    async def run(self):
+        while True:
+            interval = self.interval
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self._lags[self._count % len(self._lags)] = max(0.0, (time.perf_counter() - started - interval) * 1000)
+            self._count += 1
+
+    def report(self, slo_ms: float) -> dict:
+        lags = self._lags[:min(self._count, len(self._lags))]
+        p99 = float(np.percentile(lags, 99)) if len(lags) else None
+        return {
+            "samples": len(lags),
+            "probeIntervalMs": self.interval * 1000,
+            "lagMs": {**_percentiles(lags), "max": round(float(lags.max()), 2) if len(lags) else None},
+            "sloMs": slo_ms,
+            "ok": p99 is None or p99 <= slo_ms,
+        }
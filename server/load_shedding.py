@@ -0,0 +1,263 @@
+# server/load_shedding.py
+"""
+Overload control for the report pipeline.
+
+Reports are queued here instead of being processed as they arrive, and a single
+worker task processes them. The queue is kept per priority class (e.g.
+personnel before pallets) and, within a class, per tracker: trackers take turns
+(round robin), a tracker's own reports stay in order, and a higher class is
+always served first, so a backlog builds up in the lower classes.
+
+How far behind the queue is sets the overload level: an EMA, over the processed
+reports, of the time since the oldest report each one replaced was queued (a
+report that replaced others is itself fresh, but without shedding the worker
+would still be busy with the older ones). With hysteresis: back to normal once
+that is below recoverLagMs and no report had to be dropped for shedLagMs, or
+when the queue runs empty:
+
+- NORMAL: every report is processed.
+- SHED (wait >= shedLagMs): only the newest queued report of each tracker is
+  processed (intermediate ones are dropped), and each tracker is broadcast at
+  most every overloadBroadcastIntervalMs of its class.
+- SEVERE (wait >= severeLagMs): additionally the solver runs with cheaper
+  settings (see cheap_solver_params).
+
+End-to-end lag (queue wait + processing) is recorded for the diagnostics endpoint.
+"""
+import asyncio
+import fnmatch
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .models import BeaconSelectionParams, SolverParams, TrackerReport
+
+log = logging.getLogger(__name__)
+
+NORMAL, SHED, SEVERE = 0, 1, 2
+LEVEL_NAMES = ("normal", "shed", "severe")
+LAG_SAMPLES = 2048 # Recent end-to-end lags kept per class for percentiles
+WAIT_ALPHA = 0.05 # EMA weight of the newest queue wait
+
+def cheap_solver_params(solver: SolverParams, selection: BeaconSelectionParams) -> Tuple[SolverParams, BeaconSelectionParams]:
+    """Solver settings for SEVERE overload: a coarser stop tolerance and greedy beacon selection instead of the subset search."""
+    return (solver.model_copy(update={"stepTolerance": max(solver.stepTolerance, 0.1)}),
+            selection.model_copy(update={"maxSubsets": 1}))
+
+
+class PriorityClass:
+    __slots__ = ("name", "patterns", "broadcast_interval_ms")
+
+    def __init__(self, name: str, patterns: List[str], broadcast_interval_ms: int):
+        self.name = name
+        self.patterns = patterns
+        self.broadcast_interval_ms = broadcast_interval_ms
+
+
+class OverloadController:
+    """Priority queue of reports with lag-driven load shedding (see module docstring)."""
+    def __init__(self):
+        self.shed_lag_ms = 1000.0
+        self.severe_lag_ms = 5000.0
+        self.recover_lag_ms = 250.0
+        self.max_queued = 100_000
+        self.classes: List[PriorityClass] = [PriorityClass("default", ["*"], 2000)]
+        self.level = NORMAL
+        self._queues: List["OrderedDict[str, Deque[Tuple[TrackerReport, float, float]]]"] = [OrderedDict()] # Per class: tracker -> (report, enqueued, oldest replaced enqueued)
+        self._queued = 0
+        self._class_of: Dict[str, int] = {} # Tracker id -> class index (cache of the pattern match)
+        self._last_broadcast: Dict[str, int] = {} # Tracker id -> ms of its last broadcast while overloaded
+        self._lags: Dict[str, Deque[float]] = {} # Class name -> recent end-to-end lags (ms)
+        self._last_coalesced = 0.0 # Monotonic time reports were last dropped by coalescing
+        self.wait_ms = 0.0 # EMA of the queue wait, counted from the oldest replaced report
+        self._cheap: Optional[Tuple[SolverParams, BeaconSelectionParams, SolverParams, BeaconSelectionParams]] = None # (solver, selection) -> cheap versions
+        self._wake = asyncio.Event()
+        self._running = False
+        self.counters = {"enqueued": 0, "processed": 0, "coalesced": 0, "overflowDropped": 0, "broadcastsSkipped": 0,
+                         "severeSolves": 0, "levelChanges": 0}
+        self.class_counters: Dict[str, Dict[str, int]] = {}
+
+    def configure(self, shed_lag_ms: float, severe_lag_ms: float, recover_lag_ms: float, max_queued: int,
+                  classes: List[PriorityClass]):
+        """Applies new parameters; queued reports are re-sorted into the new classes."""
+        self.shed_lag_ms = float(shed_lag_ms)
+        self.severe_lag_ms = float(severe_lag_ms)
+        self.recover_lag_ms = float(recover_lag_ms)
+        self.max_queued = int(max_queued)
+        self.classes = classes
+        self._class_of.clear()
+        old_queues = self._queues
+        self._queues = [OrderedDict() for _ in classes]
+        for queue in old_queues:
+            for tracker_id, pending in queue.items():
+                self._queues[self.class_index(tracker_id)][tracker_id] = pending
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def class_index(self, tracker_id: str) -> int:
+        index = self._class_of.get(tracker_id)
+        if index is None:
+            index = next((i for i, c in enumerate(self.classes) if any(fnmatch.fnmatchcase(tracker_id, p) for p in c.patterns)),
+                         len(self.classes) - 1)
+            self._class_of[tracker_id] = index
+        return index
+
+    # --- Queue ---
+    def submit(self, report: TrackerReport):
+        """Queues a report (called on the event loop); while overloaded it replaces the tracker's queued reports."""
+        tracker_id = report.trackerId
+        queue = self._queues[self.class_index(tracker_id)]
+        now = time.monotonic()
+        since = now
+        pending = queue.get(tracker_id)
+        if pending is None:
+            pending = queue[tracker_id] = deque()
+        elif pending and self.level >= SHED:
+            since = pending[0][2]
+            self._coalesce(tracker_id, len(pending))
+            pending.clear()
+        pending.append((report, now, since))
+        self._queued += 1
+        self.counters["enqueued"] += 1
+        if self._queued > self.max_queued:
+            self._drop_oldest()
+        self._wake.set()
+
+    def _coalesce(self, tracker_id: str, dropped: int):
+        self._last_coalesced = time.monotonic()
+        self._queued -= dropped
+        self.counters["coalesced"] += dropped
+        self._class_counter(tracker_id, "coalesced", dropped)
+
+    def _class_counter(self, tracker_id: str, name: str, n: int = 1):
+        counters = self.class_counters.setdefault(self.classes[self.class_index(tracker_id)].name, {"processed": 0, "coalesced": 0})
+        counters[name] += n
+
+    def _drop_oldest(self):
+        """Queue full: drops the oldest report of the lowest class that has any."""
+        for queue in reversed(self._queues):
+            if queue:
+                tracker_id, pending = next(iter(queue.items()))
+                pending.popleft()
+                if not pending:
+                    del queue[tracker_id]
+                self._queued -= 1
+                self.counters["overflowDropped"] += 1
+                return
+
+    def _pop(self) -> Optional[Tuple[TrackerReport, float, float]]:
+        for queue in self._queues:
+            if not queue:
+                continue
+            tracker_id, pending = next(iter(queue.items()))
+            if self.level >= SHED and len(pending) > 1:
+                self._coalesce(tracker_id, len(pending) - 1)
+                item = pending[-1][:2] + (pending[0][2],)
+                pending.clear()
+                self._queued -= 1
+            else:
+                item = pending.popleft()
+                self._queued -= 1
+            if pending:
+                queue.move_to_end(tracker_id) # Round robin within the class
+            else:
+                del queue[tracker_id]
+            return item
+        return None
+
+    async def run(self, process: Callable[[TrackerReport], Awaitable[None]]):
+        """Worker: processes queued reports until cancelled."""
+        self._wake = asyncio.Event() # Bound to this worker's event loop
+        self._running = True
+        try:
+            while True:
+                item = self._pop()
+                if item is None:
+                    self.wait_ms = 0.0
+                    self._last_coalesced = 0.0
+                    self._set_level()
+                    self._wake.clear()
+                    await self._wake.wait()
+                    continue
+                report, enqueued, since = item
+                self.wait_ms += WAIT_ALPHA * ((time.monotonic() - since) * 1000 - self.wait_ms)
+                self._set_level()
+                try:
+                    await process(report)
+                except Exception as e:
+                    log.error(f"Error processing report of tracker {report.trackerId}: {e}", exc_info=True)
+                name = self.classes[self.class_index(report.trackerId)].name
+                lags = self._lags.get(name)
+                if lags is None:
+                    lags = self._lags[name] = deque(maxlen=LAG_SAMPLES)
+                lags.append((time.monotonic() - enqueued) * 1000)
+                self.counters["processed"] += 1
+                self._class_counter(report.trackerId, "processed")
+                await asyncio.sleep(0) # Let ingest callbacks and WebSocket traffic in between reports
+        finally:
+            self._running = False
+
+    def _set_level(self):
+        wait_ms = self.wait_ms
+        level = self.level
+        if wait_ms >= self.severe_lag_ms:
+            level = SEVERE
+        elif wait_ms >= self.shed_lag_ms:
+            level = max(level, SHED)
+        elif wait_ms <= self.recover_lag_ms and (time.monotonic() - self._last_coalesced) * 1000 >= self.shed_lag_ms:
+            level = NORMAL
+        if level != self.level:
+            log.warning(f"Report pipeline overload level: {LEVEL_NAMES[self.level]} -> {LEVEL_NAMES[level]} "
+                        f"(queue wait {wait_ms:.0f} ms, {self._queued} reports queued)")
+            self.level = level
+            self.counters["levelChanges"] += 1
+            if level == NORMAL:
+                self._last_broadcast.clear()
+
+    # --- Shedding decisions for the pipeline ---
+    def broadcast_allowed(self, tracker_id: str, now_ms: int) -> bool:
+        """False if the tracker's class was broadcast too recently for the current overload level."""
+        if self.level == NORMAL:
+            return True
+        interval = self.classes[self.class_index(tracker_id)].broadcast_interval_ms
+        last = self._last_broadcast.get(tracker_id)
+        if last is not None and now_ms - last < interval:
+            self.counters["broadcastsSkipped"] += 1
+            return False
+        self._last_broadcast[tracker_id] = now_ms
+        return True
+
+    def solver_params(self, solver: SolverParams, selection: BeaconSelectionParams) -> Tuple[SolverParams, BeaconSelectionParams]:
+        """The solver settings to use at the current overload level."""
+        if self.level < SEVERE:
+            return solver, selection
+        if self._cheap is None or self._cheap[0] is not solver or self._cheap[1] is not selection:
+            self._cheap = (solver, selection, *cheap_solver_params(solver, selection))
+        self.counters["severeSolves"] += 1
+        return self._cheap[2], self._cheap[3]
+
+    def metrics(self) -> dict:
+        per_class = {}
+        for c, queue in zip(self.classes, self._queues):
+            lags = np.fromiter(self._lags.get(c.name, ()), dtype=float)
+            per_class[c.name] = {
+                **self.class_counters.get(c.name, {"processed": 0, "coalesced": 0}),
+                "queued": sum(len(p) for p in queue.values()),
+                "lagMs": {q: round(float(np.percentile(lags, int(q[1:]))), 2) if len(lags) else None for q in ("p50", "p95", "p99")},
+            }
+        return {
+            "level": LEVEL_NAMES[self.level],
+            "queued": self._queued,
+            "queueWaitMs": round(self.wait_ms, 2),
+            **self.counters,
+            "perClass": per_class,
+        }
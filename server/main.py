@@ -1,32 +1,77 @@
-import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Response, Query
-from fastapi.responses import FileResponse, PlainTextResponse
+import time
+_import_started = time.perf_counter() # Start of the startup-timing report
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Response, Query, Request
+from fastapi.responses import FileResponse, PlainTextResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import json
 import paho.mqtt.client as mqtt
 import logging
 import datetime
-import time
-from typing import List, Dict, Optional, Any, Tuple
+import contextlib
+import bisect
+import io
+import uuid
+import math
+from typing import List, Dict, Literal, Optional, Any, Tuple
 import os # Keep one os import
+from pathlib import Path
+import numpy as np
 
 # Import project modules
 from . import config_manager
+from . import config_cache
 from . import positioning
 from .models import ( # Grouped imports for models
     DetectedBeacon, TrackerReport, TrackerState, 
-    MiniprogramConfig, WebUIConfig, 
-    WebUISettings # Import WebUISettings directly
+    MiniprogramConfig, WebUIConfig, ServerRuntimeConfig, MqttServerConfig,
+    WebUISettings, # Import WebUISettings directly
+    LatencyParams
 )
 from .positioning import KalmanFilter2D
+from .particle_filter import ParticleFilterBank, MapConstrainedParticleFilter, particle_filter_batch
+from .spatial_index import SegmentGridIndex
+from .geofence import GeofenceEngine
+from .floors import CompiledFloor, FloorSet
+from .mqtt_asyncio import AsyncioMqttConnection
+from .rssi_smoothing import RssiSmoother
+from .calibration import CalibrationSampleBuffer, apply_calibration
+from .event_time import EventTimeOrderer
+from .report_dedupe import ReportDeduplicator
+from .ws_replay import ReplayBuffer
+from .heatmap import HeatmapAggregator
+from .trajectory import TrajectoryCache
+from .solve_memo import SolveMemo, StationaryDetector
+from .load_shedding import OverloadController, PriorityClass
+from . import latency
+from .latency import EventLoopMonitor, LatencyTracker
+from .scanner_ingest import ScannerIngest
+from . import batch_ingest
+from . import history_export
+from .state_snapshot import SnapshotError, StateSnapshotter, read_snapshot
+from .batch_ingest import BatchLineError, BatchStreamError, BatchSummary, BatchTooLargeError
+from . import diagnostics
+from .diagnostics import RateLimitedLog, positioning_counters
 
 # Configure logging
 logging.basicConfig(level=logging.INFO) # Keep level INFO for now, but will reduce specific log.info calls
 log = logging.getLogger(__name__)
+ingest_log = RateLimitedLog(log) # Per-tracker payload / topic problems, one line per interval per tracker
 
 # Add asyncio import if not already present globally, for create_task
 import asyncio
 
+# --- Startup Timing ---
+startup_timings: Dict[str, float] = {"imports": time.perf_counter() - _import_started} # Stage -> seconds
+web_config_cache_hit: bool = False
+
+@contextlib.contextmanager
+def _startup_stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+
 app = FastAPI()
 
 # Define the path for the web configuration file
@@ -39,6 +84,15 @@ WEB_CONFIG_FILE_PATH = os.path.join(os.path.dirname(__file__), "web_config.json"
 DEFAULT_TEST_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "test", "config2.json")
 MAP_EXAMPLE_FORMAT_PATH = os.path.join(os.path.dirname(__file__), "..", "test", "map1.json") # New path for map1.json
 
+# Cell size (meters) of the spatial index over map entities and beacons
+SPATIAL_INDEX_CELL_SIZE = 2.0
+
+# Position history kept per tracker (30 minutes)
+HISTORY_WINDOW_MS = 30 * 60 * 1000
+
+# Bulk-uploaded reports are ranged and solved in chunks of this many; bounds memory and event-loop blocking per step
+BATCH_CHUNK_REPORTS = 2048
+
 # Mount static files (for serving the client-side HTML/JS)
 # Make sure the client directory exists relative to where uvicorn is run (usually project root)
 try:
@@ -59,37 +113,191 @@ mqtt_connection_status: str = "disconnected" # Added for live MQTT status
 is_mqtt_intentionally_disconnected: bool = False # Flag for manual disconnects
 
 tracker_states: Dict[str, TrackerState] = {} # Stores the latest state for each tracker
-kalman_filters: Dict[str, KalmanFilter2D] = {} # Stores Kalman filter instance per tracker
+kalman_filters: Dict[str, Any] = {} # Stores filter instance per tracker (KalmanFilter2D or MapConstrainedParticleFilter)
+particle_banks: Dict[str, ParticleFilterBank] = {} # Floor -> shared particle arrays of its trackers in 'particle' tracking mode
+floor_set: FloorSet = FloorSet.from_config(None) # Compiled floors (beacons, spatial index, geofence zones), synced with web_ui_cfg
+rssi_smoother: Optional[RssiSmoother] = None # Pre-solver RSSI smoothing, created from runtime_cfg.rssiSmoothing
+calibration_buffer: Optional[CalibrationSampleBuffer] = None # Samples from reference tags (runtime_cfg.calibration)
 mqtt_client: Optional[mqtt.Client] = None
+mqtt_asyncio_connection: Optional[AsyncioMqttConnection] = None # Drives mqtt_client from the event loop (mqtt.ingestMode == "asyncio")
+background_tasks: set = set() # Strong references to fire-and-forget tasks until they finish
+diagnostics_summary_task: Optional[asyncio.Task] = None # Periodic positioning summary log line
+event_time_orderer: EventTimeOrderer = EventTimeOrderer() # Per-tracker reorder buffers (runtime_cfg.eventTime.mode == "event")
+event_time_flush_task: Optional[asyncio.Task] = None # Releases reports held longer than eventTime.maxHoldMs
+report_deduplicator: ReportDeduplicator = ReportDeduplicator() # Recently processed reports (runtime_cfg.dedupe)
+heatmap_aggregator: HeatmapAggregator = HeatmapAggregator() # Per-floor occupancy grids (runtime_cfg.heatmap)
+trajectory_cache: TrajectoryCache = TrajectoryCache() # Simplified position histories per level of detail (runtime_cfg.trajectory)
+solve_memo: SolveMemo = SolveMemo() # Recent solve results by quantized RSSI vector (runtime_cfg.solveMemo)
+stationary_detector: StationaryDetector = StationaryDetector() # Per-tracker stays (runtime_cfg.stationary)
+overload_controller: OverloadController = OverloadController() # Report queue by priority class with load shedding (runtime_cfg.loadShedding)
+load_shedding_task: Optional[asyncio.Task] = None # Worker processing overload_controller's queue
+latency_tracker: LatencyTracker = LatencyTracker() # Per-site end-to-end report latency (runtime_cfg.latency)
+event_loop_monitor: EventLoopMonitor = EventLoopMonitor() # Event loop lag probe (runtime_cfg.latency)
+event_loop_monitor_task: Optional[asyncio.Task] = None
+scanner_ingest: ScannerIngest = ScannerIngest() # local-beacon-service connections (runtime_cfg.scannerIngest)
+state_snapshotter: Optional[StateSnapshotter] = None # Periodic tracker / filter snapshots (runtime_cfg.snapshot)
+state_snapshot_task: Optional[asyncio.Task] = None
+state_restore_task: Optional[asyncio.Task] = None # Startup restore; report processing waits for it
+snapshot_restore_info: Dict[str, Any] = {} # What the startup restore did, for /api/diagnostics/snapshot
+
+# Config snapshots are never mutated in place: every change builds a new model object and swaps
+# the global in a single assignment, bumping the config's version.
+CONFIG_FILES: Dict[str, str] = {
+    "web": WEB_CONFIG_FILE_PATH,
+    "runtime": str(config_manager.SERVER_RUNTIME_CONFIG_FILE_PATH),
+    "miniprogram": str(config_manager.MINIPROGRAM_CONFIG_FILE_PATH),
+}
+config_versions: Dict[str, int] = {name: 0 for name in CONFIG_FILES} # Monotonically increasing per config
+config_file_mtimes: Dict[str, Optional[int]] = {} # mtime of the file content behind the current snapshot
+config_writes_in_progress: set = set() # Configs being written by a worker thread (ignored by the watcher)
+config_watch_task: Optional[asyncio.Task] = None
 
 # --- WebSocket Connection Manager ---
 class ConnectionManager:
+    """
+    WebSocket clients and broadcasts. Every broadcast carries a global sequence
+    number ("seq") and is kept in a replay buffer, so a client whose connection
+    dropped can reconnect with /ws?resume_from=<last seq> (and &epoch=<epoch>)
+    and receive only what it missed, or a snapshot if that has aged out.
+    A client can ask for simplified tracker trails (?lod=<level>, see trajectory.py):
+    the position_history of the tracker entries it is sent is replaced by that level.
+    """
     def __init__(self):
         self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
+        self.floor_subscriptions: Dict[int, set] = {} # id(websocket) -> subscribed floor ids; absent = all floors
+        self.history_lods: Dict[int, int] = {} # id(websocket) -> position_history level of detail; absent = raw
+        self.epoch = uuid.uuid4().hex[:12] # Sequence numbers are only meaningful within one server run
+        self.seq = 0
+        self.replay = ReplayBuffer()
+        self.snapshot_provider = None # (floors) -> list of snapshot messages (dicts), set by the app
+        self._pending: Dict[int, List[Tuple[int, str]]] = {} # Live messages held back while a client is being resumed
+        self._send_lock = asyncio.Lock() # Broadcasts reach every client in seq order
+
+    async def connect(self, websocket: WebSocket, floors: Optional[set] = None, resume_from: Optional[int] = None,
+                      epoch: Optional[str] = None, lod: int = 0):
+        """
+        Accepts a client and sends it a "session" message (epoch, current seq). With
+        resume_from, the broadcasts after that seq are replayed first; if they are no
+        longer buffered (or epoch is of another server run) a snapshot is sent instead.
+        """
         await websocket.accept()
+        self.subscribe(websocket, floors)
+        self.set_history_lod(websocket, lod)
+        key = id(websocket)
+        lod = self.history_lods.get(key, 0)
+        current = self.seq
+        session = {"epoch": self.epoch, "seq": current, "configVersions": dict(config_versions)}
+        replay, snapshot = None, None
+        if resume_from is not None:
+            if epoch is None or epoch == self.epoch:
+                replay = self.replay.since(resume_from, current, self.floor_subscriptions.get(key), lod)
+            if replay is None:
+                snapshot = self.snapshot_provider(self.floor_subscriptions.get(key)) if self.snapshot_provider else []
+                snapshot = [_with_history_lod(message, lod) for message in snapshot]
+                self.replay.counters["snapshots"] += 1
+                session["resume"] = "snapshot"
+            else:
+                self.replay.counters["resumed"] += 1
+                self.replay.counters["replayed"] += len(replay)
+                session["resume"] = "replay"
+                session["replayed"] = len(replay)
+        # Registered before the first await: broadcasts from now on are queued until the catch-up is sent
+        pending = self._pending[key] = []
         self.active_connections.append(websocket)
-        log.info(f"WebSocket client connected: {websocket.client}")
+        try:
+            await websocket.send_text(json.dumps({"type": "session", "data": session}))
+            for _, message in replay or ():
+                await websocket.send_text(message)
+            for message in snapshot or ():
+                await websocket.send_text(json.dumps(message))
+            while pending:
+                seq, message = pending.pop(0)
+                if seq > current: # Older ones were assigned before the catch-up and are part of it
+                    await websocket.send_text(message)
+        finally:
+            self._pending.pop(key, None)
+        log.info(f"WebSocket client connected: {websocket.client}" + (f" (resume from {resume_from}: {session['resume']})" if resume_from is not None else ""))
+
+    def configure_replay(self, max_messages: int, max_bytes: int, max_age_seconds: float):
+        self.replay.configure(max_messages, max_bytes, max_age_seconds)
+
+    def subscribe(self, websocket: WebSocket, floors: Optional[set]):
+        """Limits floor-scoped messages (tracker updates, geofence events) sent to a client; None or empty = all floors."""
+        if floors:
+            self.floor_subscriptions[id(websocket)] = set(floors)
+        else:
+            self.floor_subscriptions.pop(id(websocket), None)
+
+    def set_history_lod(self, websocket: WebSocket, lod: int):
+        """Level of detail of the position histories sent to a client (0 = raw; clamped to the configured levels)."""
+        lod = max(0, min(int(lod), trajectory_cache.max_lod))
+        if lod:
+            self.history_lods[id(websocket)] = lod
+        else:
+            self.history_lods.pop(id(websocket), None)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        self.floor_subscriptions.pop(id(websocket), None)
+        self.history_lods.pop(id(websocket), None)
         log.info(f"WebSocket client disconnected: {websocket.client}")
 
-    async def broadcast(self, data: dict):
+    async def broadcast(self, data: dict, floor_id: Optional[str] = None, trace: Optional[latency.ReportTrace] = None):
+        """
+        Sends data to all clients; with floor_id, only to clients subscribed to that
+        floor (or to all floors). trace (of the report being broadcast) is stamped with
+        the fanout and send stages.
+        """
+        self.seq += 1
+        seq = self.seq
         # Use json.dumps to ensure proper serialization for WebSocket
-        message = json.dumps(data)
+        message = json.dumps({**data, "seq": seq})
+        variants = None # LOD -> message, built once per level that a recipient asked for
+        if data.get("type") in HISTORY_MESSAGE_TYPES and self.history_lods:
+            variants = {lod: json.dumps({**_with_history_lod(data, lod), "seq": seq}) for lod in set(self.history_lods.values())}
+        self.replay.append(seq, floor_id, message, variants)
         disconnected_clients = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e: # Handles various connection errors
-                log.warning(f"Could not send to WebSocket client {connection.client}: {e}. Marking for disconnect.")
-                disconnected_clients.append(connection)
+        async with self._send_lock:
+            if trace:
+                trace.mark(latency.FANOUT)
+            for connection in list(self.active_connections):
+                if floor_id is not None:
+                    floors = self.floor_subscriptions.get(id(connection))
+                    if floors is not None and floor_id not in floors:
+                        continue
+                text = variants.get(self.history_lods.get(id(connection), 0), message) if variants else message
+                pending = self._pending.get(id(connection))
+                if pending is not None:
+                    pending.append((seq, text))
+                    continue
+                try:
+                    await connection.send_text(text)
+                except Exception as e: # Handles various connection errors
+                    log.warning(f"Could not send to WebSocket client {connection.client}: {e}. Marking for disconnect.")
+                    disconnected_clients.append(connection)
+            if trace:
+                trace.mark(latency.SEND)
         # Clean up disconnected clients
         for client in disconnected_clients:
             if client in self.active_connections:
                 self.active_connections.remove(client) # No need to call disconnect() again
+                self.floor_subscriptions.pop(id(client), None)
+                self.history_lods.pop(id(client), None)
+
+HISTORY_MESSAGE_TYPES = ("tracker_update", "initial_state") # Messages whose data maps tracker ids to entries with a position_history
+
+def _with_history_lod(message: dict, lod: int) -> dict:
+    """message with the position_history of its tracker entries simplified to level lod."""
+    if not lod or message.get("type") not in HISTORY_MESSAGE_TYPES:
+        return message
+    entries = {}
+    for tracker_id, entry in message["data"].items():
+        history = entry.get("position_history")
+        if history:
+            entry = {**entry, "position_history": trajectory_cache.simplified(tracker_id, history, lod)}
+        entries[tracker_id] = entry
+    return {**message, "data": entries}
 
 manager = ConnectionManager()
 
@@ -175,18 +383,18 @@ def parse_sensecap_payload(device_eui: str, payload_bytes: bytes) -> Optional[Tr
 
         payload_timestamp = data.get("timestamp")
         if payload_timestamp is None:
-            log.warning(f"Missing 'timestamp' in SenseCAP payload for {device_eui}. Using current time.")
+            ingest_log.warning(("missing_timestamp", device_eui), "Missing 'timestamp' in SenseCAP payload for %s. Using current time.", device_eui)
             payload_timestamp = int(time.time() * 1000)
         else:
             try:
                 payload_timestamp = int(payload_timestamp)
             except ValueError:
-                log.warning(f"Invalid 'timestamp' format in SenseCAP payload for {device_eui}. Using current time.")
+                ingest_log.warning(("invalid_timestamp", device_eui), "Invalid 'timestamp' format in SenseCAP payload for %s. Using current time.", device_eui)
                 payload_timestamp = int(time.time() * 1000)
 
         beacon_values = data.get("value")
         if not isinstance(beacon_values, list):
-            log.warning(f"Missing or invalid 'value' list in SenseCAP payload for {device_eui}. No beacons to parse.")
+            ingest_log.warning(("invalid_value", device_eui), "Missing or invalid 'value' list in SenseCAP payload for %s. No beacons to parse.", device_eui)
             return TrackerReport(trackerId=device_eui, timestamp=payload_timestamp, detectedBeacons=[])
 
         detected_beacons_list = []
@@ -208,7 +416,7 @@ def parse_sensecap_payload(device_eui: str, payload_bytes: bytes) -> Optional[Tr
                     )
                     detected_beacons_list.append(detected)
                 except (ValueError, TypeError) as conv_err:
-                    log.warning(f"Could not convert beacon data for {device_eui}: {beacon_data} - {conv_err}")
+                    ingest_log.warning(("invalid_beacon", device_eui), "Could not convert beacon data for %s: %s - %s", device_eui, beacon_data, conv_err)
             else:
                 # log.debug(f"Skipping beacon entry for {device_eui} due to missing mac or rssi: {beacon_data}") # DEBUG
                 pass # Keep it quiet
@@ -217,14 +425,16 @@ def parse_sensecap_payload(device_eui: str, payload_bytes: bytes) -> Optional[Tr
             # log.info(f"No valid beacons found in SenseCAP payload for tracker {device_eui} after parsing 'value' list.") # Can be noisy
             pass
 
+        deduplication_id = data.get("deduplicationId")
         return TrackerReport(
             trackerId=device_eui,
             timestamp=payload_timestamp,
-            detectedBeacons=detected_beacons_list
+            detectedBeacons=detected_beacons_list,
+            deduplicationId=str(deduplication_id) if deduplication_id is not None else None
         )
 
     except json.JSONDecodeError:
-        log.error(f"Failed to decode JSON payload for {device_eui}: {payload_bytes.decode('utf-8', errors='ignore')}")
+        ingest_log.error(("invalid_json", device_eui), "Failed to decode JSON payload for %s: %s", device_eui, payload_bytes.decode('utf-8', errors='ignore'))
         return None
     except Exception as e:
         log.error(f"Error processing SenseCAP MQTT payload for tracker '{device_eui}': {e}", exc_info=True)
@@ -299,12 +509,18 @@ def _connect_mqtt_client():
         else:
             log.warning("_connect_mqtt_client: Main event loop not available for broadcasting MQTT status for connecting.")
         
+        if mqtt_cfg.ingestMode == "asyncio":
+            if not main_event_loop or not main_event_loop.is_running():
+                raise RuntimeError("MQTT ingestMode 'asyncio' needs the running main event loop")
+            _call_on_event_loop(_start_asyncio_mqtt, mqtt_cfg)
+            return True
+        mqtt_client.reconnect_delay_set(mqtt_cfg.reconnectMinDelaySeconds, mqtt_cfg.reconnectMaxDelaySeconds)
         mqtt_client.connect_async(mqtt_cfg.brokerHost, mqtt_cfg.brokerPort, 60)
         mqtt_client.loop_start() # loop_start is non-blocking and handles reconnects.
         # Status will be updated by on_connect or on_disconnect callbacks
         return True
     except Exception as e:
-        log.error(f"Error during MQTT connect_async or loop_start: {e}", exc_info=True)
+        log.error(f"Error during MQTT connect: {e}", exc_info=True)
         mqtt_connection_status = "error"
         if main_event_loop and main_event_loop.is_running():
             asyncio.run_coroutine_threadsafe(broadcast_mqtt_status(), main_event_loop)
@@ -312,6 +528,41 @@ def _connect_mqtt_client():
             log.warning("_connect_mqtt_client: Main event loop not available for broadcasting MQTT status on error.")
         return False
 
+def _call_on_event_loop(fn, *args):
+    """Runs fn(*args) now if called on the main event loop, else schedules it there."""
+    try:
+        on_loop = asyncio.get_running_loop() is main_event_loop
+    except RuntimeError:
+        on_loop = False
+    if on_loop:
+        fn(*args)
+    else:
+        main_event_loop.call_soon_threadsafe(fn, *args)
+
+def _set_mqtt_status(status: str):
+    """Status callback of the asyncio MQTT connection (runs on the event loop)."""
+    global mqtt_connection_status
+    mqtt_connection_status = status
+    main_event_loop.create_task(broadcast_mqtt_status())
+
+def _start_asyncio_mqtt(mqtt_cfg: MqttServerConfig):
+    """Connects mqtt_client from the event loop (ingestMode 'asyncio'); paho's network thread is not used."""
+    global mqtt_asyncio_connection
+    _stop_asyncio_mqtt() # A connection still retrying with the previous settings
+    mqtt_client.loop_stop() # In case the client was just switched over from ingestMode 'thread'
+    mqtt_asyncio_connection = AsyncioMqttConnection(
+        mqtt_client, main_event_loop,
+        min_delay=mqtt_cfg.reconnectMinDelaySeconds, max_delay=mqtt_cfg.reconnectMaxDelaySeconds,
+        on_status=_set_mqtt_status,
+    )
+    mqtt_asyncio_connection.start(mqtt_cfg.brokerHost, mqtt_cfg.brokerPort, 60)
+
+def _stop_asyncio_mqtt():
+    global mqtt_asyncio_connection
+    if mqtt_asyncio_connection:
+        mqtt_asyncio_connection.stop()
+        mqtt_asyncio_connection = None
+
 def disconnect_mqtt_client(broadcast=True):
     """Disconnects the MQTT client."""
     global mqtt_client, mqtt_connection_status, is_mqtt_intentionally_disconnected, main_event_loop
@@ -319,10 +570,13 @@ def disconnect_mqtt_client(broadcast=True):
     if mqtt_client:
         try:
             # log.info("Disconnecting MQTT client...") # Reduced verbosity
-            # Stop the loop first to prevent immediate auto-reconnect attempts by Paho
-            # Paho's disconnect might also trigger on_disconnect, where status is set.
-            mqtt_client.loop_stop() 
-            mqtt_client.disconnect() 
+            if mqtt_asyncio_connection:
+                _call_on_event_loop(_stop_asyncio_mqtt)
+            else:
+                # Stop the loop first to prevent immediate auto-reconnect attempts by Paho
+                # Paho's disconnect might also trigger on_disconnect, where status is set.
+                mqtt_client.loop_stop() 
+                mqtt_client.disconnect() 
             # on_disconnect should handle setting status to "disconnected" and broadcasting
             # However, ensure status is set if on_disconnect isn't triggered as expected
             if mqtt_connection_status != "disconnected":
@@ -404,11 +658,12 @@ def setup_mqtt(force_reconnect: bool = False):
 def on_message(client, userdata, msg):
     """Callback for when a PUBLISH message is received from the server."""
     global main_event_loop # Access the main event loop
+    received_ms, received = time.time() * 1000, time.perf_counter()
 
     # log.info(f"MQTT Message Received: Topic: {msg.topic}") # Can be very noisy
     topic_parts = msg.topic.split('/')
     if not msg.topic.startswith('/device_sensor_data/') or len(topic_parts) < 7:
-        log.warning(f"Received message on unexpected or incomplete topic structure: {msg.topic}")
+        ingest_log.warning(("unexpected_topic", msg.topic), "Received message on unexpected or incomplete topic structure: %s", msg.topic)
         return
 
     device_eui = topic_parts[3]
@@ -422,57 +677,585 @@ def on_message(client, userdata, msg):
     report = parse_sensecap_payload(device_eui, msg.payload)
 
     if report:
-        if main_event_loop and main_event_loop.is_running():
+        if runtime_cfg and runtime_cfg.latency.enabled:
+            report._trace = LatencyTracker.begin(report.timestamp, received_ms, received)
+            report._trace.mark(latency.DECODE)
+        if mqtt_asyncio_connection is not None and mqtt_asyncio_connection.client is client:
+            # ingestMode 'asyncio': already on the event loop, no thread hop
+            task = main_event_loop.create_task(process_tracker_report(report))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        elif main_event_loop and main_event_loop.is_running():
             asyncio.run_coroutine_threadsafe(process_tracker_report(report), main_event_loop)
         else:
-            log.error("Main asyncio event loop not available or not running. Cannot schedule tracker report processing.")
+            ingest_log.error(("no_event_loop",), "Main asyncio event loop not available or not running. Cannot schedule tracker report processing.")
+    else:
+        ingest_log.warning(("no_report", device_eui), "Failed to parse payload or no report generated for tracker %s from topic %s", device_eui, msg.topic)
+
+
+# --- Tracking Filters ---
+def _get_particle_bank(floor_id: str) -> ParticleFilterBank:
+    """Returns the particle filter bank of a floor, creating it (with the floor's map walls) on first use."""
+    global particle_banks, runtime_cfg, floor_set
+    bank = particle_banks.get(floor_id)
+    if bank is None:
+        tracking = runtime_cfg.tracking
+        floor = floor_set.floors.get(floor_id)
+        bank = particle_banks[floor_id] = ParticleFilterBank(
+            num_particles=tracking.particleCount,
+            process_variance=runtime_cfg.kalman.processVariance,
+            measurement_variance=runtime_cfg.kalman.measurementVariance,
+            wall_index=SegmentGridIndex(floor.spatial_index.wall_segments(), cell_size=tracking.wallIndexCellSize) if floor else None
+        )
+    return bank
+
+def _refresh_floors():
+    """Recompiles the floors of the current Web UI config (spatial indexes are synced incrementally) and the particle wall indexes."""
+    global particle_banks, runtime_cfg, web_ui_cfg, floor_set
+    floor_set = FloorSet.from_config(web_ui_cfg, previous=floor_set, cell_size=SPATIAL_INDEX_CELL_SIZE, geofence_cell_size=_geofence_cell_size())
+    heatmap_aggregator.sync_floors({floor_id: floor.config.map for floor_id, floor in floor_set.floors.items()})
+    solve_memo.clear() # Beacons or floors may have changed
+    stationary_detector.clear() # Stays hold fixes solved against the old beacons
+    for floor in floor_set.floors.values():
+        added, removed = floor.index_changes
+        if not added and not removed:
+            continue
+        log.info(f"Spatial index of floor '{floor.floor_id}' updated: {added} added, {removed} removed.")
+        bank = particle_banks.get(floor.floor_id)
+        if bank is not None and runtime_cfg:
+            bank.set_wall_index(SegmentGridIndex(floor.spatial_index.wall_segments(), cell_size=runtime_cfg.tracking.wallIndexCellSize))
+
+def _configure_geofence():
+    """Applies runtime_cfg.geofence parameters and rebuilds each floor's zone grid from its map."""
+    global runtime_cfg, floor_set
+    for floor in floor_set.floors.values():
+        if runtime_cfg:
+            params = runtime_cfg.geofence
+            floor.geofence_engine.configure(params.hysteresisMeters, params.dwellSeconds, params.gridCellSize)
+        floor.geofence_engine.set_zones(floor.config.map)
+
+def _floor_geofence_events(floor: CompiledFloor, events: List[dict]) -> List[dict]:
+    for event in events:
+        event["floorId"] = floor.floor_id
+    return events
+
+async def _publish_geofence_events(events: List[dict]):
+    """Pushes geofence events to WebSocket clients (subscribed to the event's floor) and, if configured, to the MQTT geofence topic."""
+    global runtime_cfg, mqtt_client, mqtt_connection_status
+    topic = runtime_cfg.geofence.mqttTopic if runtime_cfg else None
+    for event in events:
+        await manager.broadcast({"type": "geofence_event", "data": event}, floor_id=event.get("floorId"))
+        if topic and mqtt_client and mqtt_connection_status == "connected":
+            try:
+                mqtt_client.publish(topic, json.dumps(event))
+            except Exception as e:
+                log.error(f"Error publishing geofence event to MQTT topic {topic}: {e}")
+
+def _configure_rssi_smoother():
+    """(Re)creates the RSSI smoother from runtime_cfg.rssiSmoothing; smoothing windows start empty."""
+    global runtime_cfg, rssi_smoother
+    params = runtime_cfg.rssiSmoothing if runtime_cfg else None
+    if not params or params.method == "none":
+        rssi_smoother = None
+        return
+    rssi_smoother = RssiSmoother(
+        method=params.method,
+        window_size=params.windowSize,
+        ema_alpha=params.emaAlpha,
+        trim_fraction=params.trimFraction,
+        expiry_ms=int(params.expirySeconds * 1000)
+    )
+
+def _record_calibration_samples(report: TrackerReport, floor: CompiledFloor):
+    """
+    Logs (beacon, RSSI, true distance) samples if the report comes from a surveyed
+    reference tag. Reference positions are 2D, so only beacons of the floor the
+    report was routed to are used: one heard through a slab is not at that distance.
+    """
+    global runtime_cfg, web_ui_cfg, calibration_buffer
+    reference_pos = runtime_cfg.calibration.referenceTags.get(report.trackerId)
+    if not reference_pos or len(reference_pos) < 2 or not web_ui_cfg:
+        return
+    if calibration_buffer is None or calibration_buffer.capacity != runtime_cfg.calibration.maxSamples:
+        calibration_buffer = CalibrationSampleBuffer(runtime_cfg.calibration.maxSamples)
+    configured = floor.beacons_by_mac
+    for detected in report.detectedBeacons:
+        beacon = configured.get(detected.macAddress.lower()) if detected.macAddress else None
+        if beacon and -120 <= detected.rssi < 0:
+            calibration_buffer.add(detected.macAddress.lower(), detected.rssi,
+                                   ((beacon.x - reference_pos[0]) ** 2 + (beacon.y - reference_pos[1]) ** 2) ** 0.5)
+
+def _reset_tracking_filters():
+    """Drops all per-tracker filters so they are re-initialized with the current tracking settings."""
+    global particle_banks, kalman_filters
+    kalman_filters.clear()
+    particle_banks.clear()
+
+def _drop_tracking_filter(tracker_id: str):
+    """Removes a tracker's filter (e.g. it changed floors), freeing its particle slot."""
+    kf = kalman_filters.pop(tracker_id, None)
+    if isinstance(kf, MapConstrainedParticleFilter):
+        kf.bank.release(tracker_id)
+
+def _create_tracking_filter(tracker_id: str, initial_pos: Tuple[float, float], floor_id: str):
+    """
+    Creates the per-tracker filter selected by runtime_cfg.tracking.mode (particle
+    filters use the walls of floor_id). Live reports step their tracker's filter
+    one at a time, so a particle filter then propagates only its own slot of the
+    floor's bank; bulk uploads step all trackers together (_run_filter_steps).
+    """
+    global runtime_cfg
+    if runtime_cfg.tracking.mode == "particle":
+        return MapConstrainedParticleFilter(_get_particle_bank(floor_id), tracker_id, initial_pos)
+    return KalmanFilter2D(
+        initial_pos=initial_pos,
+        process_variance=runtime_cfg.kalman.processVariance,
+        measurement_variance=runtime_cfg.kalman.measurementVariance
+    )
+
+
+# --- Config Snapshots and Hot-Reload ---
+def _bump_config_version(name: str) -> int:
+    """Records that a new snapshot of config `name` is live and which file content it corresponds to."""
+    config_versions[name] += 1
+    config_file_mtimes[name] = config_manager.file_mtime_ns(CONFIG_FILES[name])
+    return config_versions[name]
+
+async def _write_config_in_thread(name: str, write_func, *args):
+    """Runs a blocking config write (atomic temp file + rename) in a worker thread."""
+    config_writes_in_progress.add(name)
+    try:
+        return await asyncio.to_thread(write_func, *args)
+    finally:
+        config_writes_in_progress.discard(name)
+
+def _swap_web_ui_config(new_cfg: WebUIConfig) -> int:
+    """Makes new_cfg the live Web UI config and rebuilds what is derived from it."""
+    global web_ui_cfg
+    web_ui_cfg = new_cfg
+    version = _bump_config_version("web")
+    _refresh_floors()
+    _configure_geofence()
+    return version
+
+def _swap_runtime_config(new_cfg: ServerRuntimeConfig) -> Optional[ServerRuntimeConfig]:
+    """Makes new_cfg the live runtime config, re-creating the components whose parameters changed. Returns the old snapshot."""
+    global runtime_cfg
+    old_cfg = runtime_cfg
+    runtime_cfg = new_cfg
+    _bump_config_version("runtime")
+    # Filters must be re-created if their parameters change
+    if not old_cfg or old_cfg.kalman != new_cfg.kalman or old_cfg.tracking != new_cfg.tracking:
+        _reset_tracking_filters()
+    if not old_cfg or old_cfg.rssiSmoothing != new_cfg.rssiSmoothing:
+        _configure_rssi_smoother()
+    _configure_geofence()
+    _configure_diagnostics()
+    _configure_event_time(old_cfg)
+    _configure_pipeline(old_cfg)
+    return old_cfg
+
+def _configure_pipeline(old_cfg: Optional[ServerRuntimeConfig]):
+    """Applies runtime_cfg to the report pipeline components (at startup and on every runtime config swap)."""
+    new_cfg = runtime_cfg
+    report_deduplicator.configure(new_cfg.dedupe.ttlSeconds, new_cfg.dedupe.maxEntries)
+    ws_params = new_cfg.websocket
+    manager.configure_replay(ws_params.replayBufferMessages, ws_params.replayBufferBytes, ws_params.replayMaxAgeSeconds)
+    heatmap_params = new_cfg.heatmap
+    heatmap_aggregator.configure(heatmap_params.cellSize, (heatmap_params.minuteBuckets, heatmap_params.hourBuckets, heatmap_params.dayBuckets))
+    trajectory_cache.configure(new_cfg.trajectory.lodTolerancesMeters, new_cfg.trajectory.maxWindowPoints)
+    solve_memo.configure(new_cfg.solveMemo.maxEntries, new_cfg.solveMemo.rssiStepDb, new_cfg.solveMemo.startCellMeters)
+    if not old_cfg or old_cfg.solver != new_cfg.solver or old_cfg.beaconSelection != new_cfg.beaconSelection:
+        solve_memo.clear()
+        stationary_detector.clear()
+    stationary_detector.configure(new_cfg.stationary.rssiToleranceDb, new_cfg.stationary.minReports, new_cfg.stationary.maxSpeed)
+    shedding = new_cfg.loadShedding
+    overload_controller.configure(
+        shedding.shedLagMs, shedding.severeLagMs, shedding.recoverLagMs, shedding.maxQueuedReports,
+        [PriorityClass(c.name, c.trackers, c.overloadBroadcastIntervalMs) for c in shedding.priorityClasses] +
+        [PriorityClass("default", ["*"], shedding.defaultBroadcastIntervalMs)])
+    latency_tracker.configure(new_cfg.latency.maxSamples, new_cfg.latency.windowSeconds)
+    event_loop_monitor.interval = new_cfg.latency.eventLoopProbeIntervalMs / 1000
+    scanner_ingest.configure(new_cfg.scannerIngest)
+
+def _read_json_file(path: str) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+async def _reload_config_from_disk(name: str):
+    """Parses and validates a config file edited on disk (in a worker thread) and swaps it in."""
+    global miniprogram_cfg, is_mqtt_intentionally_disconnected
+    data = await asyncio.to_thread(_read_json_file, CONFIG_FILES[name])
+    if name == "web":
+        version = _swap_web_ui_config(WebUIConfig(**data))
+    elif name == "runtime":
+        new_cfg = ServerRuntimeConfig(**data)
+        config_manager.server_runtime_cfg_cache = new_cfg
+        old_cfg = _swap_runtime_config(new_cfg)
+        version = config_versions[name]
+        if old_cfg and old_cfg.mqtt != new_cfg.mqtt and new_cfg.mqtt.enabled and not is_mqtt_intentionally_disconnected:
+            log.info("MQTT configuration changed on disk. Reconnecting...")
+            if mqtt_client and mqtt_connection_status in ("connected", "connecting"):
+                disconnect_mqtt_client(broadcast=False)
+            setup_mqtt(force_reconnect=True)
     else:
-        log.warning(f"Failed to parse payload or no report generated for tracker {device_eui} from topic {msg.topic}")
+        miniprogram_cfg = config_manager.miniprogram_cfg_cache = MiniprogramConfig(**data)
+        version = _bump_config_version(name)
+    log.info(f"Reloaded {name} configuration from {CONFIG_FILES[name]} (version {version}).")
+    await manager.broadcast({"type": "config_reloaded", "data": {"config": name, "version": version}})
+
+async def _config_watch_loop():
+    """Polls the config files' mtimes and hot-reloads files edited on disk."""
+    while True:
+        interval = runtime_cfg.server.configWatchIntervalSeconds if runtime_cfg else 2.0
+        await asyncio.sleep(interval if interval > 0 else 5.0)
+        if interval <= 0:
+            continue
+        for name, path in CONFIG_FILES.items():
+            if name in config_writes_in_progress:
+                continue
+            mtime = config_manager.file_mtime_ns(path)
+            if mtime is None or mtime == config_file_mtimes.get(name):
+                continue
+            try:
+                await _reload_config_from_disk(name)
+            except Exception as e: # Invalid JSON or failed validation: keep serving the previous snapshot
+                log.error(f"Ignoring invalid {name} configuration edit in {path}: {e}")
+            config_file_mtimes[name] = mtime # Do not retry the same content
+
+
+# --- Diagnostics ---
+def _configure_diagnostics():
+    """Applies runtime_cfg.diagnostics: queue-based logging and the rate-limit interval of hot-path diagnostics."""
+    global runtime_cfg
+    params = runtime_cfg.diagnostics if runtime_cfg else None
+    if params and params.queueLogging:
+        diagnostics.enable_queue_logging()
+    else:
+        diagnostics.disable_queue_logging()
+    interval = params.rateLimitSeconds if params else 60.0
+    for limiter in (ingest_log, positioning.rate_limited_log):
+        limiter.interval_seconds = interval
+
+async def _diagnostics_summary_loop():
+    """Logs the positioning counters of the last interval instead of one line per beacon / solve."""
+    while True:
+        interval = runtime_cfg.diagnostics.summaryIntervalSeconds if runtime_cfg else 60.0
+        await asyncio.sleep(interval)
+        positioning_counters.log_summary(log, interval)
+
+
+# --- State Snapshots ---
+def _snapshot_path() -> str:
+    """snapshot.path; a relative path is resolved against the server package directory, like WEB_CONFIG_FILE_PATH."""
+    path = runtime_cfg.snapshot.path
+    return path if os.path.isabs(path) else os.path.join(os.path.dirname(__file__), path)
+
+async def _restore_state_snapshot():
+    """
+    Restores tracker states and filters from the last snapshot at startup. Runs as a
+    background task so MQTT connects without waiting for it: the file is read in a
+    worker thread, and reports are held by _wait_for_state_restore until it is done.
+    Snapshots older than snapshot.maxAgeSeconds are ignored; a tracker whose last
+    update is older than snapshot.filterMaxGapSeconds keeps its position and history,
+    but its filter restarts from the last position instead of the saved Kalman state.
+    """
+    global snapshot_restore_info
+    params = runtime_cfg.snapshot
+    path = _snapshot_path()
+    if not params.enabled or not os.path.exists(path):
+        return
+    started = time.perf_counter()
+    try:
+        created_ms, trackers = await asyncio.to_thread(read_snapshot, path)
+    except SnapshotError as e:
+        log.warning(f"Not restoring tracker state: {e}")
+        snapshot_restore_info = {"restored": False, "error": str(e)}
+        return
+    now_ms = int(time.time() * 1000)
+    age_seconds = (now_ms - created_ms) / 1000.0
+    if age_seconds > params.maxAgeSeconds:
+        log.info(f"Not restoring tracker state: snapshot {path} is {age_seconds:.0f}s old (snapshot.maxAgeSeconds {params.maxAgeSeconds:.0f}s).")
+        snapshot_restore_info = {"restored": False, "ageSeconds": age_seconds}
+        return
 
+    filters_restored = filters_restarted = 0
+    for restored in trackers:
+        state = restored.state
+        tracker_states[state.trackerId] = state
+        if state.x is None or state.y is None:
+            continue
+        kf = _create_tracking_filter(state.trackerId, (state.x, state.y), state.floorId or floor_set.default_floor_id())
+        if (restored.kalman_x is not None and isinstance(kf, KalmanFilter2D)
+                and (now_ms - state.last_update_time) / 1000.0 <= params.filterMaxGapSeconds):
+            kf.x, kf.P = restored.kalman_x, restored.kalman_P
+            filters_restored += 1
+        else:
+            filters_restarted += 1
+        kalman_filters[state.trackerId] = kf
+    snapshot_restore_info = {
+        "restored": True, "ageSeconds": age_seconds, "trackers": len(trackers),
+        "filtersRestored": filters_restored, "filtersRestarted": filters_restarted,
+        "durationMs": round((time.perf_counter() - started) * 1000, 2),
+    }
+    startup_timings["stateRestore"] = time.perf_counter() - started
+    log.info(f"Restored {len(trackers)} tracker(s) from {path} ({age_seconds:.1f}s old): "
+             f"{filters_restored} filter(s) restored, {filters_restarted} restarted from the last position.")
+
+async def _wait_for_state_restore():
+    """Returns once the startup restore is done, so nothing is processed (or snapshotted) against an empty state."""
+    task = state_restore_task
+    if task is not None and not task.done():
+        await asyncio.shield(task) # A cancelled waiter must not cancel the restore
+
+def _capture_state_snapshot():
+    """References to the current states and filter arrays (on the event loop) plus the snapshotter for them."""
+    global state_snapshotter
+    path = _snapshot_path()
+    if state_snapshotter is None or str(state_snapshotter.path) != str(Path(path)):
+        state_snapshotter = StateSnapshotter(path)
+    return state_snapshotter, StateSnapshotter.capture(tracker_states, kalman_filters)
+
+async def _state_snapshot_loop():
+    """Writes a snapshot every snapshot.intervalSeconds; encoding and file I/O run in a worker thread."""
+    while True:
+        await asyncio.sleep(runtime_cfg.snapshot.intervalSeconds if runtime_cfg else 5.0)
+        if not runtime_cfg or not runtime_cfg.snapshot.enabled:
+            continue
+        await _wait_for_state_restore()
+        snapshotter, captured = _capture_state_snapshot()
+        try:
+            await asyncio.to_thread(snapshotter.write, captured)
+        except Exception as e:
+            log.error(f"Could not write tracker state snapshot {snapshotter.path}: {e}")
+
+# --- Event-Time Ordering ---
+def _configure_event_time(old_cfg: Optional[ServerRuntimeConfig]):
+    """Applies runtime_cfg.eventTime; leaving event-time mode processes everything still buffered."""
+    params = runtime_cfg.eventTime
+    event_time_orderer.configure(params.allowedLatenessMs, params.maxBufferSize, params.maxHoldMs)
+    if old_cfg and old_cfg.eventTime.mode == "event" and params.mode != "event":
+        released = event_time_orderer.flush_all()
+        if released:
+            asyncio.get_running_loop().create_task(_process_released_reports(released))
+
+async def _process_released_reports(reports: List[TrackerReport]):
+    for report in reports:
+        await _process_tracker_report(report, use_event_time=True)
+
+async def _reprocess_late_report(report: TrackerReport):
+    """
+    Solves a report that arrived after newer reports of its tracker were already
+    filtered and inserts the raw fix into the position history at its event time.
+    The tracking filter is not rewound; its state stays at the newest report.
+    """
+    floors, run_cfg = floor_set, runtime_cfg
+    state = tracker_states.get(report.trackerId)
+    if not floors.beacon_count or not run_cfg or not state:
+        return
+    floor = floors.floors.get(state.floorId or floors.default_floor_id()) # History only holds positions on the current floor
+    if floor is None:
+        return
+    detected, _ = floors.beacons_on_floor(report.detectedBeacons, floor.floor_id)
+    solve_result = _solve_position(run_cfg, floor, detected, (state.x, state.y) if state.x is not None and state.y is not None else None,
+                                   report.trackerId)
+    if not solve_result:
+        return
+    history = list(state.position_history)
+    bisect.insort(history, (solve_result.position[0], solve_result.position[1], report.timestamp), key=lambda p: p[2])
+    tracker_states[report.trackerId] = state.model_copy(update={"position_history": history})
+
+async def _event_time_flush_loop():
+    """Releases reports of trackers that went quiet, so nothing waits longer than eventTime.maxHoldMs."""
+    while True:
+        hold_ms = runtime_cfg.eventTime.maxHoldMs if runtime_cfg else 2000
+        await asyncio.sleep(min(0.5, max(hold_ms, 50) / 2000.0))
+        if runtime_cfg and runtime_cfg.eventTime.mode == "event":
+            await _process_released_reports(event_time_orderer.flush_expired(int(time.time() * 1000)))
+
+def _measurement_covariance(run_cfg: ServerRuntimeConfig, solve_result: positioning.SolveResult) -> Optional[np.ndarray]:
+    """The solver's covariance (plus floor) as the filter's measurement noise if solver.useCovariance, else None (fixed R)."""
+    if run_cfg.solver.useCovariance and solve_result.covariance is not None:
+        return solve_result.covariance + np.eye(2) * run_cfg.solver.covarianceFloor
+    return None
+
+def _solve_position(run_cfg: ServerRuntimeConfig, floor: CompiledFloor, beacons: List[DetectedBeacon],
+                    initial_guess: Optional[Tuple[float, float]], tracker_id: str) -> Optional[positioning.SolveResult]:
+    """
+    Solves a report's position on a floor, reusing a memoized result for the same
+    quantized RSSI and warm start cell (solveMemo.enabled). Under severe overload
+    the solver runs with cheaper settings, and its results are not memoized.
+    """
+    solver, selection = overload_controller.solver_params(run_cfg.solver, run_cfg.beaconSelection)
+    key = None
+    if run_cfg.solveMemo.enabled:
+        key = solve_memo.key(floor.floor_id, beacons, initial_guess)
+        result = solve_memo.get(key)
+        if result is not None:
+            positioning_counters.incr("solves_memoized")
+            return result
+    started = time.perf_counter()
+    result = positioning.calculate_position_result(
+        detected_beacons=beacons,
+        miniprogram_config=floor.config,
+        initial_guess=initial_guess,
+        tracker_id=tracker_id,
+        beacon_selection=selection,
+        solver=solver,
+        beacons_by_mac=floor.beacons_by_mac
+    )
+    if key is not None and solver is run_cfg.solver:
+        solve_memo.put(key, result, time.perf_counter() - started)
+    return result
+
+def _is_duplicate_report(report: TrackerReport) -> bool:
+    if not runtime_cfg or not runtime_cfg.dedupe.enabled or not report_deduplicator.is_duplicate(report):
+        return False
+    positioning_counters.incr("reports_duplicate")
+    return True
 
 async def process_tracker_report(report: TrackerReport):
-    """Processes a parsed tracker report to calculate position and update state."""
-    # Use new global config variables
-    global web_ui_cfg, runtime_cfg, tracker_states, kalman_filters
+    """
+    Entry point for parsed tracker reports. Copies of an already processed report are
+    dropped. With loadShedding.enabled the report is queued by priority class and
+    ingested by the overload controller's worker; otherwise it is ingested directly.
+    """
+    if _is_duplicate_report(report):
+        return
+    if runtime_cfg and runtime_cfg.loadShedding.enabled and overload_controller.running:
+        overload_controller.submit(report)
+        return
+    await _ingest_report(report)
+
+async def _submit_scanner_report(report: TrackerReport):
+    """Entry point for the windowed reports of local-beacon-service scanners (scanner_ingest)."""
+    if runtime_cfg and runtime_cfg.latency.enabled:
+        report._trace = LatencyTracker.begin(report.timestamp, report.timestamp, time.perf_counter())
+    await process_tracker_report(report)
+
+async def _ingest_report(report: TrackerReport):
+    """
+    In event-time mode the report goes through its tracker's reorder buffer and is
+    processed once the watermark passes it; otherwise it is processed immediately
+    in arrival order. Reports arriving during the startup restore wait for it.
+    """
+    await _wait_for_state_restore()
+    params = runtime_cfg.eventTime if runtime_cfg else None
+    if not params or params.mode != "event":
+        await _process_tracker_report(report)
+        return
 
-    if not web_ui_cfg or not web_ui_cfg.beacons:
-        log.warning("Web UI configuration (beacons) not loaded, cannot process tracker report.")
+    receive_ms = int(time.time() * 1000)
+    if report.timestamp > receive_ms + params.maxFutureSkewMs: # Tracker clock far ahead: trust arrival time instead
+        event_time_orderer.counters["futureTimestampsClamped"] += 1
+        report = report.model_copy(update={"timestamp": receive_ms})
+    released, late = event_time_orderer.push(report, receive_ms)
+    if late:
+        if params.latePolicy == "reprocess":
+            event_time_orderer.counters["lateReprocessed"] += 1
+            await _reprocess_late_report(report)
+        else:
+            event_time_orderer.counters["lateDropped"] += 1
+    await _process_released_reports(released)
+
+async def _process_tracker_report(report: TrackerReport, use_event_time: bool = False):
+    """Processes a parsed tracker report to calculate position and update state.
+       With use_event_time, the filter dt, history and geofence timestamps come from the report's payload timestamp."""
+    global tracker_states, kalman_filters
+    # Pin the current config snapshots. A hot-reload may swap the globals while this report
+    # is awaiting a broadcast; the report still finishes with the versions it started with.
+    web_cfg, run_cfg, floors = web_ui_cfg, runtime_cfg, floor_set
+
+    if not web_cfg or not floors.beacon_count:
+        ingest_log.warning(("no_web_ui_cfg",), "Web UI configuration (beacons) not loaded, cannot process tracker report.")
         return
-    if not runtime_cfg:
-        log.warning("Server runtime configuration not loaded, cannot process tracker report for Kalman params.")
+    if not run_cfg:
+        ingest_log.warning(("no_runtime_cfg",), "Server runtime configuration not loaded, cannot process tracker report for Kalman params.")
         return
 
+    trace = report._trace
+    if trace:
+        trace.mark(latency.QUEUE)
     tracker_id = report.trackerId
+    positioning_counters.incr("reports")
     current_time_ms = int(time.time() * 1000)
+    event_time_ms = report.timestamp if use_event_time else current_time_ms
     last_state = tracker_states.get(tracker_id)
     last_known_pos = (last_state.x, last_state.y) if last_state and last_state.x is not None and last_state.y is not None else None
-    dt = (current_time_ms - last_state.last_update_time) / 1000.0 if last_state else 0.1
+    if not last_state:
+        dt = 0.1
+    elif use_event_time: # Reports arrive here in payload-timestamp order
+        dt = max(0.0, (report.timestamp - last_state.last_known_measurement_time) / 1000.0)
+    else:
+        dt = (current_time_ms - last_state.last_update_time) / 1000.0
 
     # Prepare position history from last state
     current_position_history = list(last_state.position_history) if last_state and last_state.position_history else []
 
     # log.info(f"Processing report for {tracker_id} with {len(report.detectedBeacons)} beacons.") # Can be noisy
 
-    calculated_position = positioning.calculate_position(
-        detected_beacons=report.detectedBeacons,
-        miniprogram_config=web_ui_cfg,
-        # signal_propagation_factor is inside web_ui_cfg.settings
-    )
+    # Smooth RSSI per (tracker, beacon) before solving; last_detected_beacons keeps the raw readings
+    beacons_for_solver = rssi_smoother.smooth(tracker_id, report.detectedBeacons, event_time_ms) if rssi_smoother else report.detectedBeacons
+
+    # Route the report to a floor; only that floor's beacons take part in the solve
+    previous_floor_id = last_state.floorId if last_state else None
+    floor = floors.floors[floors.route(beacons_for_solver, previous_floor_id, run_cfg.floors.routingBeacons, run_cfg.floors.switchMarginDb)]
+    beacons_for_solver, other_floor = floors.beacons_on_floor(beacons_for_solver, floor.floor_id)
+    if other_floor:
+        positioning_counters.incr("beacons_other_floor", other_floor)
+    if tracker_id in run_cfg.calibration.referenceTags:
+        _record_calibration_samples(report, floor)
+    geofence_events: List[dict] = []
+    if previous_floor_id is not None and previous_floor_id != floor.floor_id:
+        # Coordinates of different floors are unrelated: restart the filter and the history on the new floor
+        positioning_counters.incr("floor_changes")
+        _drop_tracking_filter(tracker_id)
+        current_position_history, last_known_pos = [], None
+        previous_floor = floors.floors.get(previous_floor_id)
+        if previous_floor:
+            geofence_events.extend(_floor_geofence_events(previous_floor, previous_floor.geofence_engine.remove_tracker(
+                tracker_id, last_state.x, last_state.y, event_time_ms)))
 
     filtered_position: Optional[Tuple[float, float]] = None
     kf = kalman_filters.get(tracker_id)
+    speed = math.hypot(*kf.get_velocity()) if kf else None
+    stay = stationary_detector.observe(tracker_id, beacons_for_solver, speed) if run_cfg.stationary.enabled else None
+    new_fix = True # False if solve_result is a fix the filter has already been updated with
+    if stay is not None and kf is not None:
+        # Same signal as the last reports: the filter is held (no velocity drift; its covariance still grows)
+        # and updated only when the stay's fix is re-solved
+        kf.hold()
+        kf.predict(dt)
+        if stay.needs_solve():
+            stay.result = _solve_position(run_cfg, floor, stay.mean_beacons(), kf.get_position(), tracker_id)
+            stay.solved_at = stay.count
+            solve_result = stay.result
+        elif stay.needs_check(run_cfg.stationary.checkIntervalReports):
+            solve_result = _solve_position(run_cfg, floor, beacons_for_solver, kf.get_position(), tracker_id)
+            if stay.result is None or (solve_result and math.dist(solve_result.position, stay.result.position) > run_cfg.stationary.maxDriftMeters):
+                stationary_detector.end(tracker_id) # Moved away: this report's fix is a regular measurement
+            else:
+                solve_result, new_fix = stay.result, False
+        else:
+            solve_memo.counters["stationarySkips"] += 1
+            positioning_counters.incr("solves_skipped_stationary")
+            solve_result, new_fix = stay.result, False
+    else:
+        # Predict first so the solver is warm-started from where the filter expects the tracker now
+        if kf:
+            kf.predict(dt)
+        solver_seed = kf.get_position() if kf else last_known_pos
+        solve_result = _solve_position(run_cfg, floor, beacons_for_solver, solver_seed, tracker_id)
+    calculated_position = solve_result.position if solve_result else None
+    if trace:
+        trace.mark(latency.SOLVE)
 
-    if calculated_position:
+    if calculated_position and new_fix:
         # log.info(f"Calculated position for {tracker_id}: {calculated_position}") # Can be noisy
         if kf:
-            kf.predict(dt)
-            kf.update(calculated_position)
+            kf.update(calculated_position, _measurement_covariance(run_cfg, solve_result))
         else:
-            kf = KalmanFilter2D(
-                initial_pos=calculated_position,
-                process_variance=runtime_cfg.kalman.processVariance,
-                measurement_variance=runtime_cfg.kalman.measurementVariance
-            )
+            kf = _create_tracking_filter(tracker_id, calculated_position, floor.floor_id)
             kalman_filters[tracker_id] = kf
             # log.info(f"Initialized Kalman filter for {tracker_id} with PV:{runtime_cfg.kalman.processVariance}, MV:{runtime_cfg.kalman.measurementVariance}") # Can be noisy
 
@@ -481,10 +1264,9 @@ async def process_tracker_report(report: TrackerReport):
         
         # Add new position to history
         if filtered_position:
-            current_position_history.append((filtered_position[0], filtered_position[1], current_time_ms))
+            current_position_history.append((filtered_position[0], filtered_position[1], event_time_ms))
 
-    elif kf: # No new calculation, but KF might have predicted
-        kf.predict(dt)
+    elif kf: # No new calculation (or a held stationary tracker), but KF has predicted
         filtered_position = kf.get_position()
         # log.info(f"Position prediction (no new measurement) for {tracker_id}: {filtered_position}") # Can be noisy
         # Optionally, decide if predicted-only positions should go into history.
@@ -494,25 +1276,53 @@ async def process_tracker_report(report: TrackerReport):
         #     current_position_history.append((filtered_position[0], filtered_position[1], current_time_ms))
 
     # Prune history to last 30 minutes (30 * 60 * 1000 ms)
-    history_time_window_ms = 30 * 60 * 1000
-    cutoff_time_ms = current_time_ms - history_time_window_ms
+    cutoff_time_ms = current_time_ms - HISTORY_WINDOW_MS
     current_position_history = [p for p in current_position_history if p[2] >= cutoff_time_ms]
 
+    keep_last = last_state is not None and last_state.floorId in (None, floor.floor_id) # Else the old position is on another floor
     new_state = TrackerState(
         trackerId=tracker_id,
-        x=filtered_position[0] if filtered_position else (last_state.x if last_state else None),
-        y=filtered_position[1] if filtered_position else (last_state.y if last_state else None),
+        x=filtered_position[0] if filtered_position else (last_state.x if keep_last else None),
+        y=filtered_position[1] if filtered_position else (last_state.y if keep_last else None),
         last_update_time=current_time_ms,
         last_known_measurement_time=report.timestamp,
         last_detected_beacons=report.detectedBeacons,
-        position_history=current_position_history
+        position_history=current_position_history,
+        floorId=floor.floor_id
     )
     tracker_states[tracker_id] = new_state
 
+    if filtered_position and run_cfg.geofence.enabled:
+        geofence_events.extend(_floor_geofence_events(floor, floor.geofence_engine.update(
+            tracker_id, filtered_position[0], filtered_position[1], event_time_ms)))
+    if filtered_position and run_cfg.heatmap.enabled:
+        heatmap_aggregator.add(floor.floor_id, filtered_position[0], filtered_position[1], event_time_ms)
+    if geofence_events:
+        await _publish_geofence_events(geofence_events)
+    if trace:
+        trace.mark(latency.FILTER)
+
+    if not overload_controller.broadcast_allowed(tracker_id, current_time_ms):
+        return # Overloaded: this tracker was broadcast recently enough for its priority class
+    await manager.broadcast({
+        "type": "tracker_update", 
+        "data": {tracker_id: _tracker_update_payload(new_state, floor, solve_result)}
+    }, floor_id=floor.floor_id, trace=trace)
+    if trace:
+        latency_tracker.finish(trace, floor.floor_id)
+
+def _tracker_update_payload(new_state: TrackerState, floor: Optional[CompiledFloor], solve_result: Optional[positioning.SolveResult]) -> dict:
+    """Builds the WebSocket tracker_update entry of one tracker."""
     # Prepare data for WebSocket broadcast
     position_payload = None
     if new_state.x is not None and new_state.y is not None:
         position_payload = {"x": new_state.x, "y": new_state.y}
+        if solve_result:
+            position_payload["solver"] = {
+                "iterations": solve_result.iterations,
+                "covariance": solve_result.covariance.tolist() if solve_result.covariance is not None else None,
+                "residualRms": solve_result.residual_rms,
+            }
         # Add accuracy if available and needed by frontend, e.g.:
         # if kf and hasattr(kf, 'get_accuracy_somehow'): 
         #    position_payload['accuracy'] = kf.get_accuracy_somehow()
@@ -520,11 +1330,11 @@ async def process_tracker_report(report: TrackerReport):
     # Construct the data payload for the specific tracker_id
 
     enriched_detected_beacons = []
-    if new_state.last_detected_beacons and web_ui_cfg and web_ui_cfg.beacons:
-        configured_beacons_map = {b.macAddress: b for b in web_ui_cfg.beacons if b.macAddress} # Create a map for quick lookup by MAC
+    if new_state.last_detected_beacons and floor and floor.beacons_by_mac:
+        configured_beacons_map = floor.beacons_by_mac # Beacons of the tracker's floor, by lowercase MAC
         for detected_b in new_state.last_detected_beacons:
             enriched_b_data = detected_b.model_dump() # Start with macAddress, rssi, etc. from DetectedBeacon
-            configured_b = configured_beacons_map.get(detected_b.macAddress)
+            configured_b = configured_beacons_map.get(detected_b.macAddress.lower())
             if configured_b:
                 enriched_b_data['txPower'] = configured_b.txPower
                 enriched_b_data['name'] = configured_b.displayName
@@ -541,22 +1351,224 @@ async def process_tracker_report(report: TrackerReport):
         # Fallback if no web_ui_cfg.beacons or no detected_beacons, send basic detected beacon info
         enriched_detected_beacons = [b.model_dump() for b in new_state.last_detected_beacons] if new_state.last_detected_beacons else []
 
-    tracker_data_payload = {
+    return {
         "trackerId": new_state.trackerId,
         "timestamp": new_state.last_update_time, 
         "position": position_payload, 
         "last_detected_beacons": enriched_detected_beacons, # Use the enriched list
-        "position_history": new_state.position_history
+        "position_history": new_state.position_history,
+        "floorId": new_state.floorId
     }
 
-    await manager.broadcast({
-        "type": "tracker_update", 
-        "data": {tracker_id: tracker_data_payload}
-    })
+def _websocket_snapshot(floors: Optional[set]) -> List[dict]:
+    """What a resuming WebSocket client gets when its missed broadcasts are no longer buffered."""
+    floors_by_id = floor_set.floors
+    default_floor = floor_set.default_floor_id()
+    trackers = {}
+    for tracker_id, state in list(tracker_states.items()):
+        floor_id = state.floorId or default_floor
+        if floors is None or floor_id in floors:
+            trackers[tracker_id] = _tracker_update_payload(state, floors_by_id.get(floor_id), None)
+    return [
+        {"type": "initial_state", "data": trackers},
+        {"type": "mqtt_status_update", "data": {"status": mqtt_connection_status}},
+    ]
+
+manager.snapshot_provider = _websocket_snapshot
+
+# --- Bulk Report Ingestion ---
+def _run_filter_steps(filters: List[Any], step_filter: np.ndarray, step_rank: np.ndarray, dts: np.ndarray,
+                      measurements: np.ndarray, has_measurement: np.ndarray, covariances: Optional[np.ndarray]) -> np.ndarray:
+    """
+    Filter steps of a batch, vectorized across trackers for Kalman and for particle
+    filters; one at a time for a mix of both, or when two particle filters share a
+    slot (a tracker that left a floor and came back within the batch).
+    """
+    if all(isinstance(f, KalmanFilter2D) for f in filters):
+        return positioning.kalman_filter_batch(filters, step_filter, step_rank, dts, measurements, has_measurement, covariances)
+    if (all(isinstance(f, MapConstrainedParticleFilter) for f in filters)
+            and len({(id(f.bank), f.slot) for f in filters}) == len(filters)):
+        return particle_filter_batch(filters, step_filter, step_rank, dts, measurements, has_measurement, covariances)
+    positions = np.empty((len(dts), 2))
+    for i in range(len(dts)): # Steps were appended per tracker in timestamp order
+        f = filters[step_filter[i]]
+        f.predict(dts[i])
+        if has_measurement[i]:
+            covariance = covariances[i] if covariances is not None and np.isfinite(covariances[i]).all() else None
+            f.update((measurements[i, 0], measurements[i, 1]), covariance)
+        positions[i] = f.get_position()
+    return positions
+
+async def _process_report_batch(reports: List[TrackerReport], floors: FloorSet, run_cfg: ServerRuntimeConfig,
+                                summary: BatchSummary, latest_results: Dict[str, Optional[positioning.SolveResult]]):
+    """
+    Positions a chunk of bulk-uploaded reports. Reports are routed to floors (per
+    tracker, in timestamp order), then ranged and solved vectorized per floor.
+    Each tracker's reports then become filter steps in timestamp order, run for
+    all trackers together (_run_filter_steps); as for live reports, a floor
+    change restarts the tracker's filter and history. Reports older than what a
+    tracker's filter has already seen go into its history as raw fixes, like
+    late reports in event-time mode.
+    """
+    reports.sort(key=lambda r: r.timestamp) # Stable: equal timestamps keep upload order
+    current_time_ms = int(time.time() * 1000)
+    positioning_counters.incr("reports", len(reports))
+    params = run_cfg.floors
+    beacons_for_solver, report_floors = [], []
+    floor_reports: Dict[str, List[int]] = {} # floor -> indexes of its reports
+    routed_floor: Dict[str, Optional[str]] = {} # tracker -> floor of its newest routed report
+    for i, report in enumerate(reports):
+        tracker_id = report.trackerId
+        beacons = report.detectedBeacons
+        if rssi_smoother: # Copied: the smoother's objects are overwritten by the tracker's next report, before this chunk is solved
+            beacons = [b.model_copy() for b in rssi_smoother.smooth(tracker_id, beacons, report.timestamp)]
+        state = tracker_states.get(tracker_id)
+        if state and state.last_known_measurement_time is not None and report.timestamp < state.last_known_measurement_time:
+            floor_id = floors.route(beacons, state.floorId, params.routingBeacons, params.switchMarginDb) # Too old to move the tracker
+        else:
+            previous = routed_floor[tracker_id] if tracker_id in routed_floor else (state.floorId if state else None)
+            floor_id = routed_floor[tracker_id] = floors.route(beacons, previous, params.routingBeacons, params.switchMarginDb)
+        beacons, other_floor = floors.beacons_on_floor(beacons, floor_id)
+        if other_floor:
+            positioning_counters.incr("beacons_other_floor", other_floor)
+        if tracker_id in run_cfg.calibration.referenceTags:
+            _record_calibration_samples(report, floors.floors[floor_id])
+        beacons_for_solver.append(beacons)
+        report_floors.append(floor_id)
+        floor_reports.setdefault(floor_id, []).append(i)
+    results: List[Optional[positioning.SolveResult]] = [None] * len(reports)
+    for floor_id, indexes in floor_reports.items():
+        floor = floors.floors[floor_id]
+        floor_results = positioning.calculate_positions_batch([beacons_for_solver[i] for i in indexes], floor.config,
+                                                              run_cfg.beaconSelection, run_cfg.solver, table=floor.beacon_table)
+        for i, result in zip(indexes, floor_results):
+            results[i] = result
+
+    by_tracker: Dict[str, List[Tuple[TrackerReport, Optional[positioning.SolveResult], str]]] = {}
+    for report, result, floor_id in zip(reports, results, report_floors):
+        by_tracker.setdefault(report.trackerId, []).append((report, result, floor_id))
+
+    # One filter step per report the tracker's filter has not seen yet (the report that creates a filter is not a step)
+    filters: List[Any] = []
+    step_filter, step_rank, step_dt, step_measurement, step_covariance = [], [], [], [], []
+    nan_position, nan_covariance = (np.nan, np.nan), np.full((2, 2), np.nan)
+    tracker_points: Dict[str, list] = {} # tracker -> [(step index or (x, y), timestamp, kind, floor)] in timestamp order
+    tracker_last: Dict[str, Tuple[Optional[int], List[DetectedBeacon], Optional[str]]] = {} # tracker -> (last measurement time, beacons, floor)
+    replaced_filters: List[Tuple[str, Any]] = [] # Filters left behind on a floor change; particle slots are freed after the steps ran
+    for tracker_id, items in by_tracker.items():
+        state = tracker_states.get(tracker_id)
+        last_measurement_ms = state.last_known_measurement_time if state else None
+        last_beacons = state.last_detected_beacons if state else []
+        floor_id = state.floorId if state else None
+        kf = kalman_filters.get(tracker_id)
+        slot, rank = None, 0
+        points = tracker_points[tracker_id] = []
+        for report, result, report_floor in items:
+            if last_measurement_ms is not None and report.timestamp < last_measurement_ms:
+                merged = result is not None and report_floor == (floor_id or report_floor)
+                if merged:
+                    points.append((result.position, report.timestamp, "merged", report_floor))
+                summary.outcomes["merged_into_history" if merged else "not_positioned"] += 1
+                continue
+            if floor_id is not None and report_floor != floor_id:
+                positioning_counters.incr("floor_changes")
+                if kf is not None:
+                    replaced_filters.append((tracker_id, kalman_filters.pop(tracker_id)))
+                kf, slot, rank = None, None, 0
+                points.append((None, report.timestamp, "floor", report_floor))
+            floor_id = report_floor
+            summary.outcomes["positioned" if result else "not_positioned"] += 1
+            if result:
+                latest_results[tracker_id] = result
+            if kf is None:
+                if result:
+                    kf = kalman_filters[tracker_id] = _create_tracking_filter(tracker_id, result.position, floor_id)
+                    points.append((kf.get_position(), report.timestamp, "filtered", floor_id))
+            else:
+                if slot is None:
+                    slot = len(filters)
+                    filters.append(kf)
+                step_filter.append(slot)
+                step_rank.append(rank)
+                step_dt.append((report.timestamp - last_measurement_ms) / 1000.0 if last_measurement_ms is not None else 0.1)
+                step_measurement.append(result.position if result else nan_position)
+                if run_cfg.solver.useCovariance:
+                    covariance = _measurement_covariance(run_cfg, result) if result else None
+                    step_covariance.append(nan_covariance if covariance is None else covariance)
+                points.append((len(step_filter) - 1, report.timestamp, "filtered" if result else "predicted", floor_id))
+                rank += 1
+            last_measurement_ms, last_beacons = report.timestamp, report.detectedBeacons
+        tracker_last[tracker_id] = (last_measurement_ms, last_beacons, floor_id)
+
+    measurements = np.array(step_measurement, dtype=np.float64).reshape(-1, 2)
+    step_positions = _run_filter_steps(filters, np.array(step_filter, dtype=np.int64), np.array(step_rank, dtype=np.int64),
+                                       np.array(step_dt, dtype=np.float64), measurements, ~np.isnan(measurements[:, 0]),
+                                       np.array(step_covariance) if step_covariance else None)
+    for tracker_id, old_filter in replaced_filters:
+        current = kalman_filters.get(tracker_id)
+        if isinstance(old_filter, MapConstrainedParticleFilter) and getattr(current, "bank", None) is not old_filter.bank:
+            old_filter.bank.release(tracker_id)
+
+    geofence_events = []
+    cutoff_time_ms = current_time_ms - HISTORY_WINDOW_MS
+    for tracker_id, points in tracker_points.items():
+        state = tracker_states.get(tracker_id)
+        history = list(state.position_history) if state else []
+        x, y = (state.x, state.y) if state else (None, None)
+        current_floor_id = state.floorId if state else None
+        merged = False
+        for where, timestamp, kind, point_floor in points:
+            if kind == "floor":
+                previous_floor = floors.floors.get(current_floor_id)
+                if previous_floor:
+                    geofence_events.extend(_floor_geofence_events(previous_floor, previous_floor.geofence_engine.remove_tracker(tracker_id, x, y, timestamp)))
+                history, x, y, current_floor_id = [], None, None, point_floor
+                continue
+            position = step_positions[where] if isinstance(where, int) else where
+            if kind == "merged":
+                history.append((float(position[0]), float(position[1]), timestamp))
+                merged = True
+                continue
+            x, y = float(position[0]), float(position[1])
+            if kind == "filtered":
+                history.append((x, y, timestamp))
+                if run_cfg.geofence.enabled:
+                    floor = floors.floors[point_floor]
+                    geofence_events.extend(_floor_geofence_events(floor, floor.geofence_engine.update(tracker_id, x, y, timestamp)))
+                if run_cfg.heatmap.enabled:
+                    heatmap_aggregator.add(point_floor, x, y, timestamp)
+        if merged:
+            history.sort(key=lambda p: p[2])
+        last_measurement_ms, last_beacons, floor_id = tracker_last[tracker_id]
+        tracker_states[tracker_id] = TrackerState(
+            trackerId=tracker_id,
+            x=x,
+            y=y,
+            last_update_time=current_time_ms,
+            last_known_measurement_time=last_measurement_ms,
+            last_detected_beacons=last_beacons,
+            position_history=[p for p in history if p[2] >= cutoff_time_ms],
+            floorId=floor_id
+        )
+        summary.trackers.add(tracker_id)
+    summary.accepted += len(reports)
+    if geofence_events:
+        await _publish_geofence_events(geofence_events)
 
 # --- Configuration Loading for Web UI ---
+def _geofence_cell_size() -> float:
+    return runtime_cfg.geofence.gridCellSize if runtime_cfg else GeofenceEngine().cell_size
+
+def _compile_web_ui_config(raw: bytes) -> dict:
+    """Parses and validates web_config.json and compiles its floors (cached by config_cache)."""
+    config = WebUIConfig(**json.loads(raw))
+    return {
+        "config": config,
+        "floor_set": FloorSet.from_config(config, cell_size=SPATIAL_INDEX_CELL_SIZE, geofence_cell_size=_geofence_cell_size()),
+    }
+
 def load_web_ui_config() -> Optional[WebUIConfig]:
-    global web_ui_cfg
+    global web_ui_cfg, floor_set, web_config_cache_hit
     if not os.path.exists(WEB_CONFIG_FILE_PATH):
         log.info(f"Web UI configuration file not found at {WEB_CONFIG_FILE_PATH}. Initializing with defaults.")
         # Initialize with default if file doesn't exist
@@ -565,11 +1577,13 @@ def load_web_ui_config() -> Optional[WebUIConfig]:
         save_web_ui_config(web_ui_cfg) # Save the initial default config
         return web_ui_cfg
     try:
-        with open(WEB_CONFIG_FILE_PATH, 'r') as f:
-            data = json.load(f)
-            web_ui_cfg = WebUIConfig(**data)
-            log.info(f"Web UI configuration loaded successfully from {WEB_CONFIG_FILE_PATH}.")
-            return web_ui_cfg
+        compiled, web_config_cache_hit = config_cache.load_compiled(
+            WEB_CONFIG_FILE_PATH, _compile_web_ui_config, params=(SPATIAL_INDEX_CELL_SIZE, _geofence_cell_size())
+        )
+        web_ui_cfg = compiled["config"]
+        floor_set = compiled["floor_set"]
+        log.info(f"Web UI configuration loaded successfully from {WEB_CONFIG_FILE_PATH}" + (" (compiled cache)." if web_config_cache_hit else "."))
+        return web_ui_cfg
     except FileNotFoundError:
         log.warning(f"Web UI configuration file not found at {WEB_CONFIG_FILE_PATH} during load attempt. This should have been handled by prior check.")
         return None # Should not happen if check above is correct
@@ -582,8 +1596,7 @@ def load_web_ui_config() -> Optional[WebUIConfig]:
 
 def save_web_ui_config(config_data: WebUIConfig) -> bool:
     try:
-        with open(WEB_CONFIG_FILE_PATH, 'w') as f:
-            json.dump(config_data.model_dump(mode='json'), f, indent=4)
+        config_manager.atomic_write_json(WEB_CONFIG_FILE_PATH, config_data.model_dump(mode='json'), indent=4)
         log.info(f"Web UI configuration saved successfully to {WEB_CONFIG_FILE_PATH}.")
         return True
     except Exception as e:
@@ -602,49 +1615,92 @@ async def startup_event():
     log.info("Server startup sequence initiated.")
     
     # Load server runtime configuration first as it might be needed by other components
-    runtime_cfg = config_manager.load_server_runtime_config()
+    with _startup_stage("runtimeConfig"):
+        runtime_cfg = config_manager.load_server_runtime_config()
     if not runtime_cfg:
         log.error("Critical: Server runtime configuration could not be loaded. MQTT and other services might not start.")
         # Depending on desired behavior, could raise an exception or proceed with limited functionality
     else:
         log.info(f"Server runtime configuration loaded. MQTT enabled: {runtime_cfg.mqtt.enabled}")
+        _bump_config_version("runtime")
+        _configure_rssi_smoother()
+        _configure_event_time(None)
+        _configure_pipeline(None)
+    _configure_diagnostics()
+    global diagnostics_summary_task, event_time_flush_task, load_shedding_task, event_loop_monitor_task
+    diagnostics_summary_task = asyncio.create_task(_diagnostics_summary_loop())
+    event_time_flush_task = asyncio.create_task(_event_time_flush_loop())
+    load_shedding_task = asyncio.create_task(overload_controller.run(_ingest_report))
+    event_loop_monitor_task = asyncio.create_task(event_loop_monitor.run())
+    scanner_ingest.start(_submit_scanner_report)
 
     # Load miniprogram configuration
-    miniprogram_cfg = config_manager.load_miniprogram_config()
+    with _startup_stage("miniprogramConfig"):
+        miniprogram_cfg = config_manager.load_miniprogram_config()
     if not miniprogram_cfg:
         log.warning("Miniprogram configuration (map_beacon_config.json) not found or failed to load. Positioning may be affected.")
     else:
         # log.info("Miniprogram configuration (map_beacon_config.json) loaded.") # Reduced verbosity
-        pass
+        _bump_config_version("miniprogram")
 
     # Load Web UI configuration
-    web_ui_cfg = load_web_ui_config() # This will create a default if not found
-    if not web_ui_cfg:
-        log.warning("Web UI configuration (web_config.json) not found or failed to load. Web UI may not function as expected initially.")
-    else:
-        # log.info("Web UI configuration (web_config.json) loaded/initialized.") # Reduced verbosity
-        pass
+    with _startup_stage("webConfig"):
+        web_ui_cfg = load_web_ui_config() # This will create a default if not found
+        if not web_ui_cfg:
+            log.warning("Web UI configuration (web_config.json) not found or failed to load. Web UI may not function as expected initially.")
+        else:
+            # log.info("Web UI configuration (web_config.json) loaded/initialized.") # Reduced verbosity
+            _swap_web_ui_config(web_ui_cfg)
+
+    # In the background; reports received meanwhile wait for it (_wait_for_state_restore)
+    global state_restore_task
+    if runtime_cfg:
+        state_restore_task = asyncio.create_task(_restore_state_snapshot())
 
     if runtime_cfg and runtime_cfg.mqtt.enabled:
-        setup_mqtt() # Initialize and connect MQTT client
+        with _startup_stage("mqttSetup"):
+            setup_mqtt() # Initialize and connect MQTT client
     else:
         log.info("MQTT client is disabled in server runtime configuration. Skipping MQTT setup.")
         global mqtt_connection_status
         mqtt_connection_status = "disabled"
         await broadcast_mqtt_status() # Inform clients that MQTT is disabled
     
-    log.info("Server startup complete.")
+    global config_watch_task, state_snapshot_task
+    config_watch_task = asyncio.create_task(_config_watch_loop())
+    state_snapshot_task = asyncio.create_task(_state_snapshot_loop())
+    startup_timings["total"] = time.perf_counter() - _import_started
+    log.info("Server startup complete. Startup timing: " +
+             ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in startup_timings.items()) +
+             f" (web config cache {'hit' if web_config_cache_hit else 'miss'})")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Runs on application shutdown."""
     global mqtt_client
     log.info("Application shutdown...")
-    if mqtt_client and mqtt_client.is_connected():
+    if mqtt_asyncio_connection:
+        _stop_asyncio_mqtt()
+        log.info("MQTT client disconnected.")
+    elif mqtt_client and mqtt_client.is_connected():
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
         log.info("MQTT client disconnected.")
+    scanner_ingest.stop()
+    for task in (diagnostics_summary_task, config_watch_task, event_time_flush_task, state_snapshot_task, load_shedding_task, event_loop_monitor_task):
+        if task:
+            task.cancel()
+    if state_restore_task and not state_restore_task.done(): # Stopped while restoring: keep the old snapshot
+        state_restore_task.cancel()
+    elif runtime_cfg and runtime_cfg.snapshot.enabled: # Final snapshot, so a restart during a deploy loses nothing
+        try:
+            snapshotter, captured = _capture_state_snapshot()
+            await asyncio.to_thread(snapshotter.write, captured)
+        except Exception as e:
+            log.error(f"Could not write the final tracker state snapshot: {e}")
+    positioning_counters.log_summary(log, runtime_cfg.diagnostics.summaryIntervalSeconds if runtime_cfg else 60.0)
     log.info("Application shutdown complete.")
+    diagnostics.disable_queue_logging() # Flushes pending records
 
 # --- API Endpoints ---
 @app.get("/")
@@ -670,8 +1726,9 @@ async def upload_miniprogram_config(config_content: MiniprogramConfig, response:
     # log.info("Received request to upload miniprogram configuration.") # Reduced verbosity
     try:
         # config_content is already parsed by FastAPI into MiniprogramConfig model
-        if config_manager.save_miniprogram_config(config_content):
+        if await _write_config_in_thread("miniprogram", config_manager.save_miniprogram_config, config_content):
             miniprogram_cfg = config_manager.get_miniprogram_config() # Reload and update global cache
+            _bump_config_version("miniprogram")
             log.info("Miniprogram configuration uploaded and reloaded successfully.")
             # Broadcast update to WebSocket clients
             await manager.broadcast({"type": "config_update", "data": miniprogram_cfg.model_dump() if miniprogram_cfg else {}})
@@ -695,9 +1752,234 @@ async def get_api_miniprogram_config():
         raise HTTPException(status_code=503, detail="Miniprogram configuration not loaded.")
 
 @app.get("/api/trackers")
-async def get_trackers():
+async def get_trackers(
+    lod: int = Query(0, ge=0, description="History level of detail: 0 = raw, 1.. = simplified (runtime trajectory.lodTolerancesMeters)")
+):
     """Returns the current state of all known trackers."""
-    return tracker_states
+    if not lod:
+        return tracker_states
+    return {
+        tracker_id: state.model_copy(update={"position_history": trajectory_cache.simplified(tracker_id, state.position_history, lod)})
+        for tracker_id, state in list(tracker_states.items())
+    }
+
+def _history_export_response(series: List[Tuple[str, Any]], export_format: str, start: Optional[int], end: Optional[int],
+                             interval_ms: Optional[int], filename: str) -> StreamingResponse:
+    # Sync generator: Starlette iterates it in a worker thread, off the event loop
+    return StreamingResponse(
+        history_export.EXPORTERS[export_format](series, start, end, interval_ms),
+        media_type=history_export.MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
+
+@app.get("/api/trackers/{tracker_id}/history")
+async def get_tracker_history(
+    tracker_id: str,
+    format: Literal["ndjson", "csv", "npy"] = Query("ndjson", description="ndjson, csv or npy (structured array: trackerId, timestamp, x, y)"),
+    start: Optional[int] = Query(None, description="Earliest timestamp (Unix ms, inclusive)"),
+    end: Optional[int] = Query(None, description="Latest timestamp (Unix ms, inclusive)"),
+    intervalMs: Optional[int] = Query(None, ge=1, description="Downsample: keep the first point of each interval"),
+    lod: int = Query(0, ge=0, description="History level of detail: 0 = raw, 1.. = simplified (runtime trajectory.lodTolerancesMeters)")
+):
+    """Streams one tracker's position history."""
+    state = tracker_states.get(tracker_id)
+    if not state:
+        raise HTTPException(status_code=404, detail=f"Unknown tracker '{tracker_id}'.")
+    history = trajectory_cache.simplified(tracker_id, state.position_history, lod)
+    return _history_export_response([(tracker_id, history)], format, start, end, intervalMs, f"{tracker_id}_history")
+
+@app.get("/api/history/export")
+async def export_history(
+    trackers: Optional[str] = Query(None, description="Comma-separated tracker ids; all trackers if omitted"),
+    format: Literal["ndjson", "csv", "npy"] = Query("ndjson", description="ndjson, csv or npy (structured array: trackerId, timestamp, x, y)"),
+    start: Optional[int] = Query(None, description="Earliest timestamp (Unix ms, inclusive)"),
+    end: Optional[int] = Query(None, description="Latest timestamp (Unix ms, inclusive)"),
+    intervalMs: Optional[int] = Query(None, ge=1, description="Downsample: keep the first point of each interval per tracker"),
+    lod: int = Query(0, ge=0, description="History level of detail: 0 = raw, 1.. = simplified (runtime trajectory.lodTolerancesMeters)")
+):
+    """Streams the position histories of several trackers, grouped by tracker."""
+    states = dict(tracker_states) # Snapshot of the tracker set; each history list is itself immutable
+    tracker_ids = [t for t in (trackers.split(",") if trackers else sorted(states)) if t]
+    unknown = [t for t in tracker_ids if t not in states]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown tracker(s): {', '.join(unknown)}")
+    series = [(t, trajectory_cache.simplified(t, states[t].position_history, lod)) for t in tracker_ids]
+    return _history_export_response(series, format, start, end, intervalMs, "history")
+
+@app.get("/api/geofence/zones")
+async def get_geofence_zones():
+    """Returns the configured geofence zones of every floor and the trackers currently inside each."""
+    zones = []
+    for floor in floor_set.floors.values():
+        occupancy = floor.geofence_engine.occupancy()
+        zones.extend(
+            {"zoneId": zone.zone_id, "name": zone.name, "floorId": floor.floor_id, "trackers": occupancy.get(zone.zone_id, [])}
+            for zone in floor.geofence_engine.zones.values()
+        )
+    return zones
+
+@app.get("/api/heatmap")
+async def get_heatmap(
+    floor: Optional[str] = Query(None, description="Floor id; the first floor if omitted"),
+    start: Optional[int] = Query(None, description="Window start (Unix ms, inclusive); default one hour before end"),
+    end: Optional[int] = Query(None, description="Window end (Unix ms, exclusive); default now"),
+    format: Literal["json", "npy"] = Query("json", description="json, or npy (int64 counts, rows = y)"),
+    tileSize: Optional[int] = Query(None, ge=1, description="Return one tile of tileSize x tileSize cells instead of the whole grid"),
+    tileX: int = Query(0, ge=0, description="Tile column (with tileSize)"),
+    tileY: int = Query(0, ge=0, description="Tile row (with tileSize)"),
+):
+    """
+    Occupancy counts (filtered positions per cell) of a floor over a time window, summed
+    from the minute / hour / day rollups. The window is aligned to whole minutes
+    (or coarser buckets where finer ones are no longer kept); start / end in the
+    response are the window actually covered.
+    """
+    floor_id = floor or floor_set.default_floor_id()
+    if floor_id not in floor_set.floors:
+        raise HTTPException(status_code=404, detail=f"Unknown floor '{floor_id}'.")
+    heatmap = heatmap_aggregator.floors.get(floor_id)
+    if heatmap is None:
+        raise HTTPException(status_code=404, detail=f"No heatmap for floor '{floor_id}' (no map, or no positions yet).")
+    end_ms = end if end is not None else int(time.time() * 1000)
+    start_ms = start if start is not None else end_ms - 3_600_000
+    if start_ms >= end_ms:
+        raise HTTPException(status_code=400, detail="start must be before end.")
+    grid, covered_start, covered_end, buckets = heatmap.query(start_ms, end_ms)
+    row0 = col0 = 0
+    if tileSize:
+        row0, col0 = tileY * tileSize, tileX * tileSize
+        if row0 >= grid.shape[0] or col0 >= grid.shape[1]:
+            raise HTTPException(status_code=404, detail=f"Tile ({tileX}, {tileY}) is outside the {grid.shape[1]} x {grid.shape[0]} cell grid.")
+        grid = grid[row0:row0 + tileSize, col0:col0 + tileSize]
+    meta = {
+        "floorId": floor_id,
+        "cellSize": heatmap.cell_size,
+        "origin": [col0 * heatmap.cell_size, row0 * heatmap.cell_size], # Meters of the grid's first cell
+        "shape": list(grid.shape),
+        "start": covered_start,
+        "end": covered_end,
+        "buckets": buckets,
+        "total": int(grid.sum()),
+        "max": int(grid.max()) if grid.size else 0,
+    }
+    if format == "npy":
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(grid))
+        headers = {f"X-Heatmap-{k[0].upper()}{k[1:]}": json.dumps(v) if isinstance(v, (list, dict)) else str(v) for k, v in meta.items()}
+        return Response(content=buffer.getvalue(), media_type="application/octet-stream", headers=headers)
+    return {**meta, "counts": grid.tolist()}
+
+@app.get("/api/floors")
+async def get_floors():
+    """Lists the configured floors / sites with their beacon counts and the trackers currently on each."""
+    trackers: Dict[str, List[str]] = {}
+    for tracker_id, state in tracker_states.items():
+        if state.floorId:
+            trackers.setdefault(state.floorId, []).append(tracker_id)
+    return [{**floor.info(), "trackers": trackers.get(floor.floor_id, [])} for floor in floor_set.floors.values()]
+
+@app.get("/api/diagnostics/positioning")
+async def get_positioning_diagnostics():
+    """Cumulative positioning counters (reports, beacons used / rejected by reason, solve outcomes)."""
+    return positioning_counters.snapshot()
+
+@app.post("/api/reports/batch")
+async def ingest_report_batch(request: Request):
+    """
+    Bulk ingestion of buffered tracker reports: a streamed NDJSON body, gzip-compressed
+    if Content-Encoding (or Content-Type) says so, one report per line (see batch_ingest.py).
+    The body is parsed incrementally and positioned in chunks. Returns accepted /
+    rejected counts; one tracker_update per affected tracker is broadcast at the end.
+    A body over batch_ingest.MAX_BODY_BYTES (decompressed) is cut off with 413; the
+    reports before the limit are kept.
+    """
+    web_cfg, run_cfg, floors = web_ui_cfg, runtime_cfg, floor_set
+    if not web_cfg or not floors.beacon_count or not run_cfg:
+        raise HTTPException(status_code=503, detail="Web UI or runtime configuration not loaded; cannot position reports.")
+    await _wait_for_state_restore()
+    started = time.perf_counter()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    gzipped = request.headers.get("content-encoding", "").lower() == "gzip" or content_type in ("application/gzip", "application/x-gzip")
+
+    summary = BatchSummary()
+    latest_results: Dict[str, Optional[positioning.SolveResult]] = {}
+    pending: List[TrackerReport] = []
+    status_code = 200
+    try:
+        async for line_number, line in batch_ingest.iter_ndjson_lines(request.stream(), gzipped):
+            try:
+                report = batch_ingest.parse_report_line(line)
+            except BatchLineError as e:
+                summary.reject(line_number, e)
+                continue
+            if _is_duplicate_report(report):
+                summary.outcomes["duplicate"] += 1
+                continue
+            pending.append(report)
+            if len(pending) >= BATCH_CHUNK_REPORTS:
+                await _process_report_batch(pending, floors, run_cfg, summary, latest_results)
+                pending = []
+    except BatchStreamError as e:
+        summary.stream_error = str(e)
+        status_code = 413 if isinstance(e, BatchTooLargeError) else 400
+    if pending:
+        await _process_report_batch(pending, floors, run_cfg, summary, latest_results)
+
+    for tracker_id in summary.trackers:
+        state = tracker_states[tracker_id]
+        await manager.broadcast({
+            "type": "tracker_update",
+            "data": {tracker_id: _tracker_update_payload(state, floors.floors.get(state.floorId), latest_results.get(tracker_id))}
+        }, floor_id=state.floorId)
+    result = summary.to_dict(time.perf_counter() - started)
+    log.info(f"Batch upload: {result['accepted']} report(s) accepted, {result['rejected']} rejected, "
+             f"{result['trackers']} tracker(s), {result['elapsedMs']:.0f}ms")
+    return JSONResponse(status_code=status_code, content=result)
+
+@app.get("/api/diagnostics/snapshot")
+async def get_snapshot_diagnostics():
+    """Result of the startup restore and of the latest tracker state snapshot write."""
+    return {"restore": snapshot_restore_info, "lastWrite": state_snapshotter.last_write if state_snapshotter else {}}
+
+@app.get("/api/diagnostics/dedupe")
+async def get_dedupe_diagnostics():
+    """Report deduplication counters: reports checked, duplicates dropped (hitRate), expired / evicted keys."""
+    return {"enabled": runtime_cfg.dedupe.enabled if runtime_cfg else None, **report_deduplicator.metrics()}
+
+@app.get("/api/diagnostics/websocket")
+async def get_websocket_diagnostics():
+    """WebSocket session epoch, latest broadcast seq, connected clients and replay buffer usage."""
+    return {"epoch": manager.epoch, "seq": manager.seq, "clients": len(manager.active_connections), "replay": manager.replay.metrics()}
+
+@app.get("/api/diagnostics/trajectory")
+async def get_trajectory_diagnostics():
+    """History simplification: incremental updates vs. rebuilds and points kept per level of detail."""
+    return trajectory_cache.metrics()
+
+@app.get("/api/diagnostics/solve-memo")
+async def get_solve_memo_diagnostics():
+    """Solves avoided by the solve memo (hitRate) and by stationary detection, with the estimated CPU time saved."""
+    return {"memo": solve_memo.metrics(), "stationary": stationary_detector.metrics()}
+
+@app.get("/api/diagnostics/load")
+async def get_load_diagnostics():
+    """Report queue: overload level, queued reports per priority class, end-to-end lag percentiles and work shed."""
+    return overload_controller.metrics()
+
+@app.get("/api/diagnostics/scanners")
+async def get_scanner_diagnostics():
+    """local-beacon-service scanners: connection status, advertisements received and reports produced."""
+    return scanner_ingest.metrics()
+
+@app.get("/api/diagnostics/heatmap")
+async def get_heatmap_diagnostics():
+    """Per-floor heatmap grids: positions counted, out-of-map positions, buckets kept and memory used."""
+    return heatmap_aggregator.metrics()
+
+@app.get("/api/diagnostics/event-time")
+async def get_event_time_diagnostics():
+    """Reorder-buffer counters (reordered / late / dropped / reprocessed reports) and receive-minus-payload timestamp skew."""
+    return {"mode": runtime_cfg.eventTime.mode if runtime_cfg else None, **event_time_orderer.metrics()}
 
 @app.get("/api/server-runtime-config", response_model=Optional[config_manager.ServerRuntimeConfig])
 async def get_api_server_runtime_config():
@@ -746,9 +2028,9 @@ async def update_api_server_runtime_config(config_payload: config_manager.Server
                  mqtt_reconnect_needed = True # If user enables it again after manual disconnect
 
         # Save the new configuration (this handles the password placeholder logic internally)
-        success, new_cfg = config_manager.save_server_runtime_config(config_payload)
+        success, new_cfg = await _write_config_in_thread("runtime", config_manager.save_server_runtime_config, config_payload)
         if success and new_cfg:
-            runtime_cfg = new_cfg # Update global runtime_cfg with the effectively saved one
+            _swap_runtime_config(new_cfg) # Update global runtime_cfg with the effectively saved one
             log.info("Server runtime configuration updated successfully.")
 
             # Handle MQTT client based on changes
@@ -800,7 +2082,7 @@ async def api_mqtt_connect():
         log.warning("MQTT Connect API: Runtime configuration or MQTT section not found.")
         raise HTTPException(status_code=400, detail="MQTT configuration not available.")
     
-    runtime_cfg = current_runtime_cfg # Update global runtime_cfg
+    _swap_runtime_config(current_runtime_cfg) # Update global runtime_cfg
 
     if not runtime_cfg.mqtt.enabled:
         log.info("MQTT Connect API: MQTT is disabled in configuration. Cannot connect manually unless enabled first.")
@@ -830,9 +2112,27 @@ async def api_mqtt_disconnect():
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """Handles WebSocket connections."""
-    await manager.connect(websocket)
+    """
+    Handles WebSocket connections. Tracker updates and geofence events can be limited
+    to some floors with ?floors=a,b or a {"command": "subscribe", "floors": [...]}
+    message (an empty list subscribes to all floors again). A client that lost its
+    connection reconnects with ?resume_from=<last seq received>&epoch=<session epoch>
+    to get only the broadcasts it missed (see ConnectionManager.connect). ?lod=<level>
+    or {"command": "subscribe", "lod": <level>} selects simplified position histories.
+    """
+    floors_param = websocket.query_params.get("floors")
+    try:
+        lod = int(websocket.query_params.get("lod") or 0)
+    except ValueError:
+        lod = 0
+    resume_param = websocket.query_params.get("resume_from")
     try:
+        resume_from = int(resume_param) if resume_param not in (None, "") else None
+    except ValueError:
+        resume_from = -1 # Not a sequence number: a snapshot is sent
+    try:
+        await manager.connect(websocket, {f for f in floors_param.split(",") if f} if floors_param else None,
+                              resume_from=resume_from, epoch=websocket.query_params.get("epoch"), lod=lod)
         while True:
             data = await websocket.receive_text()
             # log.info(f"WebSocket received: {data}") # Can be noisy
@@ -850,6 +2150,21 @@ async def websocket_endpoint(websocket: WebSocket):
                     # TODO: Implement logic to stop Bluetooth scanning here
                     # For now, send a confirmation that scan stopped.
                     await manager.broadcast({"type": "info", "message": "Scanning stopped."})
+                elif command == "subscribe":
+                    if "floors" in message or "lod" not in message: # A lod-only subscribe keeps the floors
+                        floors = message.get("floors") or []
+                        if not isinstance(floors, list):
+                            floors = [floors]
+                        manager.subscribe(websocket, {str(f) for f in floors})
+                    if "lod" in message:
+                        try:
+                            manager.set_history_lod(websocket, int(message["lod"] or 0))
+                        except (TypeError, ValueError):
+                            pass
+                    await websocket.send_text(json.dumps({"type": "subscribed", "data": {
+                        "floors": sorted(manager.floor_subscriptions.get(id(websocket), ())),
+                        "lod": manager.history_lods.get(id(websocket), 0),
+                    }}))
                 elif message.get("action") == "request_initial_data": # Example action, kept for now
                     # Send initial data if needed
                     await manager.broadcast({"type": "initial_data", "payload": "some_initial_state"})
@@ -872,8 +2187,8 @@ async def websocket_endpoint(websocket: WebSocket):
 async def upload_web_ui_config(config_content: WebUIConfig, response: Response):
     global web_ui_cfg
     try:
-        if save_web_ui_config(config_content):
-            web_ui_cfg = config_content # Update in-memory cache
+        if await _write_config_in_thread("web", save_web_ui_config, config_content):
+            _swap_web_ui_config(config_content) # Update in-memory snapshot
             # log.info("Web UI configuration successfully received and saved.") # Reduced verbosity
             return {"message": "Web UI configuration saved successfully."}
         else:
@@ -883,6 +2198,33 @@ async def upload_web_ui_config(config_content: WebUIConfig, response: Response):
         # It's good practice to re-raise HTTPException or return a proper error response
         raise HTTPException(status_code=500, detail=f"Internal server error while saving Web UI configuration: {str(e)}")
 
+@app.get("/api/health/startup")
+async def get_startup_timing():
+    """Startup-timing report: seconds spent per startup stage since process import."""
+    return {"stages": startup_timings, "webConfigCacheHit": web_config_cache_hit}
+
+@app.get("/api/health/latency")
+async def get_latency_health():
+    """
+    End-to-end latency of live reports (payload timestamp to position broadcast) per
+    site, with per-stage percentiles, checked against latency.sloMs at
+    latency.sloPercentile; plus event loop lag against latency.eventLoopLagSloMs.
+    """
+    params = runtime_cfg.latency if runtime_cfg else LatencyParams()
+    report = latency_tracker.report(params.sloMs, params.sloPercentile)
+    event_loop = event_loop_monitor.report(params.eventLoopLagSloMs)
+    return {
+        "ok": event_loop["ok"] and all(site["ok"] for site in report["sites"].values()),
+        "slo": {"ms": params.sloMs, "percentile": params.sloPercentile},
+        **report,
+        "eventLoop": event_loop,
+    }
+
+@app.get("/api/configuration/versions")
+async def get_config_versions():
+    """Version of the live snapshot of each config; incremented on every save or hot-reload."""
+    return config_versions
+
 @app.get("/api/configuration/web", response_model=Optional[WebUIConfig])
 async def get_web_ui_config():
     global web_ui_cfg
@@ -897,6 +2239,38 @@ async def get_web_ui_config():
         log.warning("GET /api/configuration/web: No Web UI configuration available after load attempt.")
         return WebUIConfig(map=None, beacons=[], settings=WebUISettings()) # Use direct model name
 
+# --- Calibration Endpoints ---
+@app.get("/api/calibration")
+async def get_calibration_status():
+    """Returns the number of buffered reference-tag samples per beacon."""
+    if not calibration_buffer:
+        return {"samples": 0, "perBeacon": {}}
+    return {"samples": calibration_buffer.size, "perBeacon": calibration_buffer.counts()}
+
+@app.post("/api/calibration/fit")
+async def fit_calibration(apply: bool = Query(False, description="Write the fitted txPower / n into web_config.json")):
+    """Fits txPower and path loss exponent per beacon from the buffered samples, optionally applying them."""
+    global web_ui_cfg
+    if not calibration_buffer or not calibration_buffer.size:
+        raise HTTPException(status_code=400, detail="No calibration samples collected. Configure calibration.referenceTags first.")
+    samples = calibration_buffer.snapshot() # Copied on the event loop, where reports keep adding samples
+    results = await asyncio.to_thread(samples.fit, runtime_cfg.calibration.minSamplesPerBeacon)
+    updated = 0
+    if apply and results and web_ui_cfg:
+        new_cfg, updated = apply_calibration(web_ui_cfg, results)
+        if not await _write_config_in_thread("web", save_web_ui_config, new_cfg):
+            raise HTTPException(status_code=500, detail="Failed to save calibrated Web UI configuration.")
+        _swap_web_ui_config(new_cfg) # Swap in the complete new config in one assignment
+        log.info(f"Applied calibration to {updated} beacon(s).")
+    return {"results": results, "applied": updated}
+
+@app.delete("/api/calibration/samples")
+async def clear_calibration_samples():
+    """Discards all buffered calibration samples."""
+    if calibration_buffer:
+        calibration_buffer.clear()
+    return {"message": "Calibration samples cleared."}
+
 @app.get("/api/default-test-config")
 async def get_default_test_config():
     if not os.path.exists(DEFAULT_TEST_CONFIG_PATH):
@@ -926,6 +2300,7 @@ async def get_map_example_format():
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    import uvicorn
     # Load runtime config first for server port
     # config_manager loads both on import, so we can get it directly.
     rt_cfg = config_manager.get_server_runtime_config()
@@ -1,6 +1,6 @@
 # server/models.py
-from pydantic import BaseModel, Field, AliasChoices
-from typing import List, Optional, Tuple
+from pydantic import BaseModel, Field, AliasChoices, PrivateAttr
+from typing import Any, Dict, List, Literal, Optional, Tuple
 
 # --- Models for Miniprogram Exported Configuration (e.g., map_beacon_config.json) ---
 
@@ -45,6 +45,8 @@ class WebUIMapEntity(BaseModel):
     lineWidth: Optional[float] = None
     fillColor: Optional[str] = None # If supporting filled shapes
     # 'color' was in MiniprogramMapEntity, MapEditorTab uses strokeColor, fillColor
+    name: Optional[str] = None # Used as zone id for geofences
+    geofence: Optional[bool] = None # A closed entity with geofence=True is evaluated as a geofence zone
 
 class WebUIMapInfo(BaseModel):
     name: Optional[str] = None # Optional name for the map layout itself
@@ -62,14 +64,25 @@ class WebUIBeaconConfig(BaseModel):
     displayName: Optional[str] = Field(default=None, description="User-friendly display name for the beacon")
     macAddress: Optional[str] = Field(default=None, description="Physical MAC address, if known/relevant")
     # deviceId is not used here as uuid/major/minor are primary keys
+    signalPropagationFactor: Optional[float] = Field(default=None, ge=1.0, le=6.0, description="Per-beacon path loss exponent 'n' (e.g. from calibration); overrides settings.signalPropagationFactor")
 
 class WebUISettings(BaseModel):
     signalPropagationFactor: float = Field(default=2.5, ge=1.0, le=6.0, description="Path loss exponent 'n' for RSSI to distance conversion")
 
+class WebUIFloorConfig(BaseModel):
+    id: str = Field(..., min_length=1, description="Floor / site id; reports are routed to a floor and WebSocket clients subscribe by it")
+    name: Optional[str] = None
+    site: Optional[str] = Field(default=None, description="Building or site the floor belongs to")
+    level: Optional[int] = Field(default=None, description="Floor number within the site")
+    map: Optional[WebUIMapInfo] = None
+    beacons: List[WebUIBeaconConfig] = []
+    settings: Optional[WebUISettings] = Field(default=None, description="Overrides the top-level settings for this floor")
+
 class WebUIConfig(BaseModel):
     map: Optional[WebUIMapInfo] = None # Map can be optional initially
     beacons: List[WebUIBeaconConfig] = []
     settings: WebUISettings
+    floors: List[WebUIFloorConfig] = [] # Additional floors / sites; the top-level map and beacons are the floor "default"
 
 
 # --- Models for Server-Side Runtime Configuration (e.g., server_runtime_config.json) ---
@@ -84,18 +97,174 @@ class MqttServerConfig(BaseModel): # Renamed from MqttConfig to avoid clash if o
     clientID: Optional[str] = Field(default=None, validation_alias=AliasChoices('clientID', 'clientId'))
     enabled: bool = Field(default=True, description="Enable or disable MQTT client")
     live_mqtt_status: Optional[str] = Field(default=None, description="Live MQTT connection status, not saved to file")
+    ingestMode: Literal["thread", "asyncio"] = Field(default="thread", description="'thread': paho's network thread (loop_start); 'asyncio': the client socket is driven by the server's event loop")
+    reconnectMinDelaySeconds: int = Field(default=1, ge=1, description="First reconnect delay after a failed or lost connection; doubles per attempt")
+    reconnectMaxDelaySeconds: int = Field(default=60, ge=1, description="Upper bound of the reconnect delay")
 
 class WebServerConfig(BaseModel): # Renamed from ServerConfig
     port: int = Field(default=8000, description="Port for the FastAPI web server")
+    configWatchIntervalSeconds: float = Field(default=2.0, ge=0, description="How often config files are checked for edits on disk and hot-reloaded (0 disables)")
 
 class KalmanParams(BaseModel):
     processVariance: float = Field(default=1.0, description="Kalman filter process variance Q")
     measurementVariance: float = Field(default=10.0, description="Kalman filter measurement variance R")
 
+class TrackingParams(BaseModel):
+    mode: Literal["kalman", "particle"] = Field(default="kalman", description="Per-tracker filter: 'kalman' (KalmanFilter2D) or 'particle' (map-constrained particle filter)")
+    particleCount: int = Field(default=500, ge=10, description="Particles per tracker in 'particle' mode")
+    wallIndexCellSize: float = Field(default=1.0, gt=0, description="Cell size in meters of the wall segment grid used for wall-crossing tests")
+
+class RssiSmoothingParams(BaseModel):
+    method: Literal["none", "ema", "median", "trimmed_mean"] = Field(default="none", description="Per-(tracker, beacon) RSSI filter applied before distance calculation")
+    windowSize: int = Field(default=5, ge=1, le=64, description="Number of recent readings kept per (tracker, beacon)")
+    emaAlpha: float = Field(default=0.3, gt=0, le=1, description="Weight of the newest reading for 'ema'")
+    trimFraction: float = Field(default=0.2, ge=0, lt=0.5, description="Fraction dropped from each end of the window for 'trimmed_mean'")
+    expirySeconds: float = Field(default=30.0, gt=0, description="A beacon not heard for this long starts a new window when heard again (only beacons of the current report are passed to the solver)")
+
+class CalibrationParams(BaseModel):
+    referenceTags: Dict[str, List[float]] = Field(default_factory=dict, description="Tracker id -> surveyed [x, y] of reference tags whose reports are logged as calibration samples")
+    maxSamples: int = Field(default=1_000_000, ge=1000, description="Capacity of the online calibration sample buffer (oldest samples are overwritten)")
+    minSamplesPerBeacon: int = Field(default=50, ge=3, description="Beacons with fewer samples are not fitted")
+
+class GeofenceParams(BaseModel):
+    enabled: bool = Field(default=True, description="Evaluate geofence zones on every position update")
+    hysteresisMeters: float = Field(default=0.5, ge=0, description="A tracker only exits a zone once it is this far outside its boundary")
+    dwellSeconds: float = Field(default=60.0, gt=0, description="Time inside a zone after which a dwell event is emitted")
+    gridCellSize: float = Field(default=2.0, gt=0, description="Cell size in meters of the precomputed zone grid")
+    mqttTopic: Optional[str] = Field(default=None, description="If set, geofence events are also published to this MQTT topic")
+
+class BeaconSelectionParams(BaseModel):
+    enabled: bool = Field(default=False, description="Solve on a geometry-aware subset when a tracker hears more than subsetSize beacons (helps against NLOS-biased far beacons; with pure noise it can cost accuracy)")
+    maxCandidates: int = Field(default=8, ge=3, le=32, description="Nearest beacons (by estimated distance) considered for the subset")
+    subsetSize: int = Field(default=6, ge=3, description="Beacons passed to the solver; the subset with the lowest weighted GDOP is chosen")
+    maxSubsets: int = Field(default=512, ge=1, description="Evaluate all subsets up to this many combinations, otherwise use greedy elimination")
+
+class SolverParams(BaseModel):
+    stepTolerance: float = Field(default=0.01, gt=0, description="Multilateration stops once a step moves the position less than this (meters)")
+    maxIterations: int = Field(default=20, ge=1, description="Iterations before falling back to scipy's Levenberg-Marquardt")
+    useCovariance: bool = Field(default=False, description="Weight each measurement in the tracking filter by the solver's covariance instead of the fixed measurement variance")
+    covarianceFloor: float = Field(default=0.5, gt=0, description="Minimum variance (m^2) added to the solver covariance when useCovariance is on")
+
+class DiagnosticsParams(BaseModel):
+    queueLogging: bool = Field(default=True, description="Write log records from a background thread so logging never blocks the event loop")
+    rateLimitSeconds: float = Field(default=60.0, gt=0, description="Minimum interval between repeated diagnostics for the same tracker / beacon")
+    summaryIntervalSeconds: float = Field(default=60.0, gt=0, description="Interval of the positioning summary log line (counts of used / rejected beacons and solves)")
+
+class EventTimeParams(BaseModel):
+    mode: Literal["processing", "event"] = Field(default="processing", description="'event' reorders each tracker's reports by payload timestamp and takes the filter dt from it; 'processing' handles reports in arrival order")
+    allowedLatenessMs: int = Field(default=2000, ge=0, description="Watermark lag: a report is released once a report this much newer has been seen")
+    maxBufferSize: int = Field(default=16, ge=1, description="Reports held per tracker before the oldest is released regardless of the watermark")
+    maxHoldMs: int = Field(default=2000, ge=0, description="Maximum wall time a report waits in the reorder buffer")
+    latePolicy: Literal["drop", "reprocess"] = Field(default="drop", description="Reports older than the last released one: 'drop' them, or 'reprocess' them into the position history (the filter is not rewound)")
+    maxFutureSkewMs: int = Field(default=60000, ge=0, description="Payload timestamps further than this ahead of the server clock are replaced by the receive time")
+
+class SnapshotParams(BaseModel):
+    enabled: bool = Field(default=True, description="Periodically snapshot tracker state and filters, and restore them on startup")
+    path: str = Field(default="state_snapshot.bin", description="Snapshot file (a relative path is resolved against the server package directory)")
+    intervalSeconds: float = Field(default=5.0, gt=0, description="Interval between snapshots (a final one is written on shutdown)")
+    maxAgeSeconds: float = Field(default=3600.0, gt=0, description="Snapshots older than this are not restored")
+    filterMaxGapSeconds: float = Field(default=30.0, ge=0, description="Filters of trackers not updated for longer than this are restarted from the last position instead of restored")
+
+class FloorParams(BaseModel):
+    routingBeacons: int = Field(default=3, ge=1, description="Strongest known beacons of a report that decide its floor (weighted by received power)")
+    switchMarginDb: float = Field(default=6.0, ge=0, description="A tracker only moves to another floor once that floor's received power exceeds its current floor's by this much")
+
+class DedupeParams(BaseModel):
+    enabled: bool = Field(default=True, description="Drop reports already processed (multi-gateway uplinks, QoS 1 redeliveries)")
+    ttlSeconds: float = Field(default=60.0, gt=0, description="How long a report is remembered")
+    maxEntries: int = Field(default=200_000, ge=1000, description="Reports remembered at most; the least recently seen are evicted first")
+
+class WebSocketParams(BaseModel):
+    replayBufferMessages: int = Field(default=10_000, ge=0, description="Recent broadcasts kept for clients resuming with /ws?resume_from=<seq>")
+    replayBufferBytes: int = Field(default=64 << 20, ge=0, description="Upper bound of the replay buffer's total message size")
+    replayMaxAgeSeconds: float = Field(default=300.0, gt=0, description="Broadcasts older than this are not replayed; the client gets a snapshot instead")
+
+class HeatmapParams(BaseModel):
+    enabled: bool = Field(default=True, description="Count every filtered position in per-floor occupancy grids (GET /api/heatmap)")
+    cellSize: float = Field(default=1.0, gt=0, description="Heatmap cell size in meters; changing it resets the grids")
+    minuteBuckets: int = Field(default=120, ge=1, description="Minute buckets kept per floor")
+    hourBuckets: int = Field(default=72, ge=1, description="Hour buckets kept per floor")
+    dayBuckets: int = Field(default=31, ge=1, description="Day (UTC) buckets kept per floor")
+
+class TrajectoryParams(BaseModel):
+    lodTolerancesMeters: List[float] = Field(default=[0.25, 1.0, 4.0], description="Simplification tolerance of history levels of detail 1, 2, ... (level 0 = raw); clients choose one with ?lod=")
+    maxWindowPoints: int = Field(default=256, ge=2, description="Consecutive points dropped at most before one is kept (bounds the per-report update cost)")
+
+class SolveMemoParams(BaseModel):
+    enabled: bool = Field(default=False, description="Reuse solve results of reports with the same beacons and (quantized) RSSI; saves CPU at some accuracy cost")
+    maxEntries: int = Field(default=50_000, ge=100, description="Solve results kept; the least recently used are evicted first")
+    rssiStepDb: float = Field(default=2.0, gt=0, description="RSSI quantization of the memo key; larger = more hits, coarser positions")
+    startCellMeters: float = Field(default=1.0, gt=0, description="Grid cell of the solver's warm start in the memo key: results are only reused for starts in the same cell")
+
+class StationaryParams(BaseModel):
+    enabled: bool = Field(default=False, description="Skip the solve and hold the filter while a tracker's RSSI stays the same (off by default: slow movers lag behind)")
+    rssiToleranceDb: float = Field(default=2.0, gt=0, description="RMS deviation of recent RSSI from the stay's mean up to which a tracker counts as not moving")
+    minReports: int = Field(default=3, ge=1, description="Reports a stay needs before the tracker counts as stationary")
+    maxSpeed: float = Field(default=0.3, ge=0, description="Filter speed (m/s) above which a stay does not start counting as stationary")
+    checkIntervalReports: int = Field(default=4, ge=1, description="While stationary, every this many reports the report itself is solved to check that the tracker has not crept away")
+    maxDriftMeters: float = Field(default=1.5, gt=0, description="A check solve farther than this from the stay's fix ends the stay")
+
+class PriorityClassParams(BaseModel):
+    name: str = Field(..., description="Class name, e.g. 'personnel'")
+    trackers: List[str] = Field(default_factory=list, description="Tracker id patterns of the class (fnmatch, e.g. 'C3000000*')")
+    overloadBroadcastIntervalMs: int = Field(default=1000, ge=0, description="While overloaded, a tracker of the class is broadcast at most this often")
+
+class LoadSheddingParams(BaseModel):
+    enabled: bool = Field(default=True, description="Queue reports by priority class and shed work when they wait too long")
+    shedLagMs: int = Field(default=1000, ge=1, description="Queue wait from which only a tracker's newest report is processed and broadcasts are throttled")
+    severeLagMs: int = Field(default=5000, ge=1, description="Queue wait from which the solver also runs with cheaper settings")
+    recoverLagMs: int = Field(default=250, ge=0, description="Queue wait below which shedding stops")
+    maxQueuedReports: int = Field(default=100_000, ge=1, description="Reports queued at most; beyond that the oldest of the lowest class are dropped")
+    priorityClasses: List[PriorityClassParams] = Field(default_factory=list, description="Classes served first to last; trackers matching none are in a last 'default' class")
+    defaultBroadcastIntervalMs: int = Field(default=2000, ge=0, description="overloadBroadcastIntervalMs of the 'default' class")
+
+class LatencyParams(BaseModel):
+    enabled: bool = Field(default=True, description="Trace live reports from payload timestamp to broadcast (GET /api/health/latency)")
+    sloMs: float = Field(default=2000.0, gt=0, description="End-to-end latency target: payload timestamp to position broadcast")
+    sloPercentile: float = Field(default=95.0, gt=0, le=100, description="Percentile of the end-to-end latency that must be within sloMs")
+    windowSeconds: float = Field(default=300.0, gt=0, description="Reports of the last windowSeconds make up the percentiles")
+    maxSamples: int = Field(default=4096, ge=16, description="Reports kept per site (floor) at most, newest first")
+    eventLoopLagSloMs: float = Field(default=100.0, gt=0, description="p99 event loop lag up to which the loop counts as healthy")
+    eventLoopProbeIntervalMs: float = Field(default=250.0, gt=0, description="Interval of the event loop lag probe")
+
+class ScannerSourceParams(BaseModel):
+    url: str = Field(..., description="WebSocket URL of a local-beacon-service, e.g. ws://192.168.1.20:8081")
+    trackerId: str = Field(..., description="Tracker id the scanner's reports are positioned as")
+    ignoredMacAddresses: List[str] = Field(default_factory=list, description="Sent with startScan; the service does not forward these beacons")
+
+class ScannerIngestParams(BaseModel):
+    enabled: bool = Field(default=False, description="Connect to the scanners and position their reports like tracker reports")
+    scanners: List[ScannerSourceParams] = Field(default_factory=list, description="local-beacon-service instances to ingest from")
+    windowMs: int = Field(default=1000, ge=100, description="Advertisements of this long a window make up one report")
+    aggregate: Literal["mean", "max"] = Field(default="mean", description="RSSI of a beacon in a report: mean or maximum of its advertisements in the window")
+    minAdvertisements: int = Field(default=1, ge=1, description="Advertisements a beacon needs in a window to be part of the report")
+    startScan: bool = Field(default=True, description="Send startScan on connect (else a browser client of the service has to start scanning)")
+    reconnectMinDelaySeconds: float = Field(default=1.0, gt=0, description="First reconnect delay after a failed or lost connection; doubles per attempt")
+    reconnectMaxDelaySeconds: float = Field(default=30.0, gt=0, description="Upper bound of the reconnect delay")
+
 class ServerRuntimeConfig(BaseModel):
     mqtt: MqttServerConfig
     server: WebServerConfig
     kalman: KalmanParams
+    tracking: TrackingParams = Field(default_factory=TrackingParams)
+    rssiSmoothing: RssiSmoothingParams = Field(default_factory=RssiSmoothingParams)
+    calibration: CalibrationParams = Field(default_factory=CalibrationParams)
+    geofence: GeofenceParams = Field(default_factory=GeofenceParams)
+    diagnostics: DiagnosticsParams = Field(default_factory=DiagnosticsParams)
+    beaconSelection: BeaconSelectionParams = Field(default_factory=BeaconSelectionParams)
+    solver: SolverParams = Field(default_factory=SolverParams)
+    eventTime: EventTimeParams = Field(default_factory=EventTimeParams)
+    snapshot: SnapshotParams = Field(default_factory=SnapshotParams)
+    floors: FloorParams = Field(default_factory=FloorParams)
+    dedupe: DedupeParams = Field(default_factory=DedupeParams)
+    websocket: WebSocketParams = Field(default_factory=WebSocketParams)
+    heatmap: HeatmapParams = Field(default_factory=HeatmapParams)
+    trajectory: TrajectoryParams = Field(default_factory=TrajectoryParams)
+    solveMemo: SolveMemoParams = Field(default_factory=SolveMemoParams)
+    stationary: StationaryParams = Field(default_factory=StationaryParams)
+    loadShedding: LoadSheddingParams = Field(default_factory=LoadSheddingParams)
+    latency: LatencyParams = Field(default_factory=LatencyParams)
+    scannerIngest: ScannerIngestParams = Field(default_factory=ScannerIngestParams)
 
 
 # --- Tracker Data Models (remain largely unchanged) ---
@@ -110,6 +279,8 @@ class TrackerReport(BaseModel):
     trackerId: str # Corresponds to device devEui from MQTT topic
     timestamp: int # Unix ms timestamp from message payload
     detectedBeacons: List[DetectedBeacon]
+    deduplicationId: Optional[str] = None # Network server uplink id, shared by the copies of one uplink
+    _trace: Any = PrivateAttr(default=None) # latency.ReportTrace of a live report, not serialized
 
 class TrackerState(BaseModel):
     trackerId: str
@@ -119,6 +290,7 @@ class TrackerState(BaseModel):
     last_known_measurement_time: Optional[int] = None # Unix ms timestamp (from original report)
     last_detected_beacons: List[DetectedBeacon] = [] 
     position_history: List[Tuple[float, float, int]] = [] # List of (x, y, timestamp_ms)
+    floorId: Optional[str] = None # Floor the position (and history) refers to
 
 # --- Old combined ConfigData and CommonSettings (can be removed after refactoring) ---
 # class OldBeaconConfig(BaseModel):
@@ -0,0 +1,177 @@
+# server/mqtt_asyncio.py
+"""
+Runs a paho MQTT client on the asyncio event loop instead of paho's network thread.
+
+paho's external-loop hooks (on_socket_open / close / register_write /
+unregister_write) register the client socket with loop.add_reader /
+add_writer, so reads, writes and every callback (on_connect, on_message, ...)
+run on the event loop; a message is handed to the report pipeline without a
+thread hop. Only the blocking TCP connect runs in a worker thread.
+AsyncioMqttConnection keeps the client connected, reconnecting with
+exponential backoff (with jitter) after connect failures and lost connections.
+"""
+import asyncio
+import logging
+import random
+import socket
+import threading
+from typing import Callable, Optional
+
+import paho.mqtt.client as mqtt
+
+log = logging.getLogger(__name__)
+
+MISC_INTERVAL_SECONDS = 1.0 # Keepalive pings / timeouts (paho's loop_misc)
+READ_BATCH = 8 # Packets read per readable event at most
+
+class AsyncioMqttConnection:
+    """Drives one paho client from an asyncio loop and reconnects it with backoff."""
+    def __init__(self, client: mqtt.Client, loop: asyncio.AbstractEventLoop,
+                 min_delay: float = 1.0, max_delay: float = 60.0,
+                 on_status: Optional[Callable[[str], None]] = None):
+        self.client = client
+        self.loop = loop
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.on_status = on_status # Called on the loop with "connecting" / "error" around (re)connect attempts
+        self.reconnects = 0
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._misc_task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._was_connected = False # Whether the socket that closed last had completed the MQTT handshake
+        self._fd: Optional[int] = None # File descriptor registered with the loop
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def start(self, host: str, port: int, keepalive: int = 60) -> asyncio.Task:
+        """Starts connecting; must be called on the loop."""
+        self._loop_thread = threading.get_ident()
+        self._task = self.loop.create_task(self._run(host, port, keepalive))
+        self._misc_task = self.loop.create_task(self._misc())
+        return self._task
+
+    def stop(self):
+        """
+        Disconnects and stops reconnecting; must be called on the loop. DISCONNECT is
+        flushed right away, so on_disconnect has run when this returns and the
+        client can be handed back to paho's own loop.
+        """
+        self._stop.set()
+        self.client.disconnect()
+        self.client.loop_write() # paho closes the socket once DISCONNECT is written
+        self._detach()
+
+    def _detach(self):
+        """Removes the socket hooks from the client and the loop."""
+        client = self.client
+        client.on_socket_open = client.on_socket_close = None
+        client.on_socket_register_write = client.on_socket_unregister_write = None
+        if self._fd is not None: # Socket closed while the hooks were already detached
+            self._socket_closed(self._fd)
+            self._fd = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --- Socket callbacks (called by paho, possibly from the connect worker thread) ---
+    def _on_loop(self, fn, *args):
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._fd = sock.fileno()
+        self._on_loop(self.loop.add_reader, self._fd, self._read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        # paho closes the socket before it leaves the CONNECTED state on a lost connection
+        self._was_connected = client.is_connected()
+        self._fd = None
+        self._on_loop(self._socket_closed, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock.fileno(), self._write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock.fileno())
+
+    def _socket_closed(self, fd: int):
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+        self._closed.set()
+
+    def _read(self):
+        # loop_read handles one packet per call; draining a few per readiness event
+        # costs an EAGAIN recv when the socket is idle but saves loop iterations under load
+        for _ in range(READ_BATCH):
+            if self.client.loop_read() or self._fd is None:
+                break
+
+    def _write(self):
+        self.client.loop_write()
+
+    async def _misc(self):
+        while True:
+            await asyncio.sleep(MISC_INTERVAL_SECONDS)
+            self.client.loop_misc()
+
+    # --- Connection / backoff ---
+    async def _wait_stop(self, timeout: Optional[float]) -> bool:
+        """Sleeps up to timeout seconds (forever if None); True if stop() was called meanwhile."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._stop.is_set()
+
+    async def _run(self, host: str, port: int, keepalive: int):
+        try:
+            await self._connect_loop(host, port, keepalive)
+        finally:
+            if self._misc_task:
+                self._misc_task.cancel()
+            self._detach()
+
+    async def _connect_loop(self, host: str, port: int, keepalive: int):
+        delay = self.min_delay
+        first_attempt = True
+        while not self._stop.is_set():
+            if not first_attempt and self.on_status:
+                self.on_status("connecting")
+            self._closed.clear()
+            try:
+                if first_attempt:
+                    await asyncio.to_thread(self.client.connect, host, port, keepalive)
+                else:
+                    await asyncio.to_thread(self.client.reconnect)
+                connected = True
+            except (OSError, socket.timeout, ValueError) as e:
+                log.warning(f"MQTT connect to {host}:{port} failed: {e}")
+                connected = False
+                if self.on_status:
+                    self.on_status("error")
+            first_attempt = False
+
+            if connected:
+                if self._stop.is_set(): # stop() arrived while the TCP connect was in flight
+                    self.client.disconnect()
+                    self.client.loop_write()
+                    return
+                await self._closed.wait()
+                if self._stop.is_set():
+                    return
+                if self._was_connected:
+                    delay = self.min_delay # The connection had been up; retry quickly
+            self.reconnects += 1
+            wait = delay * random.uniform(0.5, 1.0)
+            log.info(f"MQTT reconnecting to {host}:{port} in {wait:.1f}s")
+            if await self._wait_stop(wait):
+                return
+            delay = min(delay * 2, self.max_delay)
@@ -0,0 +1,225 @@
+# server/particle_filter.py
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import logging
+
+from .spatial_index import SegmentGridIndex
+
+log = logging.getLogger(__name__)
+
+# --- Map-Constrained Particle Filter ---
+class ParticleFilterBank:
+    """
+    Particle filters for many trackers stored in shared arrays, so propagation,
+    weighting and resampling run vectorized over (trackers x particles): over
+    all trackers of a bulk upload at once (particle_filter_batch), while live
+    reports step one tracker (slot) per call as they arrive.
+
+    Motion model: constant velocity with random acceleration. A particle whose
+    step crosses a wall (tested through a SegmentGridIndex) stays where it was
+    and loses its velocity, so the cloud cannot leak through walls.
+    Measurement model: isotropic Gaussian around the multilateration result.
+    """
+    def __init__(self, num_particles: int = 500,
+                 process_variance: float = 1.0,
+                 measurement_variance: float = 10.0,
+                 wall_index: Optional[SegmentGridIndex] = None,
+                 capacity: int = 64,
+                 seed: Optional[int] = None):
+        self.num_particles = int(num_particles)
+        self.process_variance = float(process_variance)
+        self.measurement_variance = float(measurement_variance)
+        self.wall_index = wall_index
+        self.rng = np.random.default_rng(seed)
+
+        self.slots: Dict[str, int] = {}
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.pos = np.zeros((capacity, self.num_particles, 2))
+        self.vel = np.zeros((capacity, self.num_particles, 2))
+        self.weights = np.full((capacity, self.num_particles), 1.0 / self.num_particles)
+
+    def set_wall_index(self, wall_index: Optional[SegmentGridIndex]):
+        """Swaps the wall index, e.g. after the map configuration changed."""
+        self.wall_index = wall_index
+
+    def _grow(self):
+        old_capacity = len(self.pos)
+        new_capacity = old_capacity * 2
+        self.pos = np.concatenate([self.pos, np.zeros_like(self.pos)])
+        self.vel = np.concatenate([self.vel, np.zeros_like(self.vel)])
+        self.weights = np.concatenate([self.weights, np.full_like(self.weights, 1.0 / self.num_particles)])
+        self.free_slots.extend(range(new_capacity - 1, old_capacity - 1, -1))
+
+    def allocate(self, tracker_id: str, initial_pos: Tuple[float, float]) -> int:
+        """Reserves a slot for the tracker and scatters its particles around initial_pos."""
+        slot = self.slots.get(tracker_id)
+        if slot is None:
+            if not self.free_slots:
+                self._grow()
+            slot = self.free_slots.pop()
+            self.slots[tracker_id] = slot
+        spread = np.sqrt(self.measurement_variance)
+        self.pos[slot] = np.asarray(initial_pos, dtype=np.float64) + self.rng.normal(0.0, spread, (self.num_particles, 2))
+        self.vel[slot] = 0.0
+        self.weights[slot] = 1.0 / self.num_particles
+        return slot
+
+    def release(self, tracker_id: str):
+        """Frees the slot of a tracker that is no longer tracked."""
+        slot = self.slots.pop(tracker_id, None)
+        if slot is not None:
+            self.free_slots.append(slot)
+
+    def predict(self, slots: Sequence[int], dt: Sequence[float]):
+        """Propagates the particles of the given slots by their time deltas (seconds)."""
+        slots = np.asarray(slots, dtype=np.int64)
+        dt = np.clip(np.asarray(dt, dtype=np.float64), 0.0, None)[:, None, None]
+        if not len(slots):
+            return
+
+        accel_std = np.sqrt(self.process_variance * dt)
+        vel = self.vel[slots] + self.rng.standard_normal((len(slots), self.num_particles, 2)) * accel_std
+        start = self.pos[slots]
+        end = start + vel * dt
+
+        if self.wall_index is not None and len(self.wall_index):
+            blocked = self.wall_index.crossing_mask(start.reshape(-1, 2), end.reshape(-1, 2)).reshape(len(slots), self.num_particles)
+            end[blocked] = start[blocked]
+            vel[blocked] = 0.0
+
+        self.pos[slots] = end
+        self.vel[slots] = vel
+
+    def update(self, slots: Sequence[int], measurements: np.ndarray, variances: Optional[np.ndarray] = None):
+        """Re-weights the particles of the given slots against (k, 2) measured positions and resamples if degenerate.
+           variances (k,) overrides the bank's measurement variance per measurement."""
+        slots = np.asarray(slots, dtype=np.int64)
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 2)
+        if not len(slots):
+            return
+
+        variance = self.measurement_variance if variances is None else np.asarray(variances, dtype=np.float64).reshape(-1, 1)
+        sq_dist = np.sum((self.pos[slots] - measurements[:, None, :]) ** 2, axis=2)
+        log_w = np.log(self.weights[slots] + 1e-300) - sq_dist / (2.0 * variance)
+        log_w -= log_w.max(axis=1, keepdims=True)
+        weights = np.exp(log_w)
+        weights /= weights.sum(axis=1, keepdims=True)
+        self.weights[slots] = weights
+
+        ess = 1.0 / np.sum(weights ** 2, axis=1)
+        degenerate = slots[ess < self.num_particles / 2]
+        if len(degenerate):
+            self._resample(degenerate)
+
+    def _resample(self, slots: np.ndarray):
+        """Systematic resampling of all given slots with a single flattened searchsorted."""
+        k, p = len(slots), self.num_particles
+        cumulative = np.cumsum(self.weights[slots], axis=1)
+        cumulative[:, -1] = 1.0
+        offsets = np.arange(k)[:, None]
+        positions = (self.rng.random((k, 1)) + np.arange(p)) / p
+        idx = np.searchsorted((cumulative + offsets).ravel(), (positions + offsets).ravel()) - offsets.ravel().repeat(p) * p
+        idx = np.clip(idx.reshape(k, p), 0, p - 1)
+        rows = slots[:, None]
+        self.pos[slots] = self.pos[rows, idx]
+        self.vel[slots] = self.vel[rows, idx]
+        self.weights[slots] = 1.0 / p
+
+    def hold(self, slots: Sequence[int]):
+        """Zeroes the particle velocities of the given slots (stationary trackers)."""
+        self.vel[np.asarray(slots, dtype=np.int64)] = 0.0
+
+    def estimate(self, slots: Sequence[int]) -> np.ndarray:
+        """Weighted mean position (k, 2) of the given slots."""
+        slots = np.asarray(slots, dtype=np.int64)
+        return np.einsum('kp,kpd->kd', self.weights[slots], self.pos[slots])
+
+    def estimate_velocity(self, slots: Sequence[int]) -> np.ndarray:
+        """Weighted mean velocity (k, 2) of the given slots."""
+        slots = np.asarray(slots, dtype=np.int64)
+        return np.einsum('kp,kpd->kd', self.weights[slots], self.vel[slots])
+
+
+class MapConstrainedParticleFilter:
+    """
+    Per-tracker view on a ParticleFilterBank with the same interface as
+    KalmanFilter2D (predict / update / hold / get_position / get_velocity), so it can be
+    used wherever a Kalman filter is stored per tracker. Each call steps only this
+    tracker's slot; use particle_filter_batch to step many trackers together.
+    """
+    def __init__(self, bank: ParticleFilterBank, tracker_id: str, initial_pos: Tuple[float, float]):
+        self.bank = bank
+        self.tracker_id = tracker_id
+        self.slot = bank.allocate(tracker_id, initial_pos)
+
+    def predict(self, dt: float):
+        """Predict the next state based on the time delta dt."""
+        self.bank.predict([self.slot], [dt])
+
+    def update(self, measurement: Tuple[float, float], measurement_covariance: Optional[np.ndarray] = None):
+        """Update the particle weights based on the measurement [x, y] (isotropic: uses the mean variance of a given covariance)."""
+        variances = None if measurement_covariance is None else [np.trace(measurement_covariance) / 2.0]
+        self.bank.update([self.slot], np.asarray([measurement]), variances)
+
+    def hold(self):
+        """Zero the velocity: the tracker is known to be stationary, so predictions must not drift."""
+        self.bank.hold([self.slot])
+
+    def get_position(self) -> Tuple[float, float]:
+        """Return the filtered position (x, y)."""
+        x, y = self.bank.estimate([self.slot])[0]
+        return (float(x), float(y))
+
+    def get_velocity(self) -> Tuple[float, float]:
+        """Return the filtered velocity (vx, vy)."""
+        vx, vy = self.bank.estimate_velocity([self.slot])[0]
+        return (float(vx), float(vy))
+
+
+def particle_filter_batch(filters: List[MapConstrainedParticleFilter], step_filter: np.ndarray, step_rank: np.ndarray,
+                          dts: np.ndarray, measurements: np.ndarray, has_measurement: np.ndarray,
+                          measurement_covariances: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Runs predict(dt) followed by update(measurement) for many steps of many
+    MapConstrainedParticleFilter at once (bulk ingestion), with the step layout of
+    positioning.kalman_filter_batch: step i belongs to filters[step_filter[i]], and
+    the steps of equal rank (at most one per filter) are propagated and weighted
+    together in one call per bank. Steps without a measurement only predict.
+    measurement_covariances (N, 2, 2) replaces the bank's measurement variance
+    (by its mean variance, as in update) where it is finite.
+    The filters must have distinct slots within each bank.
+
+    Returns the filtered position after each step (N, 2).
+    """
+    positions = np.empty((len(dts), 2))
+    if len(dts) == 0:
+        return positions
+    banks: List[ParticleFilterBank] = []
+    bank_of = np.empty(len(filters), dtype=np.int64)
+    for i, f in enumerate(filters):
+        b = next((j for j, bank in enumerate(banks) if bank is f.bank), None)
+        if b is None:
+            b = len(banks)
+            banks.append(f.bank)
+        bank_of[i] = b
+    slot_of = np.array([f.slot for f in filters], dtype=np.int64)
+    order = np.argsort(step_rank, kind='stable')
+    bounds = np.searchsorted(step_rank[order], np.arange(int(step_rank.max()) + 2))
+    for rank in range(len(bounds) - 1):
+        rank_steps = order[bounds[rank]:bounds[rank + 1]]
+        for b, bank in enumerate(banks):
+            steps = rank_steps[bank_of[step_filter[rank_steps]] == b]
+            if not len(steps):
+                continue
+            slots = slot_of[step_filter[steps]]
+            bank.predict(slots, dts[steps])
+            measured = steps[has_measurement[steps]]
+            if len(measured):
+                variances = None
+                if measurement_covariances is not None:
+                    covariances = measurement_covariances[measured]
+                    variances = np.where(np.isfinite(covariances).all(axis=(1, 2)),
+                                         np.trace(covariances, axis1=1, axis2=2) / 2.0, bank.measurement_variance)
+                bank.update(slot_of[step_filter[measured]], measurements[measured], variances)
+            positions[steps] = bank.estimate(slots)
+    return positions
@@ -1,13 +1,29 @@
 # server/positioning.py
 import math
-from typing import List, Tuple, Optional
+import itertools
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Tuple, Optional
 import numpy as np
-from scipy.optimize import least_squares
 import logging # Added for logging
 
-from .models import DetectedBeacon, MiniprogramConfig
+from .models import DetectedBeacon, MiniprogramConfig, BeaconSelectionParams, SolverParams
+from .diagnostics import RateLimitedLog, positioning_counters
 
 log = logging.getLogger(__name__) # Added logger instance
+# Per-beacon / per-tracker diagnostics on the positioning hot path are rate limited;
+# routine outcomes are counted in positioning_counters and logged as periodic summaries.
+rate_limited_log = RateLimitedLog(log)
+
+_least_squares = None
+
+def _get_least_squares():
+    """scipy.optimize.least_squares, imported on first use (scipy is the slowest import of the server).
+       Only the fallback path needs it."""
+    global _least_squares
+    if _least_squares is None:
+        from scipy.optimize import least_squares
+        _least_squares = least_squares
+    return _least_squares
 
 # Basic RSSI to distance calculation
 def calculate_distance(rssi: int, tx_power: int, n: float = 2.5) -> float:
@@ -21,11 +37,225 @@ def calculate_distance(rssi: int, tx_power: int, n: float = 2.5) -> float:
     distance = math.pow(10, exponent)
     return distance
 
+class SolveResult(NamedTuple):
+    position: Tuple[float, float]
+    iterations: int
+    covariance: Optional[np.ndarray] # (2, 2) in m^2: s^2 (J^T J)^-1 at the solution, None if not estimable
+    residual_rms: float # RMS of measured - fitted distances in meters
+
+def _jacobian_covariance(jacobian: np.ndarray, residuals: np.ndarray) -> Optional[np.ndarray]:
+    """Position covariance from the range Jacobian, with the noise variance estimated from the residuals."""
+    dof = len(residuals) - 2
+    jtj = jacobian.T @ jacobian
+    det = jtj[0, 0] * jtj[1, 1] - jtj[0, 1] ** 2
+    if dof <= 0 or det <= 1e-12:
+        return None
+    inverse = np.array([[jtj[1, 1], -jtj[0, 1]], [-jtj[0, 1], jtj[0, 0]]]) / det
+    return inverse * float(residuals @ residuals) / dof
+
+def _gauss_newton(coords: np.ndarray, distances: np.ndarray, start: np.ndarray,
+                  step_tolerance: float, max_iterations: int) -> Optional[SolveResult]:
+    """
+    Levenberg-Marquardt on the two position unknowns, written out in NumPy (the 2x2
+    normal equations are solved in closed form). Stops as soon as an accepted
+    step is shorter than step_tolerance: seeded from a tracking prediction this
+    usually takes 2-4 iterations. Returns None if it does not converge.
+    """
+    p = start.astype(np.float64)
+    diff = p - coords
+    dist = np.maximum(np.hypot(diff[:, 0], diff[:, 1]), 1e-9)
+    residuals = dist - distances
+    cost = float(residuals @ residuals)
+    damping = 1e-3
+    for iteration in range(1, max_iterations + 1):
+        jacobian = diff / dist[:, None]
+        a = jacobian[:, 0] @ jacobian[:, 0]
+        b = jacobian[:, 0] @ jacobian[:, 1]
+        c = jacobian[:, 1] @ jacobian[:, 1]
+        g0 = jacobian[:, 0] @ residuals
+        g1 = jacobian[:, 1] @ residuals
+        a_damped, c_damped = a * (1.0 + damping), c * (1.0 + damping)
+        det = a_damped * c_damped - b * b
+        if det <= 1e-12:
+            return None
+        step = np.array([b * g1 - c_damped * g0, b * g0 - a_damped * g1]) / det
+
+        new_p = p + step
+        new_diff = new_p - coords
+        new_dist = np.maximum(np.hypot(new_diff[:, 0], new_diff[:, 1]), 1e-9)
+        new_residuals = new_dist - distances
+        new_cost = float(new_residuals @ new_residuals)
+        if new_cost <= cost:
+            p, diff, dist, residuals, cost = new_p, new_diff, new_dist, new_residuals, new_cost
+            damping = max(damping * 0.3, 1e-7)
+            if math.hypot(step[0], step[1]) < step_tolerance:
+                return SolveResult((float(p[0]), float(p[1])), iteration,
+                                   _jacobian_covariance(diff / dist[:, None], residuals),
+                                   math.sqrt(cost / len(residuals)))
+        else:
+            damping *= 10.0
+            if damping > 1e8:
+                break
+    return None
+
+def solve_multilateration(beacons_with_dist: List[Tuple[float, float, float]],
+                          initial_guess: Optional[Tuple[float, float]] = None,
+                          solver: Optional[SolverParams] = None) -> Optional[SolveResult]:
+    """
+    Position, iteration count and covariance from (x, y, distance) tuples.
+
+    Warm-started from initial_guess (e.g. the tracker's predicted position),
+    otherwise from the beacon centroid. The NumPy solver is tried first;
+    scipy's Levenberg-Marquardt is the fallback if it does not converge.
+    """
+    if len(beacons_with_dist) < 3:
+        positioning_counters.incr("solves_too_few_beacons")
+        return None
+    solver = solver or SolverParams()
+    data = np.asarray(beacons_with_dist, dtype=np.float64)
+    coords, distances = data[:, 0:2], data[:, 2]
+    start = np.mean(coords, axis=0) if initial_guess is None else np.asarray(initial_guess, dtype=np.float64)
+
+    result = _gauss_newton(coords, distances, start, solver.stepTolerance, solver.maxIterations)
+    if result is None:
+        positioning_counters.incr("solver_fallbacks")
+        position = multilateration_least_squares(beacons_with_dist, initial_guess)
+        if position is None:
+            return None
+        diff = np.asarray(position) - coords
+        dist = np.maximum(np.hypot(diff[:, 0], diff[:, 1]), 1e-9)
+        residuals = dist - distances
+        result = SolveResult(position, solver.maxIterations, _jacobian_covariance(diff / dist[:, None], residuals),
+                             math.sqrt(float(residuals @ residuals) / len(residuals)))
+    positioning_counters.incr("solver_iterations", result.iterations)
+    return result
+
+# --- Batch Solving ---
+class BeaconTable:
+    """Configured beacons as arrays indexed by lowercase MAC, so many reports can be ranged at once."""
+    def __init__(self, config: MiniprogramConfig):
+        n_default = config.settings.signalPropagationFactor if config.settings else 2.5
+        beacons = [b for b in config.beacons if b.macAddress and getattr(b, 'txPower', None) is not None]
+        self.index = {b.macAddress.lower(): i for i, b in enumerate(beacons)}
+        self.xy = np.array([(b.x, b.y) for b in beacons], dtype=np.float64).reshape(-1, 2)
+        self.tx_power = np.array([b.txPower for b in beacons], dtype=np.float64)
+        self.n = np.array([getattr(b, 'signalPropagationFactor', None) or n_default for b in beacons], dtype=np.float64)
+
+def ranges_batch(table: BeaconTable, reports_beacons: List[List[DetectedBeacon]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Ranges the detected beacons of many reports with the same rules as calculate_position_result.
+
+    Returns:
+        coords (R, K, 2), distances (R, K) and mask (R, K) of usable beacons,
+        K being the largest number of known beacons in one report.
+    """
+    index = table.index
+    flat = [(r, detected.macAddress, detected.rssi) for r, beacons in enumerate(reports_beacons) for detected in beacons]
+    beacon_idx = np.array([index.get(mac.lower(), -1) if mac else -1 for _, mac, _ in flat], dtype=np.int64)
+    known = beacon_idx >= 0
+    rows = np.array([r for r, _, _ in flat], dtype=np.int64)[known]
+    rssi = np.array([value for _, _, value in flat], dtype=np.float64)[known]
+    beacon_idx = beacon_idx[known]
+    unknown = len(flat) - len(rows)
+    # Column of each known beacon within its report (rows are sorted)
+    cols = np.arange(len(rows)) - np.searchsorted(rows, rows)
+
+    num_reports, width = len(reports_beacons), (int(cols.max()) + 1 if len(cols) else 1)
+    coords = np.zeros((num_reports, width, 2))
+    distances = np.zeros((num_reports, width))
+    mask = np.zeros((num_reports, width), dtype=bool)
+    if unknown:
+        positioning_counters.incr("beacons_rejected_unknown", unknown)
+    if not len(rows):
+        return coords, distances, mask
+
+    plausible = (rssi <= 0) & (rssi >= -120)
+    exponent = np.minimum((table.tx_power[beacon_idx] - rssi) / (10 * table.n[beacon_idx]), 10.0)
+    dist = np.where(exponent >= 10.0, 10000.0, 10.0 ** exponent)
+    valid = plausible & (rssi != 0) & (dist > 0.1) & (dist < 100) # calculate_distance gives no distance for RSSI 0
+    positioning_counters.incr("beacons_rejected_implausible_rssi", int((~plausible).sum()))
+    positioning_counters.incr("beacons_rejected_invalid_distance", int((plausible & ~valid).sum()))
+    positioning_counters.incr("beacons_used", int(valid.sum()))
+
+    coords[rows, cols] = table.xy[beacon_idx]
+    distances[rows, cols] = dist
+    mask[rows, cols] = valid
+    return coords, distances, mask
+
+def solve_multilateration_batch(coords: np.ndarray, distances: np.ndarray, mask: np.ndarray,
+                                starts: np.ndarray, solver: Optional[SolverParams] = None
+                                ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    _gauss_newton over many reports at once: every row of (coords, distances,
+    mask) is an independent problem with its own damping; a row stops once its
+    accepted step is shorter than stepTolerance.
+
+    Returns:
+        positions (R, 2), iterations (R,), converged (R,), covariances (R, 2, 2)
+        (NaN where not estimable) and residual_rms (R,). Callers should solve
+        rows that did not converge with solve_multilateration (scipy fallback).
+    """
+    solver = solver or SolverParams()
+    w = mask.astype(np.float64)
+    count = w.sum(axis=1)
+
+    def evaluate(p):
+        diff = p[:, None, :] - coords
+        dist = np.maximum(np.hypot(diff[..., 0], diff[..., 1]), 1e-9)
+        residuals = (dist - distances) * w
+        return diff, dist, residuals, np.einsum('rk,rk->r', residuals, residuals)
+
+    p = starts.astype(np.float64).copy()
+    diff, dist, residuals, cost = evaluate(p)
+    damping = np.full(len(p), 1e-3)
+    iterations = np.zeros(len(p), dtype=np.int64)
+    converged = np.zeros(len(p), dtype=bool)
+    active = count >= 3
+    for iteration in range(1, solver.maxIterations + 1):
+        if not active.any():
+            break
+        jacobian = diff / dist[..., None] * w[..., None]
+        a = np.einsum('rk,rk->r', jacobian[..., 0], jacobian[..., 0])
+        b = np.einsum('rk,rk->r', jacobian[..., 0], jacobian[..., 1])
+        c = np.einsum('rk,rk->r', jacobian[..., 1], jacobian[..., 1])
+        g0 = np.einsum('rk,rk->r', jacobian[..., 0], residuals)
+        g1 = np.einsum('rk,rk->r', jacobian[..., 1], residuals)
+        a_damped, c_damped = a * (1.0 + damping), c * (1.0 + damping)
+        det = a_damped * c_damped - b * b
+        active &= det > 1e-12
+        safe_det = np.where(active, det, 1.0)
+        step = np.stack([b * g1 - c_damped * g0, b * g0 - a_damped * g1], axis=1) / safe_det[:, None]
+        step[~active] = 0.0
+
+        new_diff, new_dist, new_residuals, new_cost = evaluate(p + step)
+        accept = active & (new_cost <= cost)
+        p[accept] += step[accept]
+        diff[accept], dist[accept], residuals[accept], cost[accept] = new_diff[accept], new_dist[accept], new_residuals[accept], new_cost[accept]
+        damping = np.where(accept, np.maximum(damping * 0.3, 1e-7), damping * 10.0)
+        iterations[active] = iteration
+        done = accept & (np.hypot(step[:, 0], step[:, 1]) < solver.stepTolerance)
+        converged |= done
+        active &= ~done & (damping <= 1e8)
+
+    jacobian = diff / dist[..., None] * w[..., None]
+    jtj = np.einsum('rki,rkj->rij', jacobian, jacobian)
+    det = jtj[:, 0, 0] * jtj[:, 1, 1] - jtj[:, 0, 1] ** 2
+    dof = count - 2
+    estimable = (dof > 0) & (det > 1e-12)
+    inverse = np.stack([np.stack([jtj[:, 1, 1], -jtj[:, 0, 1]], axis=1),
+                        np.stack([-jtj[:, 0, 1], jtj[:, 0, 0]], axis=1)], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariances = inverse / det[:, None, None] * (cost / dof)[:, None, None]
+        residual_rms = np.sqrt(cost / count)
+    covariances[~estimable] = np.nan
+    return p, iterations, converged, covariances, residual_rms
+
 # --- NEW: Least Squares Multilateration ---
 def multilateration_least_squares(beacons_with_dist: List[Tuple[float, float, float]], initial_guess: Optional[Tuple[float, float]] = None) -> Optional[Tuple[float, float]]:
     """
     Calculates position using least squares optimization based on distances
-    to known beacon coordinates.
+    to known beacon coordinates (scipy Levenberg-Marquardt; solve_multilateration
+    uses it as its fallback).
 
     Args:
         beacons_with_dist: List of tuples (x, y, distance) for each detected beacon.
@@ -35,7 +265,7 @@ def multilateration_least_squares(beacons_with_dist: List[Tuple[float, float, fl
         Estimated (x, y) position or None if calculation fails.
     """
     if len(beacons_with_dist) < 3:
-        print(f"Multilateration requires at least 3 beacons, got {len(beacons_with_dist)}")
+        positioning_counters.incr("solves_too_few_beacons")
         return None
 
     beacon_coords = np.array([(b[0], b[1]) for b in beacons_with_dist])
@@ -58,12 +288,13 @@ def multilateration_least_squares(beacons_with_dist: List[Tuple[float, float, fl
          initial_guess_calc = np.array(initial_guess)
 
     try:
-        result = least_squares(error_func, initial_guess_calc, method='lm') # Levenberg-Marquardt is often good for this
+        result = _get_least_squares()(error_func, initial_guess_calc, method='lm') # Levenberg-Marquardt is often good for this
 
         if result.success:
-            return tuple(result.x)
+            return (float(result.x[0]), float(result.x[1]))
         else:
-            print(f"Least squares optimization failed: {result.message}")
+            positioning_counters.incr("solves_failed")
+            rate_limited_log.warning(("solver_failed",), "Least squares optimization failed: %s", result.message)
             # Try a different initial guess? Maybe centroid even if one was provided?
             # result_centroid = least_squares(error_func, np.mean(beacon_coords, axis=0), method='lm')
             # if result_centroid.success:
@@ -73,27 +304,108 @@ def multilateration_least_squares(beacons_with_dist: List[Tuple[float, float, fl
             #      print(f"Optimization also failed with centroid guess: {result_centroid.message}")
             return None
     except Exception as e:
-        print(f"Error during least squares optimization: {e}")
+        positioning_counters.incr("solves_failed")
+        rate_limited_log.error(("solver_error", type(e).__name__), "Error during least squares optimization: %s", e)
         return None
 
 
 # REMOVED: Old trilateration function
 
+# --- Geometry-Aware Beacon Selection ---
+@lru_cache(maxsize=64)
+def _combinations(num_candidates: int, subset_size: int) -> np.ndarray:
+    """All subsets of subset_size out of num_candidates as an (S, subset_size) index array."""
+    return np.array(list(itertools.combinations(range(num_candidates), subset_size)), dtype=np.int64)
+
+def weighted_dop(outer: np.ndarray, subsets: np.ndarray) -> np.ndarray:
+    """
+    Weighted dilution of precision sqrt(trace((H^T W H)^-1)) of many beacon subsets at once.
+
+    Args:
+        outer: (K, 2, 2) per-beacon w_i * u_i u_i^T, u_i the unit vector from beacon i to the position.
+        subsets: (S, m) beacon indexes of each subset.
+
+    Returns:
+        (S,) DOP per subset; inf for (near) collinear geometry.
+    """
+    m = outer[subsets].sum(axis=1) # (S, 2, 2) = H^T W H
+    a, b, d = m[:, 0, 0], m[:, 0, 1], m[:, 1, 1]
+    det = a * d - b * b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dop = np.sqrt((a + d) / det) # trace of the 2x2 inverse is (a + d) / det
+    return np.where(det > 1e-9 * np.maximum(a + d, 1e-12) ** 2, dop, np.inf)
+
+def select_beacons(beacons_with_dist: List[Tuple[float, float, float]], params: BeaconSelectionParams,
+                   reference_position: Optional[Tuple[float, float]] = None) -> List[Tuple[float, float, float]]:
+    """
+    Bounds the solver input: keeps the maxCandidates nearest beacons (the estimated
+    distance already folds in RSSI and txPower; near beacons have the smallest
+    ranging error), then picks the subsetSize subset with the lowest weighted DOP
+    around the reference position. Weights are 1 / d^2 since the ranging error
+    grows with distance. Exhaustive over all subsets up to maxSubsets, greedy
+    backward elimination beyond that.
+    """
+    if len(beacons_with_dist) <= params.subsetSize:
+        return beacons_with_dist
+    data = np.asarray(beacons_with_dist, dtype=np.float64)
+    data = data[np.argsort(data[:, 2], kind='stable')[:params.maxCandidates]]
+    if len(data) <= params.subsetSize:
+        return [tuple(row) for row in data]
+
+    weights = 1.0 / np.maximum(data[:, 2], 0.1) ** 2
+    if reference_position is None: # Inverse-distance weighted centroid
+        reference = weights @ data[:, 0:2] / weights.sum()
+    else:
+        reference = np.asarray(reference_position, dtype=np.float64)
+    delta = reference - data[:, 0:2]
+    norm = np.hypot(delta[:, 0], delta[:, 1])
+    # Beacons at the reference position have no direction; fall back to their range ring (any unit vector)
+    u = np.where(norm[:, None] > 1e-6, delta / np.maximum(norm, 1e-6)[:, None], np.array([1.0, 0.0]))
+    outer = weights[:, None, None] * u[:, :, None] * u[:, None, :] # (K, 2, 2)
+
+    k, m = len(data), params.subsetSize
+    if math.comb(k, m) <= params.maxSubsets:
+        subsets = _combinations(k, m)
+        chosen = subsets[int(np.argmin(weighted_dop(outer, subsets)))]
+    else:
+        chosen = np.arange(k)
+        while len(chosen) > m: # Drop the beacon whose removal hurts the DOP least
+            removals = np.array([np.delete(chosen, i) for i in range(len(chosen))])
+            chosen = removals[int(np.argmin(weighted_dop(outer, removals)))]
+    return [tuple(row) for row in data[np.sort(chosen)]]
+
+
 # --- Update calculate_position ---
 def calculate_position(
     detected_beacons: List[DetectedBeacon],
     miniprogram_config: MiniprogramConfig, # Changed from ConfigData to MiniprogramConfig
-    last_known_position: Optional[Tuple[float, float]] = None
+    last_known_position: Optional[Tuple[float, float]] = None,
+    tracker_id: Optional[str] = None, # Only used to key rate-limited diagnostics
+    beacon_selection: Optional[BeaconSelectionParams] = None
     ) -> Optional[Tuple[float, float]]:
     """
     Main function to calculate position from detected beacons and miniprogram_config.
-    Uses least squares multilateration.
+    Uses least squares multilateration, on a geometry-aware subset of the beacons
+    if beacon_selection is enabled.
     """
+    result = calculate_position_result(detected_beacons, miniprogram_config, last_known_position, tracker_id, beacon_selection)
+    return result.position if result else None
+
+def calculate_position_result(
+    detected_beacons: List[DetectedBeacon],
+    miniprogram_config: MiniprogramConfig,
+    initial_guess: Optional[Tuple[float, float]] = None, # Warm start, e.g. the filter's predicted position
+    tracker_id: Optional[str] = None,
+    beacon_selection: Optional[BeaconSelectionParams] = None,
+    solver: Optional[SolverParams] = None,
+    beacons_by_mac: Optional[Dict[str, Any]] = None # Lowercase MAC -> beacon of miniprogram_config, e.g. a compiled floor's
+    ) -> Optional[SolveResult]:
+    """Like calculate_position, but returns the full SolveResult (iterations and covariance included)."""
     if not miniprogram_config or not miniprogram_config.beacons:
-        log.error("Miniprogram configuration not loaded or no beacons defined.")
+        rate_limited_log.error(("no_config",), "Miniprogram configuration not loaded or no beacons defined.")
         return None
     if not miniprogram_config.settings:
-        log.error("Miniprogram settings (for signalPropagationFactor) not loaded.")
+        rate_limited_log.error(("no_settings",), "Miniprogram settings (for signalPropagationFactor) not loaded.")
         return None # Or use a default n, but better to ensure it's loaded
 
     beacons_with_coords_dist = []
@@ -102,36 +414,53 @@ def calculate_position(
 
     for detected in detected_beacons:
         beacon_info = None
-        if detected.macAddress:
+        if detected.macAddress and beacons_by_mac is not None:
+            beacon_info = beacons_by_mac.get(detected.macAddress.lower())
+        elif detected.macAddress:
             for cfg_beacon in miniprogram_config.beacons: # Use miniprogram_config.beacons
                 # The macAddress field in MiniprogramBeaconConfig is populated via AliasChoices
                 if cfg_beacon.macAddress and cfg_beacon.macAddress.lower() == detected.macAddress.lower():
                     beacon_info = cfg_beacon
                     break
         else:
-            log.warning(f"Detected beacon report without MAC address: {detected}. Cannot match.")
+            positioning_counters.incr("beacons_rejected_no_mac")
+            rate_limited_log.warning(("no_mac", tracker_id), "Detected beacon report without MAC address: %s. Cannot match.", detected)
             continue # Skip this detected beacon if it has no MAC
 
         if beacon_info:
+            # MiniprogramBeaconConfig has 'name', WebUIBeaconConfig has 'displayName'
+            beacon_label = getattr(beacon_info, 'name', None) or getattr(beacon_info, 'displayName', None) or beacon_info.macAddress
             if not hasattr(beacon_info, 'txPower') or beacon_info.txPower is None:
-                log.warning(f"Beacon {beacon_info.name or beacon_info.macAddress} from config is missing txPower. Skipping.")
+                positioning_counters.incr("beacons_rejected_missing_txpower")
+                rate_limited_log.warning(("missing_txpower", beacon_info.macAddress), "Beacon %s from config is missing txPower. Skipping.", beacon_label)
                 continue
 
             if detected.rssi > 0 or detected.rssi < -120:
-                log.warning(f"Ignoring beacon {beacon_info.name or beacon_info.macAddress} due to implausible RSSI: {detected.rssi}")
+                positioning_counters.incr("beacons_rejected_implausible_rssi")
+                rate_limited_log.warning(("implausible_rssi", beacon_info.macAddress), "Ignoring beacon %s due to implausible RSSI: %s", beacon_label, detected.rssi)
                 continue
 
-            distance = calculate_distance(detected.rssi, beacon_info.txPower, n)
+            # Calibrated beacons carry their own path loss exponent
+            beacon_n = getattr(beacon_info, 'signalPropagationFactor', None) or n
+            distance = calculate_distance(detected.rssi, beacon_info.txPower, beacon_n)
             if distance > 0.1 and distance < 100:
                 beacons_with_coords_dist.append((beacon_info.x, beacon_info.y, distance))
-                log.info(f"Using beacon: {beacon_info.name or beacon_info.macAddress}, RSSI: {detected.rssi}, Tx: {beacon_info.txPower}, Dist: {distance:.2f}m")
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Using beacon: %s, RSSI: %s, Tx: %s, Dist: %.2fm", beacon_label, detected.rssi, beacon_info.txPower, distance)
             else:
-                log.warning(f"Ignoring beacon {beacon_info.name or beacon_info.macAddress} due to invalid calculated distance: {distance:.2f}m (RSSI: {detected.rssi}, Tx: {beacon_info.txPower})")
+                positioning_counters.incr("beacons_rejected_invalid_distance")
+                rate_limited_log.warning(("invalid_distance", beacon_info.macAddress),
+                                         "Ignoring beacon %s due to invalid calculated distance: %.2fm (RSSI: %s, Tx: %s)",
+                                         beacon_label, distance, detected.rssi, beacon_info.txPower)
         elif detected.macAddress:
-            log.warning(f"Detected beacon with MAC {detected.macAddress} not found in miniprogram_config.")
+            positioning_counters.incr("beacons_rejected_unknown")
+            rate_limited_log.warning(("unknown_beacon", detected.macAddress.lower()), "Detected beacon with MAC %s not found in miniprogram_config.", detected.macAddress)
 
+    positioning_counters.incr("beacons_used", len(beacons_with_coords_dist))
     if len(beacons_with_coords_dist) < 2: 
-        log.info(f"Not enough valid beacon signals ({len(beacons_with_coords_dist)}) for multilateration (need at least 2, 3+ recommended).")
+        positioning_counters.incr("solves_too_few_beacons")
+        rate_limited_log.info(("too_few_beacons", tracker_id), "Not enough valid beacon signals (%d) for multilateration (need at least 2, 3+ recommended). Tracker: %s",
+                              len(beacons_with_coords_dist), tracker_id)
         return None
     # For multilateration_least_squares, it internally checks for < 3 beacons.
     # If we allow 2 beacons here, multilateration_least_squares might return None or fail if it strictly needs 3.
@@ -139,19 +468,77 @@ def calculate_position(
     # For now, multilateration_least_squares itself handles the < 3 case. 
     # We could provide a simpler 2-beacon positioning if len is 2.
     if len(beacons_with_coords_dist) < 3:
-        log.info(f"Multilateration requires at least 3 beacons, got {len(beacons_with_coords_dist)}. Skipping position calculation.")
+        positioning_counters.incr("solves_too_few_beacons")
+        rate_limited_log.info(("too_few_beacons", tracker_id), "Multilateration requires at least 3 beacons, got %d. Skipping position calculation. Tracker: %s",
+                              len(beacons_with_coords_dist), tracker_id)
         # Reverting the previous change of allowing 2 beacons for the least_squares function, 
         # as it's more robust with 3. If only 2 are available, it will be handled by the function itself returning None.
         return None
 
-    estimated_position = multilateration_least_squares(beacons_with_coords_dist, initial_guess=last_known_position)
+    if beacon_selection and beacon_selection.enabled and len(beacons_with_coords_dist) > beacon_selection.subsetSize:
+        selected = select_beacons(beacons_with_coords_dist, beacon_selection, initial_guess)
+        positioning_counters.incr("beacons_pruned_by_selection", len(beacons_with_coords_dist) - len(selected))
+        beacons_with_coords_dist = selected
+
+    result = solve_multilateration(beacons_with_coords_dist, initial_guess=initial_guess, solver=solver)
 
-    if estimated_position:
-        log.info(f"Multilateration successful. Estimated position: {estimated_position}")
+    if result:
+        positioning_counters.incr("solves_ok")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Multilateration successful. Estimated position: %s (%d iterations)", result.position, result.iterations)
     else:
-        log.info("Multilateration failed to estimate a position.")
+        rate_limited_log.info(("solve_failed", tracker_id), "Multilateration failed to estimate a position. Tracker: %s", tracker_id)
+
+    return result
 
-    return estimated_position
+def calculate_positions_batch(
+    reports_beacons: List[List[DetectedBeacon]],
+    miniprogram_config: MiniprogramConfig,
+    beacon_selection: Optional[BeaconSelectionParams] = None,
+    solver: Optional[SolverParams] = None,
+    table: Optional[BeaconTable] = None # Precompiled BeaconTable(miniprogram_config)
+    ) -> List[Optional[SolveResult]]:
+    """
+    calculate_position_result for many reports at once (bulk ingestion): ranging and
+    the solver are vectorized over all reports, each cold-started from its
+    inverse-distance weighted beacon centroid. Reports with more than subsetSize
+    usable beacons go through select_beacons first.
+    """
+    if not miniprogram_config or not miniprogram_config.beacons:
+        rate_limited_log.error(("no_config",), "Miniprogram configuration not loaded or no beacons defined.")
+        return [None] * len(reports_beacons)
+    if not reports_beacons:
+        return []
+    coords, distances, mask = ranges_batch(table or BeaconTable(miniprogram_config), reports_beacons)
+    count = mask.sum(axis=1)
+    if beacon_selection and beacon_selection.enabled:
+        for r in np.flatnonzero(count > beacon_selection.subsetSize):
+            columns = np.flatnonzero(mask[r])
+            selected = np.asarray(select_beacons([(coords[r, k, 0], coords[r, k, 1], distances[r, k]) for k in columns], beacon_selection))
+            positioning_counters.incr("beacons_pruned_by_selection", len(columns) - len(selected))
+            mask[r] = False
+            coords[r, :len(selected)], distances[r, :len(selected)], mask[r, :len(selected)] = selected[:, 0:2], selected[:, 2], True
+        count = mask.sum(axis=1)
+
+    weights = np.where(mask, 1.0 / np.maximum(distances, 0.1) ** 2, 0.0)
+    starts = np.einsum('rk,rki->ri', weights, coords) / np.maximum(weights.sum(axis=1), 1e-12)[:, None]
+    positions, iterations, converged, covariances, residual_rms = solve_multilateration_batch(coords, distances, mask, starts, solver)
+    positioning_counters.incr("solves_too_few_beacons", int((count < 3).sum()))
+    positioning_counters.incr("solver_iterations", int(iterations[converged].sum()))
+
+    estimable = np.isfinite(covariances).all(axis=(1, 2))
+    results: List[Optional[SolveResult]] = []
+    for r in range(len(reports_beacons)):
+        if count[r] < 3:
+            results.append(None)
+        elif converged[r]:
+            results.append(SolveResult((float(positions[r, 0]), float(positions[r, 1])), int(iterations[r]),
+                                       covariances[r] if estimable[r] else None, float(residual_rms[r])))
+        else: # Rare: solve on its own, with the scipy fallback
+            columns = np.flatnonzero(mask[r])
+            results.append(solve_multilateration([(coords[r, k, 0], coords[r, k, 1], distances[r, k]) for k in columns], solver=solver))
+    positioning_counters.incr("solves_ok", sum(1 for result in results if result))
+    return results
 
 # --- Kalman Filter Implementation ---
 class KalmanFilter2D:
@@ -196,28 +583,36 @@ class KalmanFilter2D:
         # Predict state covariance: P_k = F * P_{k-1} * F^T + Q
         self.P = self.F @ self.P @ self.F.T + self.Q
 
-    def update(self, measurement: Tuple[float, float]):
-        """Update the state based on the measurement [x, y]."""
+    def update(self, measurement: Tuple[float, float], measurement_covariance: Optional[np.ndarray] = None):
+        """Update the state based on the measurement [x, y].
+           measurement_covariance (2x2) replaces R for this update, e.g. the solver's covariance estimate."""
         z = np.array([[measurement[0]], [measurement[1]]])
+        R = self.R if measurement_covariance is None else measurement_covariance
 
         # Measurement residual (innovation): y = z - H * x_k
-        y = z - self.H @ self.x
+        y = z - self.x[:2] # H selects the position rows
         # Residual covariance: S = H * P_k * H^T + R
-        S = self.H @ self.P @ self.H.T + self.R
-        # Kalman gain: K = P_k * H^T * S^{-1}
-        try:
-            S_inv = np.linalg.inv(S)
-        except np.linalg.LinAlgError:
-            print("Warning: Could not invert S matrix in Kalman filter update. Skipping update.")
+        S = self.P[:2, :2] + R
+        # Kalman gain: K = P_k * H^T * S^{-1}, with the 2x2 inverse in closed form
+        det = S[0, 0] * S[1, 1] - S[0, 1] * S[1, 0]
+        if abs(det) < 1e-12:
+            rate_limited_log.warning(("kalman_singular",), "Could not invert S matrix in Kalman filter update. Skipping update.")
             # Handle singular matrix: maybe increase R or P? Or just skip?
             return # Skip update this cycle
+        S_inv = np.array([[S[1, 1], -S[0, 1]], [-S[1, 0], S[0, 0]]]) / det
 
-        K = self.P @ self.H.T @ S_inv
+        K = self.P[:, :2] @ S_inv
 
         # Update state estimate: x_k = x_k + K * y
         self.x = self.x + K @ y
         # Update state covariance: P_k = (I - K * H) * P_k
-        self.P = (self.I - K @ self.H) @ self.P
+        self.P = self.P - K @ self.P[:2]
+
+    def hold(self):
+        """Zero the velocity: the tracker is known to be stationary, so predictions must not drift."""
+        x = self.x.copy() # Replaced, not mutated: snapshots encode x in a worker thread (StateSnapshotter.capture)
+        x[2:] = 0.0
+        self.x = x
 
     def get_position(self) -> Tuple[float, float]:
         """Return the filtered position (x, y)."""
@@ -225,4 +620,62 @@ class KalmanFilter2D:
 
     def get_velocity(self) -> Tuple[float, float]:
          """Return the filtered velocity (vx, vy)."""
-         return (self.x[2, 0], self.x[3, 0]) 
\ No newline at end of file
+         return (self.x[2, 0], self.x[3, 0]) 
+
+
+def kalman_filter_batch(filters: List[KalmanFilter2D], step_filter: np.ndarray, step_rank: np.ndarray, dts: np.ndarray,
+                        measurements: np.ndarray, has_measurement: np.ndarray,
+                        measurement_covariances: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Runs predict(dt) followed by update(measurement) for many steps of many
+    KalmanFilter2D at once (bulk ingestion). Step i belongs to filters[step_filter[i]];
+    the steps of one filter have ranks 0, 1, 2, ... and all steps of equal rank
+    (at most one per filter) are computed together, so the Python loop runs once
+    per rank instead of once per step. Steps without a measurement only predict.
+    measurement_covariances (N, 2, 2) replaces R where it is finite.
+
+    Returns the filtered position after each step (N, 2); the filters are updated in place.
+    """
+    positions = np.empty((len(dts), 2))
+    if len(dts) == 0:
+        return positions
+    x = np.stack([f.x[:, 0] for f in filters])
+    P = np.stack([f.P for f in filters])
+    Q = np.stack([f.Q for f in filters])
+    R = np.stack([f.R for f in filters])
+    order = np.argsort(step_rank, kind='stable')
+    bounds = np.searchsorted(step_rank[order], np.arange(int(step_rank.max()) + 2))
+    for rank in range(len(bounds) - 1):
+        steps = order[bounds[rank]:bounds[rank + 1]]
+        t = step_filter[steps]
+        dt = dts[steps][:, None]
+        xt, Pt = x[t], P[t]
+        # Predict with F = [[I, dt I], [0, I]]: x = F x, P = F P F^T + Q
+        xt[:, 0:2] += dt * xt[:, 2:4]
+        Pt[:, 0:2, :] += dt[:, :, None] * Pt[:, 2:4, :]
+        Pt[:, :, 0:2] += dt[:, :, None] * Pt[:, :, 2:4]
+        Pt += Q[t]
+
+        m = has_measurement[steps]
+        if measurement_covariances is not None:
+            r_cov = measurement_covariances[steps]
+            r_cov = np.where(np.isfinite(r_cov), r_cov, R[t])
+        else:
+            r_cov = R[t]
+        S = Pt[:, 0:2, 0:2] + r_cov
+        det = S[:, 0, 0] * S[:, 1, 1] - S[:, 0, 1] * S[:, 1, 0]
+        m &= np.abs(det) >= 1e-12 # Singular S: skip the update, like KalmanFilter2D.update
+        if m.any():
+            S, det = S[m], det[m]
+            S_inv = np.stack([np.stack([S[:, 1, 1], -S[:, 0, 1]], axis=1),
+                              np.stack([-S[:, 1, 0], S[:, 0, 0]], axis=1)], axis=1) / det[:, None, None]
+            K = Pt[m][:, :, 0:2] @ S_inv # (n, 4, 2)
+            y = measurements[steps][m] - xt[m][:, 0:2]
+            xt[m] += (K @ y[:, :, None])[:, :, 0]
+            Pt[m] -= K @ Pt[m][:, 0:2, :]
+        x[t], P[t] = xt, Pt
+        positions[steps] = xt[:, 0:2]
+    for i, f in enumerate(filters):
+        f.x = x[i][:, None].copy()
+        f.P = P[i].copy()
+    return positions
@@ -0,0 +1,76 @@
+# server/report_dedupe.py
+"""
+Drops tracker reports that were already processed.
+
+A tracker heard by several LoRaWAN gateways, or a QoS 1 redelivery by the
+broker, yields the same report more than once; processing each copy would cost
+a full solve and a filter update and make the filter overconfident. A report is
+identified by its network-server deduplicationId when the payload has one,
+otherwise by (tracker id, payload timestamp, detected beacons). Keys are kept as
+64-bit hashes in an OrderedDict ordered by last use, so expiring (TTL) and
+evicting (LRU, at maxEntries) both pop from the front.
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from .models import TrackerReport
+
+def report_key(report: TrackerReport) -> int:
+    if report.deduplicationId:
+        return hash(("id", report.deduplicationId))
+    return hash((report.trackerId, report.timestamp, tuple((b.macAddress, b.rssi) for b in report.detectedBeacons)))
+
+
+class ReportDeduplicator:
+    """Bounded TTL + LRU set of recently seen reports, with hit-rate counters."""
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 200_000):
+        self.ttl = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self._seen: "OrderedDict[int, float]" = OrderedDict() # key -> expiry (monotonic s), least recently seen first
+        self.counters: Dict[str, int] = {"checked": 0, "duplicates": 0, "expired": 0, "evicted": 0}
+
+    def configure(self, ttl_seconds: float, max_entries: int):
+        self.ttl = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self._trim(time.monotonic())
+
+    def is_duplicate(self, report: TrackerReport, now: Optional[float] = None) -> bool:
+        """Records the report; True if the same report was seen less than ttl seconds ago."""
+        now = time.monotonic() if now is None else now
+        key = report_key(report)
+        seen = self._seen
+        self.counters["checked"] += 1
+        expiry = seen.get(key)
+        seen[key] = now + self.ttl # A repeated copy keeps the key alive (LRU)
+        seen.move_to_end(key)
+        if expiry is not None and expiry > now:
+            self.counters["duplicates"] += 1
+            return True
+        self._trim(now)
+        return False
+
+    def _trim(self, now: float):
+        seen = self._seen
+        while seen:
+            key = next(iter(seen))
+            if seen[key] > now:
+                break
+            del seen[key]
+            self.counters["expired"] += 1
+        while len(seen) > self.max_entries:
+            seen.popitem(last=False)
+            self.counters["evicted"] += 1
+
+    def clear(self):
+        self._seen.clear()
+
+    def metrics(self) -> dict:
+        checked = self.counters["checked"]
+        return {
+            **self.counters,
+            "hitRate": round(self.counters["duplicates"] / checked, 4) if checked else None,
+            "entries": len(self._seen),
+            "maxEntries": self.max_entries,
+            "ttlSeconds": self.ttl,
+        }
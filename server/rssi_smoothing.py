@@ -0,0 +1,149 @@
+# server/rssi_smoothing.py
+from typing import Dict, List
+import numpy as np
+import logging
+
+from .models import DetectedBeacon
+
+log = logging.getLogger(__name__)
+
+SMOOTHING_METHODS = ("none", "ema", "median", "trimmed_mean")
+
+# --- Per-(tracker, beacon) RSSI Smoothing ---
+class RssiSmoother:
+    """
+    Sliding-window RSSI smoothing per (tracker, beacon) pair, applied before the
+    readings are converted to distances.
+
+    State lives in preallocated arrays indexed by (tracker row, beacon column):
+    a ring buffer of the last `window_size` readings (NaN = empty), an EMA value,
+    the last time the beacon was heard and the DetectedBeacon handed out for the
+    pair. Rows and columns are assigned once per tracker / beacon MAC and the
+    arrays grow by doubling, so a report only writes into existing memory.
+    Only the beacons of the current report are returned; a beacon not heard for
+    `expiry_ms` is cleared and starts a new window when it is heard again.
+
+    Methods: 'ema', 'median' and 'trimmed_mean' (drops `trim_fraction` of the
+    window from each end before averaging).
+    """
+    def __init__(self, method: str = "median", window_size: int = 5, ema_alpha: float = 0.3,
+                 trim_fraction: float = 0.2, expiry_ms: int = 30000,
+                 tracker_capacity: int = 64, beacon_capacity: int = 32):
+        if method not in SMOOTHING_METHODS:
+            raise ValueError(f"Unknown RSSI smoothing method '{method}'. Expected one of {SMOOTHING_METHODS}.")
+        self.method = method
+        self.window_size = int(window_size)
+        self.ema_alpha = float(ema_alpha)
+        self.trim_fraction = float(trim_fraction)
+        self.expiry_ms = int(expiry_ms)
+
+        self.tracker_rows: Dict[str, int] = {}
+        self.beacon_cols: Dict[str, int] = {}
+        self.beacon_macs: List[str] = []
+        self.free_rows: List[int] = []
+        self._allocate(tracker_capacity, beacon_capacity)
+
+    def _allocate(self, rows: int, cols: int):
+        self.window = np.full((rows, cols, self.window_size), np.nan, dtype=np.float32)
+        self.head = np.zeros((rows, cols), dtype=np.int32)
+        self.ema = np.zeros((rows, cols), dtype=np.float32)
+        self.last_seen = np.full((rows, cols), -1, dtype=np.int64)
+        self.output = np.full((rows, cols), None, dtype=object) # DetectedBeacon returned for the pair, updated in place
+
+    def _resize(self, rows: int, cols: int):
+        old = (self.window, self.head, self.ema, self.last_seen, self.output)
+        old_rows, old_cols = self.head.shape
+        self._allocate(rows, cols)
+        for new_arr, old_arr in zip((self.window, self.head, self.ema, self.last_seen, self.output), old):
+            new_arr[:old_rows, :old_cols] = old_arr
+        log.debug(f"RSSI smoother resized to {rows} trackers x {cols} beacons")
+
+    def _row(self, tracker_id: str) -> int:
+        row = self.tracker_rows.get(tracker_id)
+        if row is None:
+            if self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                row = len(self.tracker_rows)
+                if row >= self.head.shape[0]:
+                    self._resize(self.head.shape[0] * 2, self.head.shape[1])
+            self.tracker_rows[tracker_id] = row
+        return row
+
+    def _col(self, mac: str) -> int:
+        col = self.beacon_cols.get(mac)
+        if col is None:
+            col = len(self.beacon_macs)
+            if col >= self.head.shape[1]:
+                self._resize(self.head.shape[0], self.head.shape[1] * 2)
+            self.beacon_cols[mac] = col
+            self.beacon_macs.append(mac)
+        return col
+
+    def remove_tracker(self, tracker_id: str):
+        """Clears and frees the row of a tracker that is no longer tracked."""
+        row = self.tracker_rows.pop(tracker_id, None)
+        if row is not None:
+            self.window[row] = np.nan
+            self.head[row] = 0
+            self.last_seen[row] = -1
+            self.free_rows.append(row)
+
+    def smooth(self, tracker_id: str, detected_beacons: List[DetectedBeacon], timestamp_ms: int) -> List[DetectedBeacon]:
+        """
+        Adds a report's readings to the windows and returns the smoothed readings of
+        the beacons in this report, strongest first. The returned DetectedBeacons
+        belong to the smoother and are overwritten by the tracker's next report;
+        callers that keep them beyond that must copy them.
+        """
+        if self.method == "none":
+            return detected_beacons
+        row = self._row(tracker_id)
+        seen = self.last_seen[row]
+        expired = (seen >= 0) & (seen < timestamp_ms - self.expiry_ms)
+        if expired.any(): # Before the new readings, so a beacon that is back does not resume its old window
+            self.window[row, expired] = np.nan
+            self.head[row, expired] = 0
+            seen[expired] = -1
+        readings = {self._col(b.macAddress.upper()): b for b in detected_beacons if b.macAddress} # Column -> reading (last wins)
+        if not readings:
+            return []
+
+        cols = np.fromiter(readings, dtype=np.int64, count=len(readings))
+        rssi = np.fromiter((b.rssi for b in readings.values()), dtype=np.float32, count=len(readings))
+        heads = self.head[row, cols]
+        self.window[row, cols, heads] = rssi
+        self.head[row, cols] = (heads + 1) % self.window_size
+        fresh = self.last_seen[row, cols] < 0
+        self.ema[row, cols] = np.where(fresh, rssi, self.ema_alpha * rssi + (1.0 - self.ema_alpha) * self.ema[row, cols])
+        self.last_seen[row, cols] = timestamp_ms
+
+        if self.method == "ema":
+            values = self.ema[row, cols]
+        else:
+            ordered = np.sort(self.window[row, cols], axis=1) # NaNs (empty slots) sort last
+            counts = np.sum(~np.isnan(ordered), axis=1)
+            rows = np.arange(len(cols))
+            if self.method == "median":
+                values = (ordered[rows, (counts - 1) // 2] + ordered[rows, counts // 2]) / 2.0
+            else: # trimmed_mean
+                trim = np.floor(counts * self.trim_fraction).astype(np.int64)
+                cumulative = np.concatenate([np.zeros((len(cols), 1), dtype=np.float64),
+                                             np.cumsum(np.nan_to_num(ordered), axis=1)], axis=1)
+                values = (cumulative[rows, counts - trim] - cumulative[rows, trim]) / (counts - 2 * trim)
+
+        output = self.output[row]
+        smoothed = []
+        for i in np.argsort(-values, kind='stable'):
+            col = int(cols[i])
+            value = int(round(float(values[i])))
+            reading = readings[col]
+            beacon = output[col]
+            if beacon is None:
+                beacon = output[col] = DetectedBeacon(macAddress=self.beacon_macs[col], major=reading.major, minor=reading.minor, rssi=value)
+            else:
+                beacon.rssi = value
+                if beacon.major != reading.major or beacon.minor != reading.minor:
+                    beacon.major, beacon.minor = reading.major, reading.minor
+            smoothed.append(beacon)
+        return smoothed
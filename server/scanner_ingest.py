@@ -0,0 +1,186 @@
+# server/scanner_ingest.py
+"""
+Ingest from local-beacon-service scanners (local-beacon-service/service.js).
+
+The service streams every iBeacon advertisement it hears as a WebSocket message
+{"type": "beacon", "data": {"address", "rssi", "iBeacon": {...}, ...}}, tens to
+hundreds per second. For each configured scanner (scannerIngest.scanners: url and
+the tracker id its reports are positioned as) a ScannerConnection keeps a
+WebSocket open, sends startScan, and accumulates the advertisements of a window
+(scannerIngest.windowMs) per beacon MAC: a running sum, count and maximum of the
+RSSI, O(1) per advertisement. When the window ends it becomes one TrackerReport
+with the mean (or maximum) RSSI of every beacon heard at least
+minAdvertisements times, which goes through the normal report pipeline. Lost
+connections are retried with exponential backoff (with jitter).
+"""
+import asyncio
+import json
+import logging
+import math
+import random
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import websockets
+
+from .models import DetectedBeacon, ScannerIngestParams, ScannerSourceParams, TrackerReport
+
+log = logging.getLogger(__name__)
+
+MAC_PATTERN = re.compile(r"^[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2}){5}$")
+CONNECT_TIMEOUT_SECONDS = 10.0
+
+Submit = Callable[[TrackerReport], Awaitable[None]]
+
+class ScanWindow:
+    """Per-beacon RSSI accumulators of one window: MAC -> [sum, count, max, major, minor]."""
+    __slots__ = ("beacons", "advertisements")
+
+    def __init__(self):
+        self.beacons: Dict[str, list] = {}
+        self.advertisements = 0
+
+    def add(self, mac: str, rssi: int, major: Optional[int], minor: Optional[int]):
+        self.advertisements += 1
+        entry = self.beacons.get(mac)
+        if entry is None:
+            self.beacons[mac] = [rssi, 1, rssi, major, minor]
+        else:
+            entry[0] += rssi
+            entry[1] += 1
+            if rssi > entry[2]:
+                entry[2] = rssi
+
+    def detected(self, aggregate: str, min_advertisements: int) -> List[DetectedBeacon]:
+        return [
+            DetectedBeacon(macAddress=mac, rssi=round(total / count) if aggregate == "mean" else strongest, major=major, minor=minor)
+            for mac, (total, count, strongest, major, minor) in self.beacons.items() if count >= min_advertisements
+        ]
+
+
+class ScannerConnection:
+    """One scanner: keeps its WebSocket connected and turns its advertisements into windowed reports."""
+    def __init__(self, source: ScannerSourceParams, owner: "ScannerIngest"):
+        self.source = source
+        self.owner = owner
+        self.status = "connecting"
+        self.counters = {"advertisements": 0, "reports": 0, "unaddressable": 0, "invalid": 0, "reconnects": 0}
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        delay = self.owner.params.reconnectMinDelaySeconds
+        while True:
+            try:
+                async with websockets.connect(self.source.url, open_timeout=CONNECT_TIMEOUT_SECONDS) as ws:
+                    self.status = "connected"
+                    delay = self.owner.params.reconnectMinDelaySeconds
+                    log.info(f"Scanner '{self.source.trackerId}' connected to {self.source.url}")
+                    if self.owner.params.startScan:
+                        await ws.send(json.dumps({"command": "startScan", "ignoredMacAddresses": self.source.ignoredMacAddresses}))
+                    await self._receive(ws)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                log.warning(f"Scanner '{self.source.trackerId}' at {self.source.url}: {e}")
+            self.status = "error"
+            self.counters["reconnects"] += 1
+            wait = delay * random.uniform(0.5, 1.0)
+            log.info(f"Scanner '{self.source.trackerId}' reconnecting to {self.source.url} in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.owner.params.reconnectMaxDelaySeconds)
+
+    async def _receive(self, ws):
+        window = ScanWindow()
+        window_end = time.monotonic() + self.owner.params.windowMs / 1000
+        while True:
+            remaining = window_end - time.monotonic()
+            if remaining <= 0:
+                await self._close_window(window)
+                window = ScanWindow()
+                window_end = max(window_end + self.owner.params.windowMs / 1000, time.monotonic()) # No catch-up burst after a stall
+                continue
+            try:
+                raw = await asyncio.wait_for(ws.recv(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            self._on_message(raw, window)
+
+    def _on_message(self, raw, window: ScanWindow):
+        """Adds a beacon message to the window; malformed messages are counted, never raised (that would end run())."""
+        try:
+            message = json.loads(raw)
+            kind = message.get("type")
+        except (ValueError, AttributeError):
+            self.counters["invalid"] += 1
+            return
+        if kind != "beacon":
+            if kind == "error":
+                log.warning(f"Scanner '{self.source.trackerId}': {message.get('message')}")
+            elif kind == "info":
+                log.info(f"Scanner '{self.source.trackerId}': {message.get('message')}")
+            return
+        data = message.get("data")
+        if not isinstance(data, dict):
+            self.counters["invalid"] += 1
+            return
+        address, rssi = data.get("address"), data.get("rssi")
+        if not isinstance(rssi, (int, float)) or not math.isfinite(rssi):
+            self.counters["invalid"] += 1
+            return
+        if not isinstance(address, str) or not MAC_PATTERN.match(address):
+            self.counters["unaddressable"] += 1 # e.g. macOS, where noble only reports a per-host peripheral id
+            return
+        ibeacon = data.get("iBeacon")
+        major, minor = (ibeacon.get("major"), ibeacon.get("minor")) if isinstance(ibeacon, dict) else (None, None)
+        window.add(address.upper(), int(rssi), major if isinstance(major, int) else None, minor if isinstance(minor, int) else None)
+        self.counters["advertisements"] += 1
+
+    async def _close_window(self, window: ScanWindow):
+        params = self.owner.params
+        detected = window.detected(params.aggregate, params.minAdvertisements)
+        if not detected:
+            return
+        self.counters["reports"] += 1
+        await self.owner.submit(TrackerReport(trackerId=self.source.trackerId, timestamp=int(time.time() * 1000), detectedBeacons=detected))
+
+
+class ScannerIngest:
+    """The ScannerConnection of every configured scanner; follows config changes once started."""
+    def __init__(self):
+        self.params = ScannerIngestParams()
+        self.submit: Optional[Submit] = None
+        self._connections: Dict[Tuple[str, str], ScannerConnection] = {} # (url, trackerId) -> connection
+
+    def configure(self, params: ScannerIngestParams):
+        self.params = params
+        if self.submit is not None:
+            self._sync()
+
+    def start(self, submit: Submit):
+        """Starts the configured scanners (on the event loop); submit receives their reports."""
+        self.submit = submit
+        self._sync()
+
+    def stop(self):
+        self.submit = None
+        self._sync()
+
+    def _sync(self):
+        wanted = {(s.url, s.trackerId): s for s in self.params.scanners} if self.params.enabled and self.submit else {}
+        for key in [k for k in self._connections if k not in wanted]:
+            self._connections.pop(key).task.cancel()
+        for key, source in wanted.items():
+            connection = self._connections.get(key)
+            if connection is not None and connection.source == source:
+                continue
+            if connection is not None:
+                connection.task.cancel()
+            connection = self._connections[key] = ScannerConnection(source, self)
+            connection.task = asyncio.get_running_loop().create_task(connection.run())
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": self.params.enabled,
+            "windowMs": self.params.windowMs,
+            "scanners": [{"url": c.source.url, "trackerId": c.source.trackerId, "status": c.status, **c.counters}
+                         for c in self._connections.values()],
+        }
@@ -0,0 +1,195 @@
+# server/solve_memo.py
+"""
+Skipping solves for trackers whose signal has not changed.
+
+Asset tags mostly sit still, so consecutive reports carry nearly the same RSSI
+and every solve returns nearly the same position. Two mechanisms avoid that work:
+
+- SolveMemo: a bounded LRU of solve results keyed by (floor, cell of the warm
+  start, beacon MACs, RSSI quantized to rssiStepDb). Reports of a tag at one of
+  its usual spots reuse the result. The warm start's cell (startCellMeters) is
+  part of the key because with few or collinear beacons the solver can converge
+  to a different fix (a mirror image or local minimum) from a different start;
+  a result is only reused for starts within the same cell. A hit still returns
+  the fix of an earlier report, so positions are coarser (solveMemo is off by
+  default).
+- StationaryDetector: per tracker, the mean RSSI vector of the current "stay".
+  A report belongs to the stay while an EMA of the reports stays within
+  rssiToleranceDb (RMS over the beacons) of that mean, and the report itself
+  within twice that. Once the stay has more than minReports reports and the
+  filter's speed is below maxSpeed, the tracker is stationary: its filter is
+  held (velocity zero, no prediction drift) and updated with the solve of the
+  stay's mean RSSI, which is only re-solved when the stay's report count
+  doubles; in between, the unchanged fix is not applied again. Every
+  checkIntervalReports reports the report itself is solved, and a fix more than
+  maxDriftMeters from the stay's ends the stay: a tag creeping away slowly keeps
+  its RSSI within tolerance for a long time. A resting tag costs a few solves
+  per stay, and its position averages the noise of the whole stay instead of
+  following single reports. Off by default (stationary.enabled).
+
+Both count what they saved; CPU time saved is estimated from the mean duration
+of the solves that did run.
+"""
+import math
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from .models import DetectedBeacon
+
+RECENT_ALPHA = 0.3 # EMA weight of the newest report in a stay's recent RSSI
+
+def beacon_vector(beacons: List[DetectedBeacon]) -> Dict[str, int]:
+    return {b.macAddress.lower(): b.rssi for b in beacons if b.macAddress}
+
+
+class SolveMemo:
+    """LRU of solve results by (floor, warm start cell, quantized RSSI vector), with hit / miss counters and solve timing."""
+    def __init__(self, max_entries: int = 50_000, rssi_step_db: float = 2.0, start_cell_m: float = 1.0):
+        self.max_entries = int(max_entries)
+        self.rssi_step = float(rssi_step_db)
+        self.start_cell = float(start_cell_m)
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "evicted": 0, "stationarySkips": 0}
+        self.solves = 0 # Solves timed
+        self.solve_seconds = 0.0
+
+    def configure(self, max_entries: int, rssi_step_db: float, start_cell_m: float):
+        if float(rssi_step_db) != self.rssi_step or float(start_cell_m) != self.start_cell:
+            self._entries.clear()
+        self.rssi_step = float(rssi_step_db)
+        self.start_cell = float(start_cell_m)
+        self.max_entries = int(max_entries)
+        self._trim()
+
+    def key(self, floor_id: str, beacons: List[DetectedBeacon], initial_guess: Optional[Tuple[float, float]]) -> Hashable:
+        step = self.rssi_step
+        cell = None if initial_guess is None else (math.floor(initial_guess[0] / self.start_cell), math.floor(initial_guess[1] / self.start_cell))
+        return (floor_id, cell, tuple(sorted((mac, round(rssi / step)) for mac, rssi in beacon_vector(beacons).items())))
+
+    def get(self, key: Hashable):
+        """The stored SolveResult, or None on a miss."""
+        result = self._entries.get(key)
+        if result is None:
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return result
+
+    def put(self, key: Hashable, result, solve_seconds: float):
+        """Records a solve that ran; only successful ones are kept (failures are cheap: too few beacons)."""
+        self.solves += 1
+        self.solve_seconds += solve_seconds
+        if result is not None:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            self._trim()
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evicted"] += 1
+
+    def clear(self):
+        """Forgets all results, e.g. when beacons, floors or solver settings changed."""
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        mean_solve = self.solve_seconds / self.solves if self.solves else 0.0
+        skipped = self.counters["hits"] + self.counters["stationarySkips"]
+        return {
+            **self.counters,
+            "hitRate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "meanSolveMs": round(mean_solve * 1000, 4),
+            "cpuSecondsSaved": round(skipped * mean_solve, 3), # Estimate: skipped solves x mean solve time
+        }
+
+
+class Stay:
+    """A tracker's current stay: mean and recent (EMA) RSSI per beacon, and the solve of the mean."""
+    __slots__ = ("mean", "recent", "count", "stationary", "result", "solved_at")
+
+    def __init__(self, vector: Dict[str, int]):
+        self.mean = {mac: float(rssi) for mac, rssi in vector.items()}
+        self.recent = dict(self.mean)
+        self.count = 1 # Reports in the stay
+        self.stationary = False
+        self.result = None # SolveResult of mean_beacons()
+        self.solved_at = 0 # count when result was computed
+
+    def needs_solve(self) -> bool:
+        """Solved when the stay becomes stationary, then whenever its report count doubled (the mean got more precise)."""
+        return self.result is None or self.count >= 2 * self.solved_at
+
+    def needs_check(self, interval: int) -> bool:
+        """Every interval reports after the last solve of the mean, the report itself is solved to detect drift."""
+        return self.count > self.solved_at and (self.count - self.solved_at) % interval == 0
+
+    def mean_beacons(self) -> List[DetectedBeacon]:
+        return [DetectedBeacon(macAddress=mac, rssi=int(round(rssi))) for mac, rssi in self.mean.items()]
+
+
+class StationaryDetector:
+    """Per-tracker stay detection on the RSSI vector (see module docstring)."""
+    def __init__(self, rssi_tolerance_db: float = 2.0, min_reports: int = 3, max_speed: float = 0.3):
+        self.tolerance = float(rssi_tolerance_db)
+        self.min_reports = int(min_reports)
+        self.max_speed = float(max_speed)
+        self._stays: Dict[str, Stay] = {}
+        self.counters = {"stationaryReports": 0, "stays": 0, "moves": 0}
+
+    def configure(self, rssi_tolerance_db: float, min_reports: int, max_speed: float):
+        self.tolerance = float(rssi_tolerance_db)
+        self.min_reports = int(min_reports)
+        self.max_speed = float(max_speed)
+
+    def observe(self, tracker_id: str, beacons: List[DetectedBeacon], speed: Optional[float]) -> Optional[Stay]:
+        """
+        Records a report; returns the tracker's stay if it is (still) stationary, else
+        None. speed (m/s, e.g. the filter's) must be at most max_speed for a stay to
+        start counting as stationary; None if unknown (no stay starts).
+        """
+        vector = beacon_vector(beacons)
+        stay = self._stays.get(tracker_id)
+        if stay is not None and vector and stay.mean.keys() == vector.keys():
+            mean, recent = stay.mean, stay.recent
+            squared = 0.0 # This report's deviation from the mean
+            for mac, rssi in vector.items():
+                recent[mac] += RECENT_ALPHA * (rssi - recent[mac])
+                squared += (rssi - mean[mac]) ** 2
+            deviation = math.sqrt(sum((recent[mac] - mean[mac]) ** 2 for mac in mean) / len(mean))
+            if deviation <= self.tolerance and math.sqrt(squared / len(mean)) <= 2 * self.tolerance:
+                stay.count += 1
+                for mac, rssi in vector.items():
+                    mean[mac] += (rssi - mean[mac]) / stay.count
+                if not stay.stationary:
+                    if stay.count <= self.min_reports or speed is None or speed > self.max_speed:
+                        return None
+                    stay.stationary = True
+                    self.counters["stays"] += 1
+                self.counters["stationaryReports"] += 1
+                return stay
+        if stay is not None and stay.stationary:
+            self.counters["moves"] += 1
+        self._stays[tracker_id] = Stay(vector) # This report starts a possible new stay
+        return None
+
+    def end(self, tracker_id: str):
+        """Ends the tracker's stay, e.g. because a check solve showed it moved; its next report starts a new one."""
+        stay = self._stays.pop(tracker_id, None)
+        if stay is not None and stay.stationary:
+            self.counters["moves"] += 1
+
+    def forget(self, tracker_id: str):
+        self._stays.pop(tracker_id, None)
+
+    def clear(self):
+        """Ends all stays, e.g. when beacons, floors or solver settings changed (their fixes are stale)."""
+        self._stays.clear()
+
+    def metrics(self) -> dict:
+        stationary = sum(1 for stay in self._stays.values() if stay.stationary)
+        return {**self.counters, "trackers": len(self._stays), "stationaryNow": stationary}
@@ -0,0 +1,442 @@
+# server/spatial_index.py
+import math
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+
+from .models import WebUIMapInfo, WebUIMapEntity, WebUIBeaconConfig, WebUIConfig
+
+# --- Wall Segment Extraction ---
+def entity_segments(entity: WebUIMapEntity) -> np.ndarray:
+    """
+    Returns the segments [x0, y0, x1, y1] of one map entity as an (S, 4) array.
+    Closed polylines get their closing segment added if the last point does not
+    already repeat the first one.
+    """
+    points = [p for p in entity.points if len(p) >= 2]
+    segments: List[Tuple[float, float, float, float]] = []
+    for (x0, y0, *_), (x1, y1, *_) in zip(points[:-1], points[1:]):
+        if x0 != x1 or y0 != y1: # Skip zero-length segments
+            segments.append((x0, y0, x1, y1))
+    if entity.closed and len(points) > 2 and (points[0][0] != points[-1][0] or points[0][1] != points[-1][1]):
+        segments.append((points[-1][0], points[-1][1], points[0][0], points[0][1]))
+    if not segments:
+        return np.empty((0, 4), dtype=np.float64)
+    return np.asarray(segments, dtype=np.float64)
+
+def extract_wall_segments(map_info: Optional[WebUIMapInfo]) -> np.ndarray:
+    """Flattens the polylines in the map entities into an (S, 4) array of wall segments [x0, y0, x1, y1]."""
+    if not map_info or not map_info.entities:
+        return np.empty((0, 4), dtype=np.float64)
+    return np.concatenate([entity_segments(e) for e in map_info.entities] + [np.empty((0, 4))])
+
+
+def _segments_intersect(a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """
+    Vectorized test whether segments a->b intersect segments c->d (all arrays broadcast
+    over leading dims, last dim is [x, y]). Touching counts as intersecting, moving
+    exactly along a wall (collinear) does not.
+    """
+    def cross(o, p, q):
+        return (p[..., 0] - o[..., 0]) * (q[..., 1] - o[..., 1]) - (p[..., 1] - o[..., 1]) * (q[..., 0] - o[..., 0])
+
+    d1 = cross(c, d, a)
+    d2 = cross(c, d, b)
+    d3 = cross(a, b, c)
+    d4 = cross(a, b, d)
+    collinear = (d1 == 0) & (d2 == 0)
+    return (d1 * d2 <= 0) & (d3 * d4 <= 0) & ~collinear
+
+
+# --- Uniform Grid Index over Wall Segments ---
+class SegmentGridIndex:
+    """
+    Uniform grid over wall segments for fast, vectorized wall-crossing tests.
+
+    Each cell stores the ids of the segments whose bounding box overlaps it, in a
+    padded (num_cells, max_per_cell) table so lookups are pure array indexing.
+    A motion step no longer than one cell touches at most a 2x2 block of cells,
+    so only those candidates are tested; longer steps fall back to a brute-force
+    test against every segment.
+    """
+    def __init__(self, segments: np.ndarray, cell_size: float = 1.0):
+        self.segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        self.cell_size = float(cell_size)
+        if self.cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+
+        if len(self.segments):
+            xs = self.segments[:, [0, 2]]
+            ys = self.segments[:, [1, 3]]
+            self.origin = np.array([xs.min(), ys.min()])
+            extent = np.array([xs.max(), ys.max()]) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        self.nx = int(math.floor(extent[0] / self.cell_size)) + 1
+        self.ny = int(math.floor(extent[1] / self.cell_size)) + 1
+
+        # Collect (cell, segment) pairs from each segment's bounding box
+        cell_lists: List[List[int]] = [[] for _ in range(self.nx * self.ny)]
+        for seg_id, (x0, y0, x1, y1) in enumerate(self.segments):
+            cx0, cy0 = self._cell_of(min(x0, x1), min(y0, y1))
+            cx1, cy1 = self._cell_of(max(x0, x1), max(y0, y1))
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    cell_lists[cy * self.nx + cx].append(seg_id)
+
+        max_per_cell = max((len(c) for c in cell_lists), default=0)
+        self.cell_segments = np.full((len(cell_lists), max(max_per_cell, 1)), -1, dtype=np.int32)
+        for cell_id, seg_ids in enumerate(cell_lists):
+            if seg_ids:
+                self.cell_segments[cell_id, :len(seg_ids)] = seg_ids
+
+    @classmethod
+    def from_map(cls, map_info: Optional[WebUIMapInfo], cell_size: float = 1.0) -> "SegmentGridIndex":
+        """Builds the index from the walls (polyline entities) of a Web UI map."""
+        return cls(extract_wall_segments(map_info), cell_size=cell_size)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def _cell_of(self, x: float, y: float) -> Tuple[int, int]:
+        cx = int(math.floor((x - self.origin[0]) / self.cell_size))
+        cy = int(math.floor((y - self.origin[1]) / self.cell_size))
+        return min(max(cx, 0), self.nx - 1), min(max(cy, 0), self.ny - 1)
+
+    def crossing_mask(self, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean mask (N,) telling which motions start[i] -> end[i] cross a wall.
+
+        Args:
+            start: (N, 2) array of start points.
+            end: (N, 2) array of end points.
+        """
+        start = np.asarray(start, dtype=np.float64).reshape(-1, 2)
+        end = np.asarray(end, dtype=np.float64).reshape(-1, 2)
+        result = np.zeros(len(start), dtype=bool)
+        if not len(self.segments) or not len(start):
+            return result
+
+        step = np.abs(end - start)
+        long_step = (step[:, 0] > self.cell_size) | (step[:, 1] > self.cell_size)
+        short_idx = np.flatnonzero(~long_step)
+
+        if len(short_idx):
+            a = start[short_idx]
+            b = end[short_idx]
+            lo = np.floor((np.minimum(a, b) - self.origin) / self.cell_size).astype(np.int64)
+            hi = np.floor((np.maximum(a, b) - self.origin) / self.cell_size).astype(np.int64)
+            # Visit only the cells of the step's bounding box (1, 2 or 4 of the 2x2 block)
+            off_x = np.array([0, 1, 0, 1])
+            off_y = np.array([0, 0, 1, 1])
+            in_box = (off_x <= (hi[:, 0] - lo[:, 0])[:, None]) & (off_y <= (hi[:, 1] - lo[:, 1])[:, None])
+            cx = np.clip(lo[:, 0, None] + off_x, 0, self.nx - 1)
+            cy = np.clip(lo[:, 1, None] + off_y, 0, self.ny - 1)
+            candidates = self.cell_segments[cy * self.nx + cx] # (n, 4, K)
+            candidates = np.where(in_box[:, :, None], candidates, -1).reshape(len(short_idx), -1)
+            # Test only the (motion, segment) pairs that actually share a cell
+            rows, cols = np.nonzero(candidates >= 0)
+            if len(rows):
+                seg = self.segments[candidates[rows, cols]]
+                hits = _segments_intersect(a[rows], b[rows], seg[:, 0:2], seg[:, 2:4])
+                result[short_idx[rows[hits]]] = True
+
+        long_idx = np.flatnonzero(long_step)
+        if len(long_idx):
+            seg = self.segments[None, :, :]
+            hits = _segments_intersect(start[long_idx, None, :], end[long_idx, None, :], seg[..., 0:2], seg[..., 2:4])
+            result[long_idx] = np.any(hits, axis=1)
+
+        return result
+
+
+def points_in_polygons(x: float, y: float, edges: np.ndarray, owners: np.ndarray, num_owners: int) -> np.ndarray:
+    """
+    Vectorized crossing-number test of one point against several polygons at once.
+
+    Args:
+        edges: (E, 4) polygon edges [x0, y0, x1, y1] of all polygons, concatenated.
+        owners: (E,) index of the polygon each edge belongs to (0..num_owners-1).
+
+    Returns:
+        Boolean array (num_owners,) telling which polygons contain the point.
+    """
+    x0, y0, x1, y1 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+    straddles = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    crossings = straddles & (x < x_cross)
+    return (np.bincount(owners[crossings], minlength=num_owners) % 2) == 1
+
+
+# --- Reusable Spatial Index over Map Entities and Beacons ---
+class _IndexedEntity:
+    __slots__ = ("entity", "key", "bbox", "segments", "cells")
+
+    def __init__(self, entity: WebUIMapEntity, key: tuple, bbox: np.ndarray, segments: np.ndarray, cells: List[Tuple[int, int]]):
+        self.entity = entity
+        self.key = key
+        self.bbox = bbox
+        self.segments = segments
+        self.cells = cells
+
+
+class SpatialIndex:
+    """
+    Uniform grid index over map entities and beacon positions.
+
+    Entities are registered in every cell overlapped by their bounding box and
+    beacons in the cell containing them; cells are sparse (a dict of sets), so
+    entities and beacons can be added and removed one by one. update_from_config()
+    diffs a new configuration against the indexed one by geometry and only
+    re-grids what changed.
+
+    Queries: nearest_beacons (k nearest), beacons_in_rect / entities_in_rect,
+    entities_crossing_segment and entities_containing_point (closed entities).
+    """
+    def __init__(self, cell_size: float = 2.0):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.cell_size = float(cell_size)
+
+        self._entities: Dict[int, _IndexedEntity] = {}
+        self._entity_cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._next_entity_id = 0
+
+        self._beacons: Dict[int, Tuple[WebUIBeaconConfig, tuple]] = {}
+        self._beacon_xy: Dict[int, Tuple[float, float]] = {}
+        self._beacon_cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._beacon_cell_bounds: Optional[Tuple[int, int, int, int]] = None # Lazily computed, reset on change
+        self._next_beacon_id = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[WebUIConfig], cell_size: float = 2.0) -> "SpatialIndex":
+        """Builds the index from a Web UI configuration (map entities and beacons)."""
+        index = cls(cell_size=cell_size)
+        index.update_from_config(config)
+        return index
+
+    # --- Grid helpers ---
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def _cells_in_rect(self, xmin: float, ymin: float, xmax: float, ymax: float) -> Iterable[Tuple[int, int]]:
+        cx0, cy0 = self._cell(xmin, ymin)
+        cx1, cy1 = self._cell(xmax, ymax)
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                yield (cx, cy)
+
+    def _collect(self, cells: Dict[Tuple[int, int], Set[int]], xmin: float, ymin: float, xmax: float, ymax: float) -> Set[int]:
+        # Visit whichever is smaller: the cells of the rectangle or the occupied cells
+        cx0, cy0 = self._cell(xmin, ymin)
+        cx1, cy1 = self._cell(xmax, ymax)
+        found: Set[int] = set()
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) <= len(cells):
+            for cell in self._cells_in_rect(xmin, ymin, xmax, ymax):
+                ids = cells.get(cell)
+                if ids:
+                    found |= ids
+        else:
+            for (cx, cy), ids in cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found |= ids
+        return found
+
+    # --- Entities ---
+    @staticmethod
+    def _entity_key(entity: WebUIMapEntity) -> tuple:
+        return (entity.type, bool(entity.closed), tuple(map(tuple, entity.points)))
+
+    def add_entity(self, entity: WebUIMapEntity) -> int:
+        """Indexes one map entity and returns its id."""
+        points = np.asarray([p[:2] for p in entity.points if len(p) >= 2], dtype=np.float64).reshape(-1, 2)
+        if not len(points):
+            points = np.zeros((1, 2))
+        bbox = np.concatenate([points.min(axis=0), points.max(axis=0)])
+        cells = list(self._cells_in_rect(*bbox))
+        entity_id = self._next_entity_id
+        self._next_entity_id += 1
+        self._entities[entity_id] = _IndexedEntity(entity, self._entity_key(entity), bbox, entity_segments(entity), cells)
+        for cell in cells:
+            self._entity_cells.setdefault(cell, set()).add(entity_id)
+        return entity_id
+
+    def remove_entity(self, entity_id: int):
+        """Removes one entity from the index."""
+        indexed = self._entities.pop(entity_id, None)
+        if indexed is None:
+            return
+        for cell in indexed.cells:
+            ids = self._entity_cells.get(cell)
+            if ids is not None:
+                ids.discard(entity_id)
+                if not ids:
+                    del self._entity_cells[cell]
+
+    def set_entities(self, entities: List[WebUIMapEntity]) -> Tuple[int, int]:
+        """
+        Makes the indexed entities equal to the given list, touching only entities
+        whose geometry changed. Returns (added, removed) counts.
+        """
+        by_key: Dict[tuple, List[int]] = {}
+        for entity_id, indexed in self._entities.items():
+            by_key.setdefault(indexed.key, []).append(entity_id)
+
+        added = 0
+        for entity in entities:
+            existing = by_key.get(self._entity_key(entity))
+            if existing:
+                self._entities[existing.pop()].entity = entity # Same geometry, keep cells; refresh style fields
+            else:
+                self.add_entity(entity)
+                added += 1
+
+        removed = 0
+        for leftover in by_key.values():
+            for entity_id in leftover:
+                self.remove_entity(entity_id)
+                removed += 1
+        return added, removed
+
+    def entities_in_rect(self, xmin: float, ymin: float, xmax: float, ymax: float) -> List[WebUIMapEntity]:
+        """Entities whose bounding box overlaps the rectangle (e.g. a client viewport)."""
+        result = []
+        for entity_id in sorted(self._collect(self._entity_cells, xmin, ymin, xmax, ymax)):
+            bx0, by0, bx1, by1 = self._entities[entity_id].bbox
+            if bx0 <= xmax and bx1 >= xmin and by0 <= ymax and by1 >= ymin:
+                result.append(self._entities[entity_id].entity)
+        return result
+
+    def entities_crossing_segment(self, x0: float, y0: float, x1: float, y1: float) -> List[WebUIMapEntity]:
+        """Entities with at least one segment intersecting the segment (x0, y0) -> (x1, y1)."""
+        candidates = sorted(self._collect(self._entity_cells, min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)))
+        candidates = [c for c in candidates if len(self._entities[c].segments)]
+        if not candidates:
+            return []
+        segments = np.concatenate([self._entities[c].segments for c in candidates])
+        owners = np.repeat(np.arange(len(candidates)), [len(self._entities[c].segments) for c in candidates])
+        hits = _segments_intersect(np.array([x0, y0]), np.array([x1, y1]), segments[:, 0:2], segments[:, 2:4])
+        hit_owners = np.unique(owners[hits])
+        return [self._entities[candidates[i]].entity for i in hit_owners]
+
+    def entities_containing_point(self, x: float, y: float) -> List[WebUIMapEntity]:
+        """Closed entities (polygons) containing the point."""
+        candidates = [c for c in sorted(self._entity_cells.get(self._cell(x, y), ()))
+                      if self._entities[c].entity.closed and len(self._entities[c].segments) >= 3]
+        if not candidates:
+            return []
+        edges = np.concatenate([self._entities[c].segments for c in candidates])
+        owners = np.repeat(np.arange(len(candidates)), [len(self._entities[c].segments) for c in candidates])
+        inside = points_in_polygons(x, y, edges, owners, len(candidates))
+        return [self._entities[candidates[i]].entity for i in np.flatnonzero(inside)]
+
+    def wall_segments(self) -> np.ndarray:
+        """All indexed entity segments as an (S, 4) array (e.g. for a SegmentGridIndex)."""
+        return np.concatenate([e.segments for e in self._entities.values()] + [np.empty((0, 4))])
+
+    # --- Beacons ---
+    @staticmethod
+    def _beacon_key(beacon: WebUIBeaconConfig) -> tuple:
+        return (beacon.uuid, beacon.major, beacon.minor, beacon.macAddress, beacon.x, beacon.y)
+
+    def add_beacon(self, beacon: WebUIBeaconConfig) -> int:
+        """Indexes one beacon at its configured coordinates and returns its id."""
+        beacon_id = self._next_beacon_id
+        self._next_beacon_id += 1
+        self._beacons[beacon_id] = (beacon, self._beacon_key(beacon))
+        self._beacon_xy[beacon_id] = (beacon.x, beacon.y)
+        self._beacon_cells.setdefault(self._cell(beacon.x, beacon.y), set()).add(beacon_id)
+        self._beacon_cell_bounds = None
+        return beacon_id
+
+    def remove_beacon(self, beacon_id: int):
+        """Removes one beacon from the index."""
+        if self._beacons.pop(beacon_id, None) is None:
+            return
+        cell = self._cell(*self._beacon_xy.pop(beacon_id))
+        ids = self._beacon_cells.get(cell)
+        if ids is not None:
+            ids.discard(beacon_id)
+            if not ids:
+                del self._beacon_cells[cell]
+        self._beacon_cell_bounds = None
+
+    def set_beacons(self, beacons: List[WebUIBeaconConfig]) -> Tuple[int, int]:
+        """Makes the indexed beacons equal to the given list, touching only changed ones. Returns (added, removed)."""
+        by_key: Dict[tuple, List[int]] = {}
+        for beacon_id, (_, key) in self._beacons.items():
+            by_key.setdefault(key, []).append(beacon_id)
+
+        added = 0
+        for beacon in beacons:
+            existing = by_key.get(self._beacon_key(beacon))
+            if existing:
+                beacon_id = existing.pop()
+                self._beacons[beacon_id] = (beacon, self._beacons[beacon_id][1])
+            else:
+                self.add_beacon(beacon)
+                added += 1
+
+        removed = 0
+        for leftover in by_key.values():
+            for beacon_id in leftover:
+                self.remove_beacon(beacon_id)
+                removed += 1
+        return added, removed
+
+    def beacons_in_rect(self, xmin: float, ymin: float, xmax: float, ymax: float) -> List[WebUIBeaconConfig]:
+        """Beacons located inside the rectangle."""
+        result = []
+        for beacon_id in sorted(self._collect(self._beacon_cells, xmin, ymin, xmax, ymax)):
+            bx, by = self._beacon_xy[beacon_id]
+            if xmin <= bx <= xmax and ymin <= by <= ymax:
+                result.append(self._beacons[beacon_id][0])
+        return result
+
+    def nearest_beacons(self, x: float, y: float, k: int = 3, max_distance: Optional[float] = None) -> List[Tuple[WebUIBeaconConfig, float]]:
+        """
+        The k beacons closest to (x, y) as (beacon, distance) pairs, nearest first.
+        Searches rings of cells outward until no unvisited cell can hold a closer beacon.
+        """
+        if k <= 0 or not self._beacons:
+            return []
+        cx, cy = self._cell(x, y)
+        if self._beacon_cell_bounds is None:
+            occupied = np.array(list(self._beacon_cells.keys()))
+            self._beacon_cell_bounds = (*occupied.min(axis=0).tolist(), *occupied.max(axis=0).tolist())
+        min_cx, min_cy, max_cx, max_cy = self._beacon_cell_bounds
+        max_ring = max(abs(cx - min_cx), abs(cx - max_cx), abs(cy - min_cy), abs(cy - max_cy)) # No beacons beyond this ring
+        if max_distance is not None:
+            max_ring = min(max_ring, int(math.ceil(max_distance / self.cell_size)) + 1)
+
+        ids: List[int] = []
+        best: List[Tuple[float, int]] = []
+        for ring in range(max_ring + 1):
+            for gx in range(cx - ring, cx + ring + 1):
+                for gy in ((cy - ring, cy + ring) if abs(gx - cx) != ring else range(cy - ring, cy + ring + 1)):
+                    ids.extend(self._beacon_cells.get((gx, gy), ()))
+            if len(ids) >= k:
+                xy = np.array([self._beacon_xy[i] for i in ids])
+                dist = np.hypot(xy[:, 0] - x, xy[:, 1] - y)
+                order = np.argsort(dist, kind='stable')[:k]
+                best = [(float(dist[i]), ids[i]) for i in order]
+                # Every beacon outside the visited rings is at least ring * cell_size away
+                if best[-1][0] <= ring * self.cell_size:
+                    break
+        if len(best) < k and ids: # Fewer than k beacons within reach
+            xy = np.array([self._beacon_xy[i] for i in ids])
+            dist = np.hypot(xy[:, 0] - x, xy[:, 1] - y)
+            best = [(float(dist[i]), ids[i]) for i in np.argsort(dist, kind='stable')[:k]]
+        if max_distance is not None:
+            best = [b for b in best if b[0] <= max_distance]
+        return [(self._beacons[i][0], d) for d, i in best]
+
+    # --- Configuration ---
+    def update_from_config(self, config: Optional[WebUIConfig]) -> Tuple[int, int]:
+        """Incrementally syncs the index with a (new) Web UI configuration. Returns total (added, removed)."""
+        entities = config.map.entities if config and config.map else []
+        beacons = config.beacons if config else []
+        added_e, removed_e = self.set_entities(entities)
+        added_b, removed_b = self.set_beacons(beacons)
+        return added_e + added_b, removed_e + removed_b
@@ -0,0 +1,231 @@
+# server/state_snapshot.py
+"""
+Crash-safe binary snapshot of tracker state (positions, histories, Kalman x / P).
+
+File layout (little endian, all sections 8-byte aligned):
+
+    header   magic "IPSSNAP1", version u32, tracker count u32, created (Unix ms) i64,
+             index offset u64, CRC-32 of everything after the header u32, padding
+    records  per tracker: id length u16 + UTF-8 id, floor id length u16 + UTF-8 floor id
+             (padded); x, y f64 (NaN = unknown), last update / last measurement
+             time i64 (-1 = unknown), has-Kalman u8;
+             Kalman x (4 f64) and P (16 f64) if present; history length u32 and
+             last-beacons JSON length u32; history as three columns x f64[n], y f64[n],
+             t i64[n]; last-beacons JSON (padded)
+    index    record offsets u64[count]
+
+Version 1 files (written before floors existed) have no floor id in the record;
+they are still read, with floorId None, and the next write upgrades the file.
+
+Records are re-encoded only for trackers whose TrackerState object changed since
+the previous snapshot (states are replaced, never mutated, on every update); the
+file itself is rewritten from the cached records into a temp file and renamed
+over the old one, so a crash leaves either the old or the new snapshot. Restore
+memory-maps the file and reads the history columns with np.frombuffer.
+"""
+import itertools
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from .models import DetectedBeacon, TrackerState
+
+MAGIC = b"IPSSNAP1"
+FORMAT_VERSION = 2
+READABLE_VERSIONS = (1, 2)
+_HEADER = struct.Struct("<8sIIqQI4x") # 40 bytes
+_FIXED = struct.Struct("<ddqqB7x") # 40 bytes
+_COUNTS = struct.Struct("<II")
+
+class SnapshotError(ValueError):
+    """The snapshot file is missing, truncated, corrupt or of another format version."""
+
+class RestoredTracker(NamedTuple):
+    state: TrackerState
+    kalman_x: Optional[np.ndarray] # (4, 1), None if the tracker had no Kalman filter
+    kalman_P: Optional[np.ndarray] # (4, 4)
+
+def _pad8(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 8)
+
+def encode_record(state: TrackerState, kalman_x: Optional[np.ndarray], kalman_P: Optional[np.ndarray]) -> bytes:
+    """One tracker's record (see module docstring)."""
+    tracker_id = state.trackerId.encode("utf-8")
+    floor_id = (state.floorId or "").encode("utf-8")
+    history = state.position_history
+    # fromiter over the flattened tuples is about twice as fast as np.asarray on a list of tuples
+    history = np.fromiter(itertools.chain.from_iterable(history), dtype=np.float64, count=3 * len(history)).reshape(-1, 3)
+    beacons = json.dumps([b.model_dump() for b in state.last_detected_beacons]).encode("utf-8")
+    parts = [
+        _pad8(struct.pack("<H", len(tracker_id)) + tracker_id + struct.pack("<H", len(floor_id)) + floor_id),
+        _FIXED.pack(
+            state.x if state.x is not None else float("nan"),
+            state.y if state.y is not None else float("nan"),
+            state.last_update_time,
+            state.last_known_measurement_time if state.last_known_measurement_time is not None else -1,
+            kalman_x is not None,
+        ),
+    ]
+    if kalman_x is not None:
+        parts.append(np.ascontiguousarray(kalman_x, dtype="<f8").tobytes() + np.ascontiguousarray(kalman_P, dtype="<f8").tobytes())
+    parts.append(_COUNTS.pack(len(history), len(beacons)))
+    parts.append(np.ascontiguousarray(history[:, 0], dtype="<f8").tobytes())
+    parts.append(np.ascontiguousarray(history[:, 1], dtype="<f8").tobytes())
+    parts.append(history[:, 2].astype("<i8").tobytes())
+    parts.append(_pad8(beacons))
+    return b"".join(parts)
+
+
+class StateSnapshotter:
+    """Keeps the encoded record of every tracker and writes snapshot files from them."""
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._records: Dict[str, Tuple[TrackerState, bytes]] = {} # tracker -> (state encoded, record)
+        self.last_write: Dict[str, Any] = {}
+        self._lock = threading.Lock() # A cancelled periodic write may still be running when the final one starts
+
+    @staticmethod
+    def capture(tracker_states: Dict[str, TrackerState], filters: Dict[str, Any]) -> List[Tuple[TrackerState, Optional[np.ndarray], Optional[np.ndarray]]]:
+        """
+        Takes references to the current states and Kalman arrays. Must run on the
+        event loop; it copies nothing, since states and filter arrays are replaced,
+        not mutated, by updates.
+        """
+        captured = []
+        for tracker_id, state in list(tracker_states.items()):
+            kf = filters.get(tracker_id)
+            if kf is not None and hasattr(kf, "P"): # Kalman filter; particle filters are re-created on restore
+                captured.append((state, kf.x, kf.P))
+            else:
+                captured.append((state, None, None))
+        return captured
+
+    def write(self, captured: List[Tuple[TrackerState, Optional[np.ndarray], Optional[np.ndarray]]]) -> Dict[str, Any]:
+        """
+        Encodes the changed trackers and atomically replaces the snapshot file; nothing
+        is written if no tracker changed. Blocking: run in a worker thread.
+        """
+        with self._lock:
+            return self._write(captured)
+
+    def _write(self, captured) -> Dict[str, Any]:
+        started = time.perf_counter()
+        encoded = 0
+        records: Dict[str, Tuple[TrackerState, bytes]] = {}
+        for state, kalman_x, kalman_P in captured:
+            cached = self._records.get(state.trackerId)
+            if cached is None or cached[0] is not state:
+                cached = (state, encode_record(state, kalman_x, kalman_P))
+                encoded += 1
+            records[state.trackerId] = cached
+        unchanged = encoded == 0 and records.keys() == self._records.keys() and self.path.exists()
+        self._records = records # Trackers that disappeared are dropped
+        if unchanged:
+            return self.last_write
+
+        offsets, position = [], _HEADER.size
+        for _, record in records.values():
+            offsets.append(position)
+            position += len(record)
+        index = np.asarray(offsets, dtype="<u8").tobytes()
+        crc = 0
+        for _, record in records.values():
+            crc = zlib.crc32(record, crc)
+        crc = zlib.crc32(index, crc)
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(records), int(time.time() * 1000), position, crc)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                for _, record in records.values():
+                    f.write(record)
+                f.write(index)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.last_write = {
+            "trackers": len(records),
+            "encoded": encoded,
+            "bytes": position + len(index),
+            "durationMs": round((time.perf_counter() - started) * 1000, 2),
+            "time": int(time.time() * 1000),
+        }
+        return self.last_write
+
+
+def read_snapshot(path: Union[str, Path]) -> Tuple[int, List[RestoredTracker]]:
+    """Memory-maps a snapshot file; returns (created Unix ms, trackers). Raises SnapshotError."""
+    try:
+        f = open(path, "rb")
+    except OSError as e:
+        raise SnapshotError(f"Cannot open snapshot {path}: {e}") from e
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _HEADER.size:
+            raise SnapshotError(f"Snapshot {path} is truncated ({size} bytes)")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, count, created_ms, index_offset, crc = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version not in READABLE_VERSIONS:
+                raise SnapshotError(f"Snapshot {path} has an unknown format ({magic!r}, version {version})")
+            if index_offset + 8 * count != size:
+                raise SnapshotError(f"Snapshot {path} is truncated")
+            with memoryview(mm) as view, view[_HEADER.size:] as body:
+                if zlib.crc32(body) != crc:
+                    raise SnapshotError(f"Snapshot {path} failed its checksum")
+            offsets = np.frombuffer(mm, dtype="<u8", count=count, offset=index_offset).tolist()
+            trackers = [_read_record(mm, offset, version) for offset in offsets]
+    return created_ms, trackers
+
+def _read_record(mm: mmap.mmap, offset: int, version: int = FORMAT_VERSION) -> RestoredTracker:
+    (id_length,) = struct.unpack_from("<H", mm, offset)
+    tracker_id = bytes(mm[offset + 2:offset + 2 + id_length]).decode("utf-8")
+    ids_length = 2 + id_length
+    floor_id = ""
+    if version >= 2:
+        floor_offset = offset + ids_length
+        (floor_length,) = struct.unpack_from("<H", mm, floor_offset)
+        floor_id = bytes(mm[floor_offset + 2:floor_offset + 2 + floor_length]).decode("utf-8")
+        ids_length += 2 + floor_length
+    offset += ids_length + (-ids_length % 8)
+    x, y, last_update, last_measurement, has_kalman = _FIXED.unpack_from(mm, offset)
+    offset += _FIXED.size
+    kalman_x = kalman_P = None
+    if has_kalman:
+        kalman = np.frombuffer(mm, dtype="<f8", count=20, offset=offset).copy()
+        kalman_x, kalman_P = kalman[:4].reshape(4, 1), kalman[4:].reshape(4, 4)
+        offset += 160
+    history_length, beacons_length = _COUNTS.unpack_from(mm, offset)
+    offset += _COUNTS.size
+    xs = np.frombuffer(mm, dtype="<f8", count=history_length, offset=offset).tolist()
+    ys = np.frombuffer(mm, dtype="<f8", count=history_length, offset=offset + 8 * history_length).tolist()
+    ts = np.frombuffer(mm, dtype="<i8", count=history_length, offset=offset + 16 * history_length).tolist()
+    offset += 24 * history_length
+    beacons = json.loads(bytes(mm[offset:offset + beacons_length])) if beacons_length else []
+    # The record was encoded from a validated TrackerState and passed the checksum;
+    # re-validating every history tuple would dominate restore time
+    state = TrackerState.model_construct(
+        trackerId=tracker_id,
+        x=None if np.isnan(x) else x,
+        y=None if np.isnan(y) else y,
+        last_update_time=last_update,
+        last_known_measurement_time=None if last_measurement < 0 else last_measurement,
+        last_detected_beacons=[DetectedBeacon(**b) for b in beacons],
+        position_history=list(zip(xs, ys, ts)),
+        floorId=floor_id or None,
+    )
+    return RestoredTracker(state, kalman_x, kalman_P)
@@ -0,0 +1,250 @@
+# server/trajectory.py
+"""
+Simplified tracker trails at several levels of detail (LOD).
+
+position_history holds one point per report; drawn at building scale, most of
+them are sub-pixel detail. Level k (1..len(tolerances)) keeps a subset of the
+raw points such that every dropped point lies within tolerances[k-1] meters of
+the kept polyline; level 0 is the raw history. Each tracker's simplification is
+kept up to date incrementally: a report appends one point to the history, which
+costs one opening-window step per level (the dropped points after the last kept
+"anchor" are checked against the segment anchor -> new point). Points aging out
+of the history window are trimmed from the front, a late point rewinds the
+level to its last anchor before it, and any other change (floor change,
+snapshot restore) rebuilds the level with Douglas-Peucker. Levels are only
+computed when a consumer asks for them.
+"""
+import bisect
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+Point = Tuple[float, float, int] # (x, y, timestamp_ms)
+
+DEFAULT_TOLERANCES = (0.25, 1.0, 4.0) # Meters, levels 1..3
+MAX_WINDOW_POINTS = 256 # Dropped points between two kept ones at most (bounds the per-append check)
+
+# --- Geometry ---
+def _segment_distances(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Distances of points (n x 2) to the segment a-b."""
+    ab = b - a
+    d = points - a
+    length_sq = float(ab @ ab)
+    if length_sq > 0.0:
+        t = np.minimum(np.maximum(d @ (ab / length_sq), 0.0), 1.0) # Called per report: ufuncs, not np.clip
+        d -= t[:, None] * ab
+    return np.sqrt(np.einsum("ij,ij->i", d, d))
+
+def douglas_peucker(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """Sorted indices of the points Douglas-Peucker keeps (always the first and last)."""
+    n = len(xy)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        distances = _segment_distances(xy[i + 1:j], xy[i], xy[j])
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return np.flatnonzero(keep)
+
+
+# --- Incremental simplification ---
+def _diff(previous: List[Point], history: List[Point]) -> Optional[Tuple[int, int]]:
+    """
+    (points dropped at the front of previous, length of the prefix of history that
+    follows them unchanged), or None if history is not previous trimmed at the front
+    and extended or with points inserted.
+    """
+    if not previous or not history:
+        return None
+    dropped = bisect.bisect_left(previous, history[0][2], key=lambda p: p[2])
+    if dropped >= len(previous) or history[0] != previous[dropped]:
+        return None
+    remaining = len(previous) - dropped
+    overlap = min(remaining, len(history))
+    if history[overlap - 1] == previous[dropped + overlap - 1]:
+        return (dropped, overlap) if overlap == remaining else None # Else points were removed at the end
+    return dropped, next(i for i in range(overlap) if history[i] != previous[dropped + i])
+
+def _index_of(history: List[Point], point: Point) -> int:
+    """Position of point in history (-1 if absent)."""
+    i = bisect.bisect_left(history, point[2], key=lambda p: p[2])
+    while i < len(history) and history[i][2] == point[2]:
+        if history[i] == point:
+            return i
+        i += 1
+    return -1
+
+
+def _coordinates(points: Sequence[Point]) -> np.ndarray:
+    return np.array([(p[0], p[1]) for p in points], dtype=float).reshape(-1, 2)
+
+
+class _Level:
+    """One level of one trail: the kept points, except the history's last point (always the polyline's end)."""
+    __slots__ = ("kept", "output")
+
+    def __init__(self, kept: List[Point]):
+        self.kept = kept # The last one is the "anchor" of the opening window
+        self.output: Optional[List[Point]] = None
+
+    def result(self, history: List[Point]) -> List[Point]:
+        if self.output is None:
+            self.output = self.kept + [history[-1]] if history[-1] != self.kept[-1] else list(self.kept)
+        return self.output
+
+
+class _Trail:
+    __slots__ = ("source", "xy", "levels")
+
+    def __init__(self, levels: int):
+        self.source: List[Point] = [] # History the levels were computed from
+        self.xy = np.empty((0, 2)) # Its coordinates
+        self.levels: List[Optional[_Level]] = [None] * levels
+
+
+class TrajectoryCache:
+    """Per-tracker simplified trails; simplified() brings the requested level up to date with a history."""
+    def __init__(self, tolerances: Sequence[float] = DEFAULT_TOLERANCES, max_window: int = MAX_WINDOW_POINTS):
+        self.tolerances = tuple(float(t) for t in tolerances)
+        self.max_window = int(max_window)
+        self._trails: Dict[str, _Trail] = {}
+        self.counters = {"appended": 0, "trimmed": 0, "rewound": 0, "rebuilt": 0}
+
+    def configure(self, tolerances: Sequence[float], max_window: int):
+        tolerances = tuple(float(t) for t in tolerances)
+        if tolerances != self.tolerances or int(max_window) != self.max_window:
+            self.tolerances = tolerances
+            self.max_window = int(max_window)
+            self._trails.clear()
+
+    @property
+    def max_lod(self) -> int:
+        return len(self.tolerances)
+
+    def simplified(self, tracker_id: str, history: List[Point], lod: int) -> List[Point]:
+        """
+        The history at level lod (clamped to max_lod; 0 returns history itself).
+        history must be the complete, timestamp-sorted position_history of the
+        tracker; it is referenced, not copied, so it must not be mutated afterwards.
+        """
+        lod = min(lod, self.max_lod)
+        if lod <= 0 or len(history) <= 2:
+            return history
+        trail = self._trails.get(tracker_id)
+        if trail is None:
+            trail = self._trails[tracker_id] = _Trail(self.max_lod)
+        if trail.source is not history:
+            self._sync(trail, history)
+        level = trail.levels[lod - 1]
+        if level is None:
+            level = trail.levels[lod - 1] = self._rebuild(history, trail.xy, self.tolerances[lod - 1])
+        return level.result(history)
+
+    def _sync(self, trail: _Trail, history: List[Point]):
+        # Each report builds a new history list (TrackerState validation copies the points): compare by value
+        previous = trail.source
+        trail.source = history
+        change = _diff(previous, history)
+        if change is None:
+            trail.xy = _coordinates(history)
+            trail.levels = [None] * self.max_lod # Rebuilt when next requested
+            return
+        dropped, common = change
+        appended = common == len(previous) - dropped
+        if appended:
+            trail.xy = np.concatenate([trail.xy[dropped:], _coordinates(history[common:])])
+        else:
+            trail.xy = _coordinates(history)
+        for index, level in enumerate(trail.levels):
+            if level is not None:
+                trail.levels[index] = self._update(level, history, trail.xy, dropped, common, appended, self.tolerances[index])
+
+    def _update(self, level: _Level, history: List[Point], xy: np.ndarray, dropped: int, common: int, appended: bool,
+                tolerance: float) -> _Level:
+        level.output = None
+        if dropped and not self._trim(level, history, xy, tolerance):
+            return self._rebuild(history, xy, tolerance)
+        start = common
+        if not appended:
+            start = self._rewind(level, history, common)
+            if start < 0:
+                return self._rebuild(history, xy, tolerance)
+        self._extend(level, history, xy, start, tolerance)
+        self.counters["appended"] += len(history) - start
+        return level
+
+    def _trim(self, level: _Level, history: List[Point], xy: np.ndarray, tolerance: float) -> bool:
+        """Drops kept points older than history[0]; False if the level has to be rebuilt."""
+        first = history[0]
+        kept = level.kept
+        cut = bisect.bisect_left(kept, first[2], key=lambda p: p[2])
+        if cut == 0:
+            return True
+        if cut >= len(kept):
+            return False # The anchor aged out
+        del kept[:cut]
+        if kept[0] != first:
+            # The raw points up to the new first kept point are re-simplified on their own
+            end = _index_of(history, kept[0])
+            if end < 0:
+                return False
+            kept[:0] = [history[i] for i in douglas_peucker(xy[:end + 1], tolerance)[:-1]]
+        self.counters["trimmed"] += 1
+        return True
+
+    def _rewind(self, level: _Level, history: List[Point], common: int) -> int:
+        """
+        Backs the level up to its last kept point before history[common] (where a
+        late point was inserted); returns the history index to continue from, or -1.
+        """
+        kept = level.kept
+        del kept[bisect.bisect_left(kept, history[common][2], key=lambda p: p[2]):]
+        if not kept:
+            return -1
+        anchor = _index_of(history, kept[-1])
+        if anchor < 0 or anchor >= common:
+            return -1
+        self.counters["rewound"] += 1
+        return anchor + 1
+
+    def _extend(self, level: _Level, history: List[Point], xy: np.ndarray, start: int, tolerance: float):
+        """Opening-window steps for history[start:]: the points after the anchor must stay within tolerance of anchor -> point."""
+        kept = level.kept
+        anchor = _index_of(history, kept[-1])
+        for j in range(max(start, anchor + 1), len(history)):
+            if j - anchor > 1 and (j - anchor - 1 >= self.max_window or
+                                   _segment_distances(xy[anchor + 1:j], xy[anchor], xy[j]).max() > tolerance):
+                anchor = j - 1 # The previous end point becomes the new anchor
+                kept.append(history[anchor])
+
+    def _rebuild(self, history: List[Point], xy: np.ndarray, tolerance: float) -> _Level:
+        self.counters["rebuilt"] += 1
+        return _Level([history[i] for i in douglas_peucker(xy, tolerance)[:-1]] or history[:1])
+
+    def metrics(self) -> dict:
+        raw = 0
+        kept = [0] * self.max_lod
+        for trail in self._trails.values():
+            raw += len(trail.source)
+            for index, level in enumerate(trail.levels):
+                kept[index] += len(level.result(trail.source)) if level is not None else 0
+        return {
+            **self.counters,
+            "trackers": len(self._trails),
+            "tolerancesMeters": list(self.tolerances),
+            "rawPoints": raw,
+            "pointsPerLevel": kept, # Only trackers whose level was requested count
+        }
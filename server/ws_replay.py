@@ -0,0 +1,76 @@
+# server/ws_replay.py
+"""
+Replay buffer of recent WebSocket broadcasts, for resuming dropped sessions.
+
+Every broadcast gets the next global sequence number and its serialized text is
+kept here, bounded by message count, total bytes and age. A client that
+reconnects with /ws?resume_from=N is sent the buffered messages after N (only
+those of its floors); if some of them were already evicted, since() returns
+None and the caller falls back to a snapshot of the current state. Messages sent
+to clients with a history level of detail are kept alongside (variants by LOD),
+so a resumed client is replayed what it would have received.
+"""
+import itertools
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+def _size(message: str, variants: Optional[Dict[int, str]]) -> int:
+    return len(message) + (sum(len(v) for v in variants.values()) if variants else 0)
+
+
+class ReplayBuffer:
+    """Recent (seq, floor id, message) entries; seqs are consecutive, so lookup by seq is an index computation."""
+    def __init__(self, max_messages: int = 10_000, max_bytes: int = 64 << 20, max_age_seconds: float = 300.0):
+        self.max_messages = int(max_messages)
+        self.max_bytes = int(max_bytes)
+        self.max_age = float(max_age_seconds)
+        self._entries: Deque[Tuple[int, Optional[str], str, float, Optional[Dict[int, str]]]] = deque() # (seq, floor_id, message, monotonic time, variants)
+        self._bytes = 0
+        self.counters = {"resumed": 0, "replayed": 0, "snapshots": 0}
+
+    def configure(self, max_messages: int, max_bytes: int, max_age_seconds: float):
+        self.max_messages = int(max_messages)
+        self.max_bytes = int(max_bytes)
+        self.max_age = float(max_age_seconds)
+        self._evict(time.monotonic())
+
+    def append(self, seq: int, floor_id: Optional[str], message: str, variants: Optional[Dict[int, str]] = None):
+        now = time.monotonic()
+        self._entries.append((seq, floor_id, message, now, variants))
+        self._bytes += _size(message, variants)
+        self._evict(now)
+
+    def _evict(self, now: float):
+        entries = self._entries
+        while entries and (len(entries) > self.max_messages or self._bytes > self.max_bytes or now - entries[0][3] > self.max_age):
+            entry = entries.popleft()
+            self._bytes -= _size(entry[2], entry[4])
+
+    def since(self, seq: int, current_seq: int, floors: Optional[Set[str]] = None, lod: int = 0) -> Optional[List[Tuple[int, str]]]:
+        """
+        (seq, message) of the broadcasts after seq that a client subscribed to floors
+        would have received, or None if some of them are no longer buffered (or seq
+        is not a sequence number of this server run).
+        """
+        if seq < 0 or seq > current_seq:
+            return None
+        if seq == current_seq:
+            return []
+        self._evict(time.monotonic())
+        entries = self._entries
+        if not entries or entries[0][0] > seq + 1:
+            return None
+        start = seq + 1 - entries[0][0]
+        return [(s, variants.get(lod, message) if variants else message)
+                for s, floor_id, message, _, variants in itertools.islice(entries, start, None)
+                if floor_id is None or floors is None or floor_id in floors]
+
+    def metrics(self) -> dict:
+        return {
+            **self.counters,
+            "messages": len(self._entries),
+            "bytes": self._bytes,
+            "oldestSeq": self._entries[0][0] if self._entries else None,
+            "newestSeq": self._entries[-1][0] if self._entries else None,
+        }
@@ -0,0 +1,66 @@
+# test/test_batch_ingest.py
+"""Streaming NDJSON / gzip parsing of bulk report uploads (server/batch_ingest.py)."""
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from server import batch_ingest
+from server.batch_ingest import BatchStreamError, BatchTooLargeError, iter_ndjson_lines
+
+def _lines(n: int, start: int = 0) -> bytes:
+    return b"".join(json.dumps({"trackerId": "t", "timestamp": start + i, "detectedBeacons": []}).encode() + b"\n"
+                    for i in range(n))
+
+def _read(body: bytes, gzipped: bool, chunk_size: int = 7):
+    async def chunks():
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i + chunk_size]
+
+    async def collect():
+        return [item async for item in iter_ndjson_lines(chunks(), gzipped)]
+    return asyncio.run(collect())
+
+def _timestamps(items):
+    return [json.loads(line)["timestamp"] for _, line in items]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_plain_and_gzip_give_the_same_lines(chunk_size):
+    body = _lines(50) + b"\n  \n" + b'{"trackerId": "t", "timestamp": 99, "detectedBeacons": []}' # Blank lines, no final newline
+    plain = _read(body, False, chunk_size)
+    assert plain == _read(gzip.compress(body), True, chunk_size)
+    assert _timestamps(plain) == list(range(50)) + [99]
+    assert plain[-1][0] == 53 # Line numbers count the blank lines
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 16])
+def test_concatenated_gzip_members(chunk_size):
+    body = gzip.compress(_lines(20)) + gzip.compress(_lines(30, 20)) + gzip.compress(b"") + gzip.compress(_lines(5, 50))
+    assert _timestamps(_read(body, True, chunk_size)) == list(range(55))
+
+def test_truncated_gzip():
+    body = gzip.compress(_lines(20)) + gzip.compress(_lines(20))[:-10]
+    with pytest.raises(BatchStreamError, match="Truncated"):
+        _read(body, True)
+
+def test_trailing_garbage_after_gzip_member():
+    with pytest.raises(BatchStreamError, match="Invalid gzip"):
+        _read(gzip.compress(_lines(3)) + b"not gzip", True)
+
+def test_highly_compressed_body_is_inflated_in_bounded_steps(monkeypatch):
+    monkeypatch.setattr(batch_ingest, "DECOMPRESS_CHUNK_BYTES", 4096)
+    body = _lines(5000) # About 350 kB from a few kB of gzip
+    items = _read(gzip.compress(body), True, 1 << 16)
+    assert _timestamps(items) == list(range(5000))
+
+def test_body_over_limit(monkeypatch):
+    monkeypatch.setattr(batch_ingest, "MAX_BODY_BYTES", 1000)
+    with pytest.raises(BatchTooLargeError):
+        _read(gzip.compress(_lines(100)), True)
+
+def test_over_long_line_is_skipped(monkeypatch):
+    monkeypatch.setattr(batch_ingest, "MAX_LINE_BYTES", 100)
+    body = _lines(1) + b"x" * 500 + b"\n" + _lines(1, 1)
+    items = _read(body, False)
+    assert [line is None for _, line in items] == [False, True, False]
@@ -0,0 +1,113 @@
+# test/test_state_snapshot.py
+"""Round trips of the binary tracker state snapshot (server/state_snapshot.py)."""
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from server.models import DetectedBeacon, TrackerState
+from server.state_snapshot import _HEADER, _pad8, MAGIC, SnapshotError, StateSnapshotter, encode_record, read_snapshot
+
+def _state(tracker_id: str, floor_id=None, points: int = 5, **kwargs) -> TrackerState:
+    history = [(1.5 * i, -0.25 * i, 1_700_000_000_000 + 1000 * i) for i in range(points)]
+    fields = dict(
+        trackerId=tracker_id, x=3.25, y=-1.0, last_update_time=1_700_000_010_000,
+        last_known_measurement_time=1_700_000_009_500,
+        last_detected_beacons=[DetectedBeacon(macAddress="C3:00:00:3E:7D:EF", major=1, minor=2, rssi=-71)],
+        position_history=history, floorId=floor_id,
+    )
+    fields.update(kwargs)
+    return TrackerState(**fields)
+
+def _kalman(seed: int):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(4, 1)), rng.normal(size=(4, 4))
+
+def _write_v1(path, records):
+    """A snapshot in the version 1 layout: the record's id block has no floor id."""
+    body = b"".join(records)
+    offsets, position = [], _HEADER.size
+    for record in records:
+        offsets.append(position)
+        position += len(record)
+    index = np.asarray(offsets, dtype="<u8").tobytes()
+    crc = zlib.crc32(index, zlib.crc32(body))
+    path.write_bytes(_HEADER.pack(MAGIC, 1, len(records), 1_700_000_020_000, position, crc) + body + index)
+
+def _encode_v1(state: TrackerState, kalman_x=None, kalman_P=None) -> bytes:
+    record = encode_record(state, kalman_x, kalman_P)
+    tracker_id = state.trackerId.encode("utf-8")
+    floor_id = (state.floorId or "").encode("utf-8")
+    v2_ids = len(_pad8(struct.pack("<H", len(tracker_id)) + tracker_id + struct.pack("<H", len(floor_id)) + floor_id))
+    return _pad8(struct.pack("<H", len(tracker_id)) + tracker_id) + record[v2_ids:]
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "snapshot.bin"
+    kalman_x, kalman_P = _kalman(1)
+    states = [
+        _state("tracker-a", floor_id="level-2"),
+        _state("tracker-ü", points=0, x=None, y=None, last_known_measurement_time=None, last_detected_beacons=[]),
+    ]
+    write = StateSnapshotter(path).write([(states[0], kalman_x, kalman_P), (states[1], None, None)])
+    assert write["trackers"] == 2 and write["encoded"] == 2 and write["bytes"] == path.stat().st_size
+
+    created_ms, trackers = read_snapshot(path)
+    assert created_ms == pytest.approx(write["time"], abs=5000)
+    assert [t.state for t in trackers] == states
+    np.testing.assert_array_equal(trackers[0].kalman_x, kalman_x)
+    np.testing.assert_array_equal(trackers[0].kalman_P, kalman_P)
+    assert trackers[1].kalman_x is None and trackers[1].kalman_P is None
+
+def test_rewrite_reencodes_only_changed_trackers(tmp_path):
+    path = tmp_path / "snapshot.bin"
+    snapshotter = StateSnapshotter(path)
+    a, b = _state("a"), _state("b")
+    snapshotter.write([(a, None, None), (b, None, None)])
+    b = b.model_copy(update={"x": 9.0})
+    assert snapshotter.write([(a, None, None), (b, None, None)])["encoded"] == 1
+    assert [t.state.x for t in read_snapshot(path)[1]] == [3.25, 9.0]
+    snapshotter.write([(b, None, None)]) # a disappeared
+    assert [t.state.trackerId for t in read_snapshot(path)[1]] == ["b"]
+
+def test_corrupted_byte_fails_checksum(tmp_path):
+    path = tmp_path / "snapshot.bin"
+    StateSnapshotter(path).write([(_state("a", points=50), *_kalman(2))])
+    data = bytearray(path.read_bytes())
+    data[_HEADER.size + 100] ^= 0x01
+    path.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError, match="checksum"):
+        read_snapshot(path)
+
+@pytest.mark.parametrize("size", [0, _HEADER.size - 1, _HEADER.size + 7])
+def test_truncated(tmp_path, size):
+    path = tmp_path / "snapshot.bin"
+    StateSnapshotter(path).write([(_state("a"), None, None)])
+    path.write_bytes(path.read_bytes()[:size])
+    with pytest.raises(SnapshotError, match="truncated"):
+        read_snapshot(path)
+
+def test_unknown_version(tmp_path):
+    path = tmp_path / "snapshot.bin"
+    StateSnapshotter(path).write([(_state("a"), None, None)])
+    data = bytearray(path.read_bytes())
+    struct.pack_into("<I", data, 8, 99)
+    path.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError, match="version 99"):
+        read_snapshot(path)
+
+def test_v1_file_is_read_and_upgraded(tmp_path):
+    path = tmp_path / "snapshot.bin"
+    kalman_x, kalman_P = _kalman(3)
+    states = [_state("tracker-a"), _state("b", points=0)]
+    _write_v1(path, [_encode_v1(states[0], kalman_x, kalman_P), _encode_v1(states[1])])
+
+    created_ms, trackers = read_snapshot(path)
+    assert created_ms == 1_700_000_020_000
+    assert [t.state for t in trackers] == states # No floor id in v1: floorId None
+    np.testing.assert_array_equal(trackers[0].kalman_P, kalman_P)
+
+    StateSnapshotter(path).write([(t.state, t.kalman_x, t.kalman_P) for t in trackers])
+    assert _HEADER.unpack_from(path.read_bytes())[1] == 2
+    assert [t.state for t in read_snapshot(path)[1]] == states